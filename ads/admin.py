@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Ad, ExchangeProposal, Notification
+from .models import Ad, ExchangeProposal, Notification, Wish
 
 
 @admin.register(Ad)
@@ -16,6 +16,12 @@ class ExchangeProposalAdmin(admin.ModelAdmin):
     search_fields = ('comment',)
 
 
+@admin.register(Wish)
+class WishAdmin(admin.ModelAdmin):
+    list_display = ('user', 'category', 'condition', 'created_at')
+    list_filter = ('category', 'condition')
+
+
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ('user', 'message_preview', 'is_read', 'created_at')
@@ -1,11 +1,22 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from ads.api_views import AdViewSet, ExchangeProposalViewSet
+from ads.api_views import AdViewSet, ExchangeProposalViewSet, WishViewSet
 
 router = DefaultRouter()
 router.register(r'ads', AdViewSet)
 router.register(r'proposals', ExchangeProposalViewSet)
+router.register(r'wishes', WishViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+if settings.ADS_ASYNC_VIEWS:
+    from ads import async_views
+
+    # GET в JSON — асинхронно, остальное уходит в AdViewSet (см. async_views.with_sync_fallback)
+    urlpatterns = [
+        path('ads/', async_views.api_ad_list, name='ad-list'),
+        path('ads/<int:pk>/', async_views.api_ad_detail, name='ad-detail'),
+    ] + urlpatterns
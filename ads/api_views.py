@@ -1,11 +1,21 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 
 from ads import serializers
-from ads.models import Ad, ExchangeProposal, Notification
-from ads.serializers import AdSerializer, ExchangeProposalSerializer
+from ads.facets import get_facets
+from ads.http_cache import ad_versions, make_etag, not_modified, set_validators
+from ads.matching import get_matching_graph
+from ads.models import Ad, ExchangeProposal, Wish
+from ads.pagination import KeysetPagination
+from ads.search import filter_ads
+from ads.serializers import AdSerializer, AdValuesSerializer, ExchangeProposalSerializer, WishSerializer, sparse_fields
+from ads.services import ProposalError, bulk_create_ads, decide_proposal, proposal_mailbox, validate_ads
+from ads.suggestions import suggest_ads
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -19,6 +29,32 @@ class AdViewSet(viewsets.ModelViewSet):
     queryset = Ad.objects.filter(is_active=True)
     serializer_class = AdSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        # Страница всегда keyset-пагинируется; 304, если версии объявлений на ней не изменились.
+        # Строки читаются через .values() и сериализуются AdValuesSerializer, без экземпляров моделей.
+        fields = self.get_fieldset()
+        page = self.paginate_queryset(AdValuesSerializer.values(self.filter_queryset(self.get_queryset()), fields))
+        etag = make_etag('ad-list', request.accepted_renderer.format, request.get_full_path(), ad_versions(page))
+        response = not_modified(request, etag)
+        if response is None:
+            response = self.get_paginated_response(AdValuesSerializer(page, fields).data)
+        return set_validators(response, etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        ad = self.get_object()
+        fields = self.get_fieldset()
+        parts = [ad_versions([ad])]
+        if fields is None or 'user' in fields:
+            parts.append(ad.user.username)
+        if fields is not None:
+            parts.append(fields)
+        etag = make_etag('ad-detail', request.accepted_renderer.format, *parts)
+        response = not_modified(request, etag, ad.updated_at)
+        if response is None:
+            response = Response(self.get_serializer(ad).data)
+        return set_validators(response, etag, ad.updated_at)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)  # Сохраняем объявление с текущим пользователем
@@ -27,20 +63,56 @@ class AdViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        query = self.request.query_params.get('q')
-        category = self.request.query_params.get('category')
-        condition = self.request.query_params.get('condition')
+    def get_fieldset(self):
+        """Поля ответа из ?fields=/?omit= для list и retrieve; None — все поля."""
+        if self.action not in ('list', 'retrieve') or self.request.method not in permissions.SAFE_METHODS:
+            return None  # формы Browsable API и ответы на запись — всегда полные
+        return sparse_fields(self.request.query_params, AdSerializer.Meta.fields)
 
-        if query:
-            queryset = queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
-        if category:
-            queryset = queryset.filter(category=category)
-        if condition:
-            queryset = queryset.filter(condition=condition)
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_fieldset()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
 
-        return queryset.order_by('-created_at')
+    def get_queryset(self):
+        queryset = filter_ads(super().get_queryset(), self.request.query_params)
+        fields = self.get_fieldset()
+        if fields is None:
+            return queryset.select_related('user')
+        # Только колонки запрошенных полей; id, created_at и updated_at нужны пагинации и ETag
+        serializer_fields = AdSerializer().fields
+        columns = {'id', 'created_at', 'updated_at', *(serializer_fields[name].source for name in fields)}
+        if 'user' in fields:
+            queryset = queryset.select_related('user')
+            columns.add('user__username')
+        return queryset.only(*columns)
+
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk', permission_classes=[permissions.IsAuthenticated])
+    def bulk_create(self, request):
+        """Создаёт пачку объявлений одной транзакцией; ошибочные элементы пропускаются."""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({"error": "Ожидается список объявлений."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.ADS_BULK_MAX_ITEMS:
+            return Response({"error": f"Не больше {settings.ADS_BULK_MAX_ITEMS} объявлений за запрос."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        valid, errors = validate_ads(items)
+        indexes = [index for index, _ in valid]
+        ads = bulk_create_ads([(data, request.user) for _, data in valid])
+        body = {
+            'created': [
+                {'index': index, **ad} for index, ad in zip(indexes, AdSerializer(ads, many=True).data)
+            ],
+            'errors': [{'index': index, 'errors': detail} for index, detail in sorted(errors.items())],
+        }
+        return Response(body, status=status.HTTP_201_CREATED if ads else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Число объявлений по категориям и состояниям для ?q=, ?category=, ?condition=."""
+        return Response(get_facets(request.query_params))
 
     @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def proposals(self, request, pk=None):
@@ -49,16 +121,82 @@ class AdViewSet(viewsets.ModelViewSet):
         serializer = ExchangeProposalSerializer(proposals, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def suggestions(self, request, pk=None):
+        """Активные объявления текущего пользователя, которые лучше всего подходят для обмена на это."""
+        ad = self.get_object()
+        if ad.user_id == request.user.pk:
+            return Response([])
+        return Response([
+            {'ad': AdSerializer(suggested).data, 'score': score}
+            for suggested, score in suggest_ads(ad, request.user)
+        ])
+
+    @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def cycles(self, request, pk=None):
+        """Цепочки обмена (2..k участников), в которых отдаётся это объявление."""
+        ad = self.get_object()
+        try:
+            max_length = int(request.query_params.get('max_length', settings.ADS_MATCHING_MAX_LENGTH))
+        except ValueError:
+            max_length = settings.ADS_MATCHING_MAX_LENGTH
+        max_length = max(2, min(max_length, settings.ADS_MATCHING_MAX_LENGTH))
+
+        cycles, truncated = get_matching_graph().find_cycles(
+            ad.pk, max_length, settings.ADS_MATCHING_MAX_RESULTS, settings.ADS_MATCHING_MAX_VISITS
+        )
+        ads = Ad.objects.filter(is_active=True).select_related('user').in_bulk(
+            {step['ad'] for cycle in cycles for step in cycle}
+        )
+        usernames = {item.user_id: item.user.username for item in ads.values()}
+        body = []
+        for cycle in cycles:
+            if not all(step['ad'] in ads for step in cycle):
+                continue  # объявление удалили или сняли после построения графа
+            body.append({
+                'length': len(cycle),
+                'steps': [
+                    {
+                        'ad': AdSerializer(ads[step['ad']]).data,
+                        'giver': usernames[step['giver']],
+                        'receiver': usernames[step['receiver']],
+                    }
+                    for step in cycle
+                ],
+            })
+        return Response({'cycles': body, 'truncated': truncated})
+
 
 class ExchangeProposalViewSet(viewsets.ModelViewSet):
     queryset = ExchangeProposal.objects.all()
     serializer_class = ExchangeProposalSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return ExchangeProposal.objects.filter(
-            Q(sender=self.request.user) | Q(ad_receiver__user=self.request.user)
-        ).order_by('-created_at')
+            Q(sender=self.request.user) | Q(receiver=self.request.user)
+        ).select_related('sender', 'receiver', 'ad_sender', 'ad_receiver__user').order_by('-created_at')
+
+    def list(self, request, *args, **kwargs):
+        return self._mailbox(request, 'all')
+
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """Предложения на объявления пользователя; ?status= фильтрует по статусу."""
+        return self._mailbox(request, 'inbox')
+
+    @action(detail=False, methods=['get'])
+    def outbox(self, request):
+        """Предложения, отправленные пользователем; ?status= фильтрует по статусу."""
+        return self._mailbox(request, 'outbox')
+
+    def _mailbox(self, request, box):
+        status = request.query_params.get('status')
+        if status and status not in dict(ExchangeProposal.STATUS_CHOICES):
+            raise ValidationError({'status': 'Неизвестный статус.'})
+        page = self.paginate_queryset(proposal_mailbox(request.user, box, status))
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
     def perform_create(self, serializer):
         ad_receiver = Ad.objects.get(pk=self.request.data.get('ad_receiver'))
@@ -67,45 +205,45 @@ class ExchangeProposalViewSet(viewsets.ModelViewSet):
             raise serializers.ValidationError("Нельзя предложить обмен на своё объявление.")
         if not ad_receiver.is_active or not ad_sender.is_active:
             raise serializers.ValidationError("Одно из объявлений неактивно.")
-        serializer.save(sender=self.request.user, ad_receiver=ad_receiver, ad_sender=ad_sender)
+        with transaction.atomic():  # вместе со счётчиком предложений (ads.signals)
+            serializer.save(sender=self.request.user, ad_receiver=ad_receiver, ad_sender=ad_sender)
+
+    def perform_update(self, serializer):
+        if serializer.instance.sender_id != self.request.user.pk:
+            raise PermissionDenied("Изменять предложение может только отправитель.")
+        serializer.save()
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def accept(self, request, pk=None):
+        return self._decide(request, 'accepted', "Предложение принято, объявления закрыты.")
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def reject(self, request, pk=None):
+        return self._decide(request, 'rejected', "Предложение отклонено.")
+
+    def _decide(self, request, status, success_message):
         proposal = self.get_object()
         if proposal.ad_receiver.user != request.user:
             return Response({"error": "Это не ваше предложение."}, status=403)
+        try:
+            decide_proposal(proposal, status)
+        except ProposalError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response({"status": success_message})
 
-        # Устанавливаем статус предложения как принятый
-        proposal.status = 'accepted'
-        proposal.save()
 
-        # Помечаем оба объявления как неактивные
-        proposal.ad_sender.is_active = False
-        proposal.ad_sender.save()
-        proposal.ad_receiver.is_active = False
-        proposal.ad_receiver.save()
-
-        # Создаём уведомления для обоих пользователей
-        Notification.objects.create(
-            user=proposal.sender,
-            message=f'Ваше предложение на "{proposal.ad_receiver.title}" принято. Вы получили "{proposal.ad_receiver.title}" от {proposal.ad_receiver.user.username}.'
-        )
-        Notification.objects.create(
-            user=proposal.ad_receiver.user,
-            message=f'Вы приняли предложение от {proposal.sender.username}. Вы получили "{proposal.ad_sender.title}".'
-        )
+class WishViewSet(viewsets.ModelViewSet):
+    """Пожелания пользователя: что он хотел бы получить в обмен (учитываются в /api/ads/{id}/cycles/)."""
+    queryset = Wish.objects.all()
+    serializer_class = WishSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-        return Response({"status": "Предложение принято, объявления закрыты."})
+    def get_queryset(self):
+        return Wish.objects.filter(user=self.request.user).order_by('-created_at')
 
-    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
-    def reject(self, request, pk=None):
-        proposal = self.get_object()
-        if proposal.ad_receiver.user != request.user:
-            return Response({"error": "Это не ваше предложение."}, status=403)
-        proposal.status = 'rejected'
-        proposal.save()
-        Notification.objects.create(
-            user=proposal.sender,
-            message=f'Ваше предложение на "{proposal.ad_receiver.title}" отклонено.'
-        )
-        return Response({"status": "Предложение отклонено."})
\ No newline at end of file
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        if Wish.objects.filter(user=self.request.user, category=data['category'],
+                               condition=data.get('condition')).exists():
+            raise ValidationError("Такое пожелание уже есть.")
+        serializer.save(user=self.request.user)
@@ -0,0 +1,154 @@
+"""Асинхронные версии читающих представлений для запуска под ASGI.
+
+Включаются ``ADS_ASYNC_VIEWS`` (по умолчанию — под ASGI, см. ads/urls.py и
+ads/api_urls.py). Страница объявлений или предложений читается через async
+ORM прямо в event loop; то, что остаётся синхронным (контекст-процессоры и
+рендеринг шаблонов, кэш карточек, поисковый индекс, подсказки), выполняется
+за один переход в поток через ``sync_to_async`` — вместо перехода на весь
+запрос, как у синхронного представления под ASGI.
+
+В API асинхронно обслуживаются только GET/HEAD списка и объявления в JSON;
+запись, Browsable API, поиск, выборочные поля и ошибки отдаются синхронному
+AdViewSet, поэтому ответы совпадают с ads.api_views байт в байт.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404, render
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import replace_query_param
+
+from . import views
+from .api_views import AdViewSet
+from .http_cache import ad_versions, make_etag, not_modified, set_validators
+from .models import Ad
+from .pagination import InvalidCursor, KeysetPaginator, get_page_size
+from .search import filter_ads
+from .serializers import AdSerializer, AdValuesSerializer
+
+
+async def _auth_user(request):
+    # Дальше request.user читается в потоке (контекст-процессоры) — без повторного запроса сессии
+    request.user = await request.auser()
+    return request.user
+
+
+async def ad_list(request):
+    if not (await _auth_user(request)).is_authenticated:
+        response = await sync_to_async(views.ad_list_cached)(request)
+        if response is not None:
+            return response
+    if request.GET.get('q'):
+        # Поиск по индексу в памяти может строить индекс из базы
+        paginator = await sync_to_async(views.ad_list_paginator)(request)
+    else:
+        paginator = views.ad_list_paginator(request)
+    try:
+        page_obj = await paginator.aget_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page_obj = await paginator.aget_page()
+    return await sync_to_async(views.ad_list_response)(request, page_obj)
+
+
+async def ad_detail(request, pk):
+    ad = await aget_object_or_404(Ad.objects.select_related('user'), pk=pk, is_active=True)
+    await _auth_user(request)
+    return await sync_to_async(views.ad_detail_response)(request, ad)
+
+
+async def _proposal_page(request, user, box):
+    paginator = views.proposal_paginator(request, user, box)
+    try:
+        return await paginator.aget_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return await paginator.aget_page()
+
+
+@login_required
+async def exchange_proposal_list(request):
+    user = await _auth_user(request)
+    context = {
+        'sent_proposals': await _proposal_page(request, user, 'outbox'),
+        'received_proposals': await _proposal_page(request, user, 'inbox'),
+    }
+    return await sync_to_async(render)(request, 'ads/exchange_proposal_list.html', context)
+
+
+def with_sync_fallback(sync_view):
+    """Отдаёт синхронному DRF-представлению всё, кроме чтения в JSON."""
+
+    def decorator(async_view):
+        @functools.wraps(async_view)
+        async def view(request, *args, **kwargs):
+            if request.method in ('GET', 'HEAD') and _wants_json(request):
+                response = await async_view(request, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+        view.csrf_exempt = True  # как у DRF: CSRF проверяет SessionAuthentication
+        return view
+
+    return decorator
+
+
+def _wants_json(request):
+    if request.GET.get('format') not in (None, 'json'):
+        return False
+    return 'text/html' not in request.headers.get('Accept', '')
+
+
+def _viewset_only(request):
+    # Поиск и выборочные поля (?fields=/?omit=) обслуживает синхронный AdViewSet
+    return any(request.GET.get(name) for name in ('q', 'fields', 'omit'))
+
+
+def _json_response(request, data, etag, last_modified=None):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json')
+    patch_vary_headers(response, ['Accept'])
+    return set_validators(response, etag, last_modified)
+
+
+@with_sync_fallback(AdViewSet.as_view({'get': 'list', 'post': 'create'}, basename='ad', detail=False))
+async def api_ad_list(request):
+    if _viewset_only(request):
+        return None
+    queryset = AdValuesSerializer.values(filter_ads(Ad.objects.filter(is_active=True), request.GET))
+    paginator = KeysetPaginator(queryset, get_page_size(request.GET, settings.ADS_API_PAGE_SIZE))
+    try:
+        page = await paginator.aget_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return None  # ответ 404 формирует DRF
+
+    etag = make_etag('ad-list', 'json', request.get_full_path(), ad_versions(page))
+    response = not_modified(request, etag)
+    if response is not None:
+        return set_validators(response, etag)
+    url = request.build_absolute_uri()
+    data = {
+        'next': replace_query_param(url, 'cursor', page.next_cursor) if page.next_cursor else None,
+        'previous': replace_query_param(url, 'cursor', page.previous_cursor) if page.previous_cursor else None,
+        'results': AdValuesSerializer(page).data,
+    }
+    return _json_response(request, data, etag)
+
+
+@with_sync_fallback(AdViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    basename='ad', detail=True,
+))
+async def api_ad_detail(request, pk):
+    if _viewset_only(request):
+        return None
+    ad = await filter_ads(Ad.objects.filter(is_active=True).select_related('user'), request.GET).filter(pk=pk).afirst()
+    if ad is None:
+        return None
+    etag = make_etag('ad-detail', 'json', ad_versions([ad]), ad.user.username)
+    response = not_modified(request, etag, ad.updated_at)
+    if response is not None:
+        return set_validators(response, etag, ad.updated_at)
+    return _json_response(request, AdSerializer(ad).data, etag, ad.updated_at)
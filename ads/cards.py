@@ -0,0 +1,40 @@
+"""Кэш отрендеренных карточек объявлений для ленты.
+
+Карточка зависит только от самого объявления и имени владельца, поэтому
+хранится одна запись на объявление вместе с версией (``Ad.updated_at`` и имя):
+при чтении запись с другой версией считается промахом, а сохранение, снятие и удаление объявления
+удаляют её сразу (ads.signals, ads.services). Кнопки, зависящие от
+пользователя, в кэш не попадают — шаблон вставляет их на место ACTIONS_MARKER.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+ACTIONS_MARKER = '<!-- ad-card-actions -->'
+
+
+def card_key(ad_id):
+    return f'ads:card:{ad_id}'
+
+
+def render_cards(ads):
+    """Возвращает [(ad, html до кнопок, html после кнопок)]; кэш читается и пишется одним запросом."""
+    ads = list(ads)
+    cached = cache.get_many([card_key(ad.pk) for ad in ads])
+    missing, cards = {}, []
+    for ad in ads:
+        version = (ad.updated_at.isoformat(), ad.user.username)
+        entry = cached.get(card_key(ad.pk))
+        if entry is None or entry[0] != version:
+            html = render_to_string('ads/_ad_card.html', {'ad': ad})
+            entry = (version, *html.split(ACTIONS_MARKER, 1))
+            missing[card_key(ad.pk)] = entry
+        cards.append((ad, mark_safe(entry[1]), mark_safe(entry[2])))
+    if missing:
+        cache.set_many(missing, settings.ADS_CARD_CACHE_TIMEOUT)
+    return cards
+
+
+def invalidate_cards(ad_ids):
+    cache.delete_many([card_key(ad_id) for ad_id in ad_ids])
@@ -0,0 +1,20 @@
+"""Проверки настроек приложения (manage.py check)."""
+from django.conf import settings
+from django.core import checks
+from django.utils.module_loading import import_string
+
+
+@checks.register()
+def check_pubsub_backend(app_configs, **kwargs):
+    """InProcessBroker не видит уведомлений, созданных процессом-обработчиком очереди."""
+    from .pubsub import PollingBroker
+
+    if settings.ADS_NOTIFICATIONS_EAGER:
+        return []
+    if issubclass(import_string(settings.ADS_PUBSUB_BACKEND), PollingBroker):
+        return []
+    return [checks.Error(
+        f'{settings.ADS_PUBSUB_BACKEND} не получает уведомления от manage.py process_notifications.',
+        hint='Укажите ADS_PUBSUB_BACKEND = "ads.pubsub.PollingBroker" или ADS_NOTIFICATIONS_EAGER = True.',
+        id='ads.E001',
+    )]
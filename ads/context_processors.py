@@ -0,0 +1,16 @@
+from django.conf import settings
+
+from .notifications import get_unread_summary
+
+
+def notifications(request):
+    """Добавляет в контекст непрочитанные уведомления; для анонимов запросов нет."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    summary = get_unread_summary(user.pk)
+    return {
+        'unread_notifications': summary['latest'],
+        'unread_notifications_count': summary['count'],
+        'notifications_stream_enabled': settings.ADS_STREAM_ENABLED,
+    }
@@ -0,0 +1,77 @@
+"""Число объявлений по категориям и состояниям для текущего поиска.
+
+Все счётчики берутся из одного запроса ``GROUP BY category, condition`` по
+активным объявлениям, найденным по ``?q=`` (порядок группировки совпадает с
+индексом ``(category, condition)``). Выбранные фильтры к нему не применяются:
+счётчики категорий учитывают только выбранное состояние и наоборот, это
+досчитывается в Python по тем же строкам.
+
+Поэтому результат запроса зависит только от ``?q=`` и кэшируется по
+нормализованным словам запроса на ``ADS_FACETS_CACHE_TIMEOUT`` секунд — без
+инвалидации, счётчики могут отставать на это время.
+"""
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Ad
+from .search import TOKEN_RE, match_ads
+
+
+def normalize_query(query):
+    """Слова запроса в нижнем регистре без повторов и порядка; None — поиска нет."""
+    if not query:
+        return None
+    return ' '.join(sorted(set(TOKEN_RE.findall(query.lower()))))
+
+
+def facets_cache_key(query):
+    raw = repr(normalize_query(query)).encode()
+    return f'ads:facets:{hashlib.md5(raw, usedforsecurity=False).hexdigest()}'
+
+
+def facet_rows(query):
+    """Кортежи (category, condition, count) для активных объявлений по запросу."""
+    key = facets_cache_key(query)
+    rows = cache.get(key)
+    if rows is None:
+        queryset = Ad.objects.filter(is_active=True)
+        if query:
+            queryset = match_ads(queryset, query)
+        rows = list(
+            queryset.order_by('category', 'condition')
+            .values_list('category', 'condition')
+            .annotate(count=Count('pk'))
+        )
+        cache.set(key, rows, settings.ADS_FACETS_CACHE_TIMEOUT)
+    return rows
+
+
+def get_facets(params):
+    """Счётчики для ?q=, ?category=, ?condition=.
+
+    Возвращает {'category': [{'value', 'label', 'count'}, ...], 'condition': [...],
+    'total': число объявлений с текущими фильтрами}.
+    """
+    category = params.get('category')
+    condition = params.get('condition')
+    categories, conditions, total = Counter(), Counter(), 0
+    for row_category, row_condition, count in facet_rows(params.get('q')):
+        category_matches = not category or row_category == category
+        condition_matches = not condition or row_condition == condition
+        if condition_matches:
+            categories[row_category] += count
+        if category_matches:
+            conditions[row_condition] += count
+        if category_matches and condition_matches:
+            total += count
+    return {
+        'category': [{'value': value, 'label': label, 'count': categories[value]}
+                     for value, label in Ad.CATEGORY_CHOICES],
+        'condition': [{'value': value, 'label': label, 'count': conditions[value]}
+                      for value, label in Ad.CONDITION_CHOICES],
+        'total': total,
+    }
@@ -0,0 +1,130 @@
+"""Условные GET (ETag/Last-Modified) и кэш страниц для анонимных запросов.
+
+ETag API строится из версий (``Ad.updated_at``) показанных объявлений и
+параметров запроса. Лента (``ads.views.ad_list``) зависит ещё и от счётчиков
+фильтров и имён владельцев, поэтому её ETag и ключ кэша строятся из общей
+версии данных (``content_version``) — её можно проверить до любых запросов к
+базе. Версию меняют сигналы Ad/ExchangeProposal/User и сервисы, которые пишут
+через UPDATE. Она хранится в кэше Django не дольше ``ADS_PAGE_CACHE_TIMEOUT``:
+с кэшем в памяти процесса (LocMemCache) другие процессы увидят изменения не
+позже этого срока, с общим кэшем — сразу.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Сильный ETag из частей; ADS_HTTP_CACHE_VERSION меняют при смене шаблонов."""
+    raw = repr((settings.ADS_HTTP_CACHE_VERSION, parts)).encode()
+    return f'"{hashlib.md5(raw, usedforsecurity=False).hexdigest()}"'
+
+
+CONTENT_VERSION_KEY = 'ads:content-version'
+
+
+def content_version():
+    """Текущая версия данных ленты; без запросов к базе."""
+    version = cache.get(CONTENT_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(CONTENT_VERSION_KEY, version, settings.ADS_PAGE_CACHE_TIMEOUT):
+            version = cache.get(CONTENT_VERSION_KEY, version)
+    return version
+
+
+def bump_content_version():
+    """Меняет версию сразу и ещё раз после коммита, чтобы не закэшировать незакоммиченное состояние."""
+    def bump():
+        cache.set(CONTENT_VERSION_KEY, uuid.uuid4().hex, settings.ADS_PAGE_CACHE_TIMEOUT)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def ad_versions(ads):
+    """Версии объявлений или строк .values() (AdValuesSerializer); у строк — вместе с именем владельца."""
+    return [
+        (ad['id'], ad['updated_at'].isoformat(), ad.get('user__username')) if isinstance(ad, dict)
+        else (ad.pk, ad.updated_at.isoformat())
+        for ad in ads
+    ]
+
+
+def is_cacheable(request):
+    """Кэшировать можно только анонимный GET без ожидающих flash-сообщений."""
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def not_modified(request, etag, last_modified=None):
+    """Ответ 304, если клиент прислал актуальный If-None-Match/If-Modified-Since, иначе None."""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, no_cache=True)  # хранить можно, но перед показом — перепроверить
+    return response
+
+
+def _page_etag(request, template_name, etag_parts):
+    return make_etag(template_name, request.get_full_path(), *etag_parts)
+
+
+def _page_response(response, etag, last_modified):
+    patch_vary_headers(response, ['Cookie'])
+    return set_validators(response, etag, last_modified)
+
+
+def cached_page(request, template_name, etag_parts, last_modified=None):
+    """Ответ 304 или готовая страница из кэша; None — страницу нужно отрендерить.
+
+    Части ETag должны быть известны без запросов к базе (например,
+    content_version()), иначе смысла проверять кэш заранее нет.
+    """
+    if not is_cacheable(request):
+        return None
+    etag = _page_etag(request, template_name, etag_parts)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        content = cache.get(f'ads:page:{etag[1:-1]}')
+        if content is None:
+            return None
+        response = HttpResponse(content)
+    return _page_response(response, etag, last_modified)
+
+
+def cached_render(request, template_name, context, etag_parts, last_modified=None):
+    """render() с ETag и кэшем готовой страницы для анонимных пользователей.
+
+    context может быть функцией без аргументов: тогда она вызывается, только
+    если страницу действительно нужно отрендерить.
+    """
+    if not is_cacheable(request):
+        return render(request, template_name, context() if callable(context) else context)
+
+    etag = _page_etag(request, template_name, etag_parts)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        key = f'ads:page:{etag[1:-1]}'
+        content = cache.get(key)
+        if content is None:
+            content = render(request, template_name, context() if callable(context) else context).content
+            cache.set(key, content, settings.ADS_PAGE_CACHE_TIMEOUT)
+        response = HttpResponse(content)
+    return _page_response(response, etag, last_modified)
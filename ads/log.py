@@ -0,0 +1,117 @@
+"""Неблокирующее логирование с выборкой для settings.LOGGING.
+
+``QueueListenerHandler`` только кладёт запись в очередь, а форматирование и
+запись в поток/файл выполняет фоновый поток ``QueueListener``: обработчик
+запроса не ждёт ввода-вывода. ``SamplingFilter`` пропускает заданную долю
+записей ниже WARNING для каждого логгера, поэтому отладочные сообщения на
+горячих путях почти ничего не стоят и в продакшене.
+"""
+import atexit
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra=
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю записей по имени логгера; WARNING и выше — всегда.
+
+    ``rates`` — {префикс имени логгера: доля от 0 до 1}, выбирается самый
+    длинный подходящий префикс, иначе ``rate``.
+    """
+
+    def __init__(self, rate=1.0, rates=None, always_level='WARNING'):
+        super().__init__()
+        self.rate = rate
+        self.rates = rates or {}
+        self.always_level = logging.getLevelName(always_level) if isinstance(always_level, str) else always_level
+        self._cache = {}
+
+    def rate_for(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        rate, matched = self.rate, -1
+        for prefix, value in self.rates.items():
+            if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > matched:
+                rate, matched = value, len(prefix)
+        self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Стандартная строка лога плюс поля из extra= в виде key=value."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(
+            f'{key}={value!r}' for key, value in vars(record).items() if key not in RESERVED_ATTRS
+        )
+        return f'{line} {fields}' if fields else line
+
+
+class QueueListenerHandler(QueueHandler):
+    """QueueHandler, который сам запускает QueueListener для обработчиков ``handlers``.
+
+    Обработчики указываются по именам из settings.LOGGING['handlers'] и
+    находятся при первой записи: dictConfig создаёт их независимо от порядка.
+    """
+
+    def __init__(self, handlers, maxsize=10000, respect_handler_level=True):
+        super().__init__(queue.Queue(maxsize))
+        self.handler_names = list(handlers)
+        self.respect_handler_level = respect_handler_level
+        self.listener = None
+        self.dropped = 0
+
+    def start(self):
+        handlers = []
+        for name in self.handler_names:
+            handler = logging.getHandlerByName(name)
+            if handler is None:
+                raise ValueError(f'QueueListenerHandler: нет обработчика логов {name!r}.')
+            handlers.append(handler)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=self.respect_handler_level)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()  # дописывает очередь до конца
+            self.listener = None
+
+    def prepare(self, record):
+        # Подставляем аргументы здесь (они могут измениться после возврата),
+        # но форматирование строки оставляем фоновому потоку.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1  # лучше потерять запись, чем заблокировать запрос
+
+    def emit(self, record):
+        if self.listener is None:  # handle() уже держит self.lock
+            self.start()
+        super().emit(record)
+
+    def close(self):
+        self.stop()
+        super().close()
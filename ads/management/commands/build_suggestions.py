@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.suggestions import SuggestionIndex
+
+
+class Command(BaseCommand):
+    help = 'Строит индекс подбора объявлений для обмена и сохраняет его в файл (запускать по расписанию).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.ADS_SUGGESTIONS_INDEX_PATH,
+                            help='Файл индекса (.npz), по умолчанию ADS_SUGGESTIONS_INDEX_PATH.')
+
+    def handle(self, *args, output, **options):
+        if not output:
+            raise CommandError('Укажите --output или настройку ADS_SUGGESTIONS_INDEX_PATH.')
+        index = SuggestionIndex.build()
+        index.save(output)
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано объявлений: {len(index.ids)}'))
@@ -0,0 +1,51 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ads.models import Ad
+
+FIELDS = ['id', 'user', 'title', 'description', 'image_url', 'category', 'condition', 'is_active', 'created_at']
+
+
+class Command(BaseCommand):
+    help = 'Выгружает объявления в JSONL/CSV потоково, без загрузки таблицы в память.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Путь к файлу или "-" для stdout.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Формат файла; по умолчанию определяется по расширению.')
+        parser.add_argument('--all', action='store_true', help='Включить неактивные объявления.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Сколько строк читать из базы за раз.')
+
+    def handle(self, *args, path, format, all, chunk_size, **options):
+        fmt = format or ('csv' if path.endswith('.csv') else 'jsonl')
+        ads = Ad.objects.all() if all else Ad.objects.filter(is_active=True)
+        rows = (
+            ads.order_by('pk')
+            .values('id', 'user__username', 'title', 'description', 'image_url',
+                    'category', 'condition', 'is_active', 'created_at')
+            .iterator(chunk_size=chunk_size)
+        )
+
+        stream = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        count = 0
+        try:
+            if fmt == 'csv':
+                writer = csv.DictWriter(stream, fieldnames=FIELDS)
+                writer.writeheader()
+            for row in rows:
+                row['user'] = row.pop('user__username')
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    stream.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                count += 1
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+
+        if stream is not self.stdout:
+            self.stdout.write(self.style.SUCCESS(f'Выгружено: {count}'))
@@ -0,0 +1,96 @@
+import csv
+import json
+import sys
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ads.services import bulk_create_ads, validate_ads
+
+FORMATS = ('jsonl', 'csv')
+MAX_REPORTED_ERRORS = 20
+
+
+def read_rows(stream, fmt):
+    """Построчно читает JSONL или CSV, не загружая файл целиком."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Импортирует объявления из JSONL/CSV пачками через bulk_create. Файл импортируется '
+            'целиком в одной транзакции: при ошибке в любой строке ничего не записывается.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу или "-" для stdin.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Формат файла; по умолчанию определяется по расширению.')
+        parser.add_argument('--user', help='Владелец объявлений, если в строке нет поля "user".')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк проверять и вставлять за раз.')
+
+    def handle(self, *args, path, format, user, batch_size, **options):
+        fmt = format or ('csv' if path.endswith('.csv') else 'jsonl')
+        default_user = None
+        if user:
+            default_user = User.objects.filter(username=user).first()
+            if default_user is None:
+                raise CommandError(f'Пользователь "{user}" не найден.')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        imported = failed = 0
+        try:
+            # Одна транзакция на файл: после исправления ошибок повторный
+            # запуск не дублирует уже вставленные пачки
+            with transaction.atomic():
+                for number, batch in enumerate(batches(read_rows(stream, fmt), batch_size)):
+                    offset = number * batch_size
+                    created, errors = self.import_batch(batch, default_user, batch_size)
+                    imported += created
+                    for index, error in errors:
+                        if failed < MAX_REPORTED_ERRORS:
+                            self.stderr.write(f'Строка {offset + index + 1}: {error}')
+                        failed += 1
+                if failed:
+                    raise CommandError(f'Строк с ошибками: {failed}. Ничего не импортировано.')
+        except (json.JSONDecodeError, csv.Error) as exc:
+            raise CommandError(f'Не удалось прочитать файл: {exc}. Ничего не импортировано.')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Импортировано: {imported}'))
+
+    def import_batch(self, rows, default_user, batch_size):
+        """Возвращает (число созданных, [(индекс, ошибка), ...])."""
+        usernames = {row.get('user') for row in rows if isinstance(row, dict)} - {None, ''}
+        users = {u.username: u for u in User.objects.filter(username__in=usernames)}
+
+        valid, errors = validate_ads(rows)
+        errors = list(errors.items())
+        items = []
+        for index, data in valid:
+            username = rows[index].get('user')
+            owner = users.get(username) if username else default_user
+            if owner is None:
+                errors.append((index, f'неизвестный пользователь "{username or ""}"'))
+                continue
+            items.append((data, owner))
+        errors.sort(key=lambda error: error[0])
+
+        if items:
+            bulk_create_ads(items, batch_size=batch_size)
+        return len(items), errors
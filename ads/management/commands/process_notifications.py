@@ -0,0 +1,50 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from ads.notifications import process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Доставляет уведомления из очереди NotificationEvent пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.ADS_NOTIFICATIONS_BATCH_SIZE,
+                            help='Сколько событий обрабатывать за одну транзакцию.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Число потоков-обработчиков.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, опрашивая очередь.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, секунды.')
+
+    def handle(self, *args, batch_size, workers, loop, interval, **options):
+        if workers == 1:
+            total = self.work(batch_size, loop, interval)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(self.work, batch_size, loop, interval, True) for _ in range(workers)]
+                total = sum(future.result() for future in futures)
+        self.stdout.write(self.style.SUCCESS(f'Создано уведомлений: {total}'))
+
+    def work(self, batch_size, loop, interval, own_connection=False):
+        total = 0
+        try:
+            while True:
+                if loop:
+                    close_old_connections()
+                created = process_outbox(batch_size)
+                total += created
+                if created:
+                    continue
+                if not loop:
+                    return total
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            return total
+        finally:
+            if own_connection:
+                connection.close()  # у каждого потока своё соединение
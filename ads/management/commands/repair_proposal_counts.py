@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ads.http_cache import bump_content_version
+from ads.models import Ad, ExchangeProposal
+
+
+def actual_pending_count():
+    """Подзапрос с фактическим числом ожидающих предложений для объявления."""
+    pending = (
+        ExchangeProposal.objects.filter(ad_receiver=OuterRef('pk'), status='pending')
+        .values('ad_receiver').annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(pending), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает Ad.pending_proposal_count и исправляет расхождения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько объявлений исправлять одним UPDATE.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать число расхождений.')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        drifted = (
+            Ad.objects.annotate(actual=actual_pending_count())
+            .exclude(pending_proposal_count=F('actual'))
+            .values_list('pk', flat=True)
+        )
+        ids = list(drifted.iterator(chunk_size=batch_size))
+        if dry_run:
+            self.stdout.write(f'Расхождений: {len(ids)}')
+            return
+
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                Ad.objects.filter(pk__in=ids[start:start + batch_size]).update(
+                    pending_proposal_count=actual_pending_count(), updated_at=timezone.now()
+                )
+                bump_content_version()
+        self.stdout.write(self.style.SUCCESS(f'Исправлено объявлений: {len(ids)}'))
@@ -0,0 +1,417 @@
+"""Поиск цепочек обмена между несколькими пользователями.
+
+Граф строится по пользователям: ребро ``u -> v`` означает, что ``u`` хочет
+какое-то активное объявление ``v`` — через ожидающее предложение обмена или
+через пожелание (``Wish``) по категории и состоянию. Цикл ``u0 -> u1 -> ... -> u0``
+— это обмен, в котором каждый участник отдаёт своё объявление предыдущему.
+
+Граф хранится в памяти процесса, строится лениво при первом запросе и дальше
+обновляется точечно после коммита: сигналами (ads.signals) и сервисами,
+которые меняют строки через UPDATE (ads.services). Сигналы видны только процессу, который
+выполнил запись, поэтому граф старше ``ADS_MATCHING_REFRESH`` секунд
+перестраивается при следующем поиске — так подхватываются изменения из
+других воркеров.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+ANY_CONDITION = None
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+class MatchingGraph:
+    """Потокобезопасная обёртка над графом процесса.
+
+    Запись (сигналы, сервисы) держит блокировку только на время точечного
+    изменения. Поиск идёт без блокировки: обход копирует множества смежности
+    перед перебором, поэтому параллельная запись его не ломает, а удалённые
+    за это время вершины просто пропускаются. Граф строится вне блокировки;
+    изменения, пришедшие во время построения, копятся в журнале и
+    применяются к новому графу перед подменой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # граф строит только один поиск
+        self._state = None
+        self._journal = None
+        self.built_at = None
+
+    def reset(self):
+        with self._lock:
+            self._state = self.built_at = None
+
+    def expire(self, max_age):
+        """Сбрасывает граф старше max_age секунд; он перестроится при следующем поиске."""
+        with self._lock:
+            if self._state is not None and time.time() - self.built_at > max_age:
+                self._state = self.built_at = None
+
+    # Построение и точечные обновления
+
+    def load(self, ads=(), proposals=(), wishes=()):
+        """Добавляет в граф кортежи (id, ...) и помечает его построенным.
+
+        ads: (ad_id, user_id, category, condition) — только активные;
+        proposals: (proposal_id, sender_id, ad_receiver_id) — только ожидающие;
+        wishes: (wish_id, user_id, category, condition или None).
+        """
+        with self._lock:
+            if self._state is None:
+                self._state, self.built_at = _Graph(), time.time()
+            self._state.load(ads, proposals, wishes)
+
+    def _build(self):
+        from ads.models import Ad, ExchangeProposal, Wish
+
+        built_at = time.time()
+        with self._lock:
+            self._journal = []
+        try:
+            state = _Graph()
+            state.load(
+                Ad.objects.filter(is_active=True)
+                .values_list('pk', 'user_id', 'category', 'condition').iterator(chunk_size=5000),
+                ExchangeProposal.objects.filter(status='pending')
+                .values_list('pk', 'sender_id', 'ad_receiver_id').iterator(chunk_size=5000),
+                Wish.objects.values_list('pk', 'user_id', 'category', 'condition').iterator(chunk_size=5000),
+            )
+            with self._lock:
+                for method, items in self._journal:
+                    getattr(state, method)(items)
+                self._state, self.built_at = state, built_at
+            return state
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def _apply(self, method, items):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((method, items))
+            if self._state is not None:
+                getattr(self._state, method)(items)
+
+    def sync_ads(self, ads):
+        """Добавляет активные объявления в граф и убирает неактивные."""
+        self._apply('sync_ads', list(ads))
+
+    def remove_ads(self, ad_ids):
+        self._apply('remove_ads', list(ad_ids))
+
+    def sync_proposals(self, proposals):
+        """Учитывает ожидающие предложения и забывает обработанные."""
+        self._apply('sync_proposals', list(proposals))
+
+    def remove_proposals(self, proposal_ids):
+        self._apply('remove_proposals', list(proposal_ids))
+
+    def sync_wishes(self, wishes):
+        self._apply('sync_wishes', list(wishes))
+
+    def remove_wishes(self, wish_ids):
+        self._apply('remove_wishes', list(wish_ids))
+
+    def find_cycles(self, ad_id, max_length, max_results, max_visits):
+        """Ищет циклы обмена длиной 2..max_length, в которых отдаётся объявление ad_id.
+
+        Сначала обратным обходом считается расстояние до тех, кто хочет
+        ad_id, затем прямой обход от владельца идёт только по вершинам,
+        с которых цикл успевает замкнуться. Короткие циклы возвращаются первыми.
+        Каждый из двух обходов ограничен max_visits просмотренными рёбрами.
+
+        Возвращает (циклы, признак исчерпания бюджета). Цикл — список шагов
+        ``{'ad': id, 'giver': user_id, 'receiver': user_id}``, первый шаг — ad_id.
+        """
+        state = self._state
+        if state is None:
+            with self._build_lock:
+                state = self._state or self._build()
+        return state.find_cycles(ad_id, max_length, max_results, max_visits)
+
+
+class _Graph:
+    """Данные графа. Меняется под блокировкой MatchingGraph, читается без неё."""
+
+    def __init__(self):
+        self._ad_owner = {}  # ad_id -> user_id (только активные объявления)
+        self._ad_bucket = {}  # ad_id -> (категория, состояние)
+        self._owner_ads = defaultdict(set)  # user_id -> {ad_id}
+        # (категория, состояние) и (категория, None) -> Counter{user_id: число объявлений}
+        self._bucket_owners = defaultdict(Counter)
+        self._proposals = {}  # proposal_id -> (sender_id, ad_id)
+        self._wanted = defaultdict(Counter)  # user_id -> Counter{ad_id} из предложений
+        self._wanters = defaultdict(Counter)  # ad_id -> Counter{user_id}
+        self._wish_keys = {}  # wish_id -> (user_id, ключ корзины)
+        self._wishes = defaultdict(Counter)  # user_id -> Counter{ключ корзины}
+        self._wishers = defaultdict(Counter)  # ключ корзины -> Counter{user_id}
+
+    def load(self, ads, proposals, wishes):
+        for row in ads:
+            self._add_ad(*row)
+        for row in proposals:
+            self._add_proposal(*row)
+        for row in wishes:
+            self._add_wish(*row)
+
+    def sync_ads(self, ads):
+        for ad in ads:
+            self._remove_ad(ad.pk)
+            if ad.is_active:
+                self._add_ad(ad.pk, ad.user_id, ad.category, ad.condition)
+
+    def remove_ads(self, ad_ids):
+        for ad_id in ad_ids:
+            self._remove_ad(ad_id)
+
+    def sync_proposals(self, proposals):
+        for proposal in proposals:
+            self._remove_proposal(proposal.pk)
+            if proposal.status == 'pending':
+                self._add_proposal(proposal.pk, proposal.sender_id, proposal.ad_receiver_id)
+
+    def remove_proposals(self, proposal_ids):
+        for proposal_id in proposal_ids:
+            self._remove_proposal(proposal_id)
+
+    def sync_wishes(self, wishes):
+        for wish in wishes:
+            self._remove_wish(wish.pk)
+            self._add_wish(wish.pk, wish.user_id, wish.category, wish.condition)
+
+    def remove_wishes(self, wish_ids):
+        for wish_id in wish_ids:
+            self._remove_wish(wish_id)
+
+    def _add_ad(self, ad_id, user_id, category, condition):
+        self._ad_owner[ad_id] = user_id
+        self._ad_bucket[ad_id] = (category, condition)
+        self._owner_ads[user_id].add(ad_id)
+        self._bucket_owners[(category, condition)][user_id] += 1
+        self._bucket_owners[(category, ANY_CONDITION)][user_id] += 1
+
+    def _remove_ad(self, ad_id):
+        user_id = self._ad_owner.pop(ad_id, None)
+        if user_id is None:
+            return
+        category, condition = self._ad_bucket.pop(ad_id)
+        _discard(self._owner_ads, user_id, ad_id)
+        _decrement(self._bucket_owners, (category, condition), user_id)
+        _decrement(self._bucket_owners, (category, ANY_CONDITION), user_id)
+
+    def _add_proposal(self, proposal_id, sender_id, ad_id):
+        self._proposals[proposal_id] = (sender_id, ad_id)
+        self._wanted[sender_id][ad_id] += 1
+        self._wanters[ad_id][sender_id] += 1
+
+    def _remove_proposal(self, proposal_id):
+        edge = self._proposals.pop(proposal_id, None)
+        if edge is None:
+            return
+        sender_id, ad_id = edge
+        _decrement(self._wanted, sender_id, ad_id)
+        _decrement(self._wanters, ad_id, sender_id)
+
+    def _add_wish(self, wish_id, user_id, category, condition):
+        key = (category, condition or ANY_CONDITION)
+        self._wish_keys[wish_id] = (user_id, key)
+        self._wishes[user_id][key] += 1
+        self._wishers[key][user_id] += 1
+
+    def _remove_wish(self, wish_id):
+        entry = self._wish_keys.pop(wish_id, None)
+        if entry is None:
+            return
+        user_id, key = entry
+        _decrement(self._wishes, user_id, key)
+        _decrement(self._wishers, key, user_id)
+
+    # Обход графа
+
+    def _ad_wanters(self, ad_id):
+        """Пользователи, которые хотят объявление (кроме владельца)."""
+        owner = self._ad_owner.get(ad_id)
+        bucket = self._ad_bucket.get(ad_id)
+        if bucket is None:
+            return
+        category, condition = bucket
+        for users in (
+            self._wanters.get(ad_id, ()),
+            self._wishers.get((category, condition), ()),
+            self._wishers.get((category, ANY_CONDITION), ()),
+        ):
+            for user_id in tuple(users):
+                if user_id != owner:
+                    yield user_id
+
+    def _successors(self, user_id, reachable):
+        """Владельцы объявлений, которые хочет user_id, среди reachable (с повторами).
+
+        Пожелание охватывает целую корзину, поэтому перебирается меньшее
+        из двух множеств: владельцы корзины или reachable.
+        """
+        for ad_id in tuple(self._wanted.get(user_id, ())):
+            owner = self._ad_owner.get(ad_id)
+            if owner is not None and owner != user_id and owner in reachable:
+                yield owner
+        for key in tuple(self._wishes.get(user_id, ())):
+            owners = self._bucket_owners.get(key, {})
+            smaller, larger = (owners, reachable) if len(owners) <= len(reachable) else (reachable, owners)
+            for owner in tuple(smaller):
+                if owner != user_id and owner in larger:
+                    yield owner
+
+    def _predecessors(self, user_id, expanded):
+        """Пользователи, которые хотят хотя бы одно объявление user_id (с повторами).
+
+        Желающие одной корзины одинаковы для всех её владельцев, поэтому
+        каждая корзина раскрывается один раз за обход (ключи копятся в expanded).
+        Владелец может попасть в свои же предшественники — это лишь занижает
+        оценку расстояния и не ломает отсечение.
+        """
+        for ad_id in tuple(self._owner_ads.get(user_id, ())):
+            yield from tuple(self._wanters.get(ad_id, ()))
+            bucket = self._ad_bucket.get(ad_id)
+            if bucket is None:
+                continue
+            category, condition = bucket
+            for key in ((category, condition), (category, ANY_CONDITION)):
+                if key not in expanded:
+                    expanded.add(key)
+                    yield from tuple(self._wishers.get(key, ()))
+
+    def _wanted_ad(self, user_id, owner_id):
+        """Объявление owner_id, которое хочет user_id; предложения важнее пожеланий."""
+        for ad_id in tuple(self._wanted.get(user_id, ())):
+            if self._ad_owner.get(ad_id) == owner_id:
+                return ad_id
+        keys = self._wishes.get(user_id, ())
+        for ad_id in sorted(tuple(self._owner_ads.get(owner_id, ()))):
+            category, condition = self._ad_bucket.get(ad_id, (None, None))
+            if (category, condition) in keys or (category, ANY_CONDITION) in keys:
+                return ad_id
+        return None
+
+    def find_cycles(self, ad_id, max_length, max_results, max_visits):
+        owner = self._ad_owner.get(ad_id)
+        if owner is None:
+            return [], False
+        targets = set(self._ad_wanters(ad_id))
+        backward = _Budget(max_visits)
+        distance = self._distances(targets, max_length - 2, backward)
+        budget = _Budget(max_visits)
+        paths = []
+        try:
+            for length in range(2, max_length + 1):
+                self._search(owner, targets, distance, length, max_results - len(paths), budget, paths)
+                if len(paths) >= max_results:
+                    break
+        except _BudgetExhausted:
+            pass
+        cycles = [self._steps(ad_id, path) for path in paths[:max_results]]
+        return [cycle for cycle in cycles if cycle is not None], backward.exhausted or budget.exhausted
+
+    def _distances(self, targets, depth, budget):
+        """Расстояние (в рёбрах, не больше depth) до targets; при исчерпании бюджета — частичное."""
+        distance = dict.fromkeys(targets, 0)
+        frontier = list(targets)
+        expanded = set()
+        try:
+            for level in range(1, depth + 1):
+                next_frontier = []
+                for user_id in frontier:
+                    for predecessor in self._predecessors(user_id, expanded):
+                        budget.spend()
+                        if predecessor not in distance:
+                            distance[predecessor] = level
+                            next_frontier.append(predecessor)
+                frontier = next_frontier
+        except _BudgetExhausted:
+            pass
+        return distance
+
+    def _search(self, owner, targets, distance, length, limit, budget, paths):
+        path = [owner]
+        on_path = {owner}
+        found = []
+
+        def visit(user_id):
+            seen = set()
+            for successor in self._successors(user_id, distance):
+                budget.spend()
+                if successor in on_path or successor in seen:
+                    continue
+                seen.add(successor)
+                if len(path) + 1 + distance[successor] > length:
+                    continue
+                path.append(successor)
+                on_path.add(successor)
+                if len(path) == length:
+                    if successor in targets:
+                        found.append(list(path))
+                else:
+                    visit(successor)
+                path.pop()
+                on_path.discard(successor)
+                if len(found) >= limit:
+                    return
+
+        try:
+            visit(owner)
+        finally:
+            paths.extend(found)
+
+    def _steps(self, ad_id, path):
+        steps = [{'ad': ad_id, 'giver': path[0], 'receiver': path[-1]}]
+        for receiver, giver in zip(path, path[1:]):
+            wanted = self._wanted_ad(receiver, giver)
+            if wanted is None:
+                return None
+            steps.append({'ad': wanted, 'giver': giver, 'receiver': receiver})
+        return steps
+
+
+class _Budget:
+    def __init__(self, visits):
+        self.left = visits
+        self.exhausted = False
+
+    def spend(self):
+        self.left -= 1
+        if self.left < 0:
+            self.exhausted = True
+            raise _BudgetExhausted()
+
+
+def _discard(mapping, key, value):
+    values = mapping.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del mapping[key]
+
+
+def _decrement(mapping, key, value):
+    counter = mapping.get(key)
+    if counter is None:
+        return
+    counter[value] -= 1
+    if counter[value] <= 0:
+        del counter[value]
+        if not counter:
+            del mapping[key]
+
+
+_graph = MatchingGraph()
+
+
+def get_matching_graph():
+    """Возвращает граф обменов процесса (сброшенный, если он старше ADS_MATCHING_REFRESH)."""
+    _graph.expire(settings.ADS_MATCHING_REFRESH)
+    return _graph
@@ -0,0 +1,185 @@
+"""Метрики запроса: число SQL-запросов, время SQL, шаблонов и Python.
+
+``RequestMetricsMiddleware`` замеряет долю запросов ``ADS_METRICS_SAMPLE_RATE``,
+добавляет заголовок ``Server-Timing`` и пишет в лог ``ads.metrics`` запросы,
+превысившие ``ADS_METRICS_SLOW_MS`` или ``ADS_METRICS_SLOW_QUERIES``, вместе с
+самыми частыми повторяющимися SQL (типичный признак N+1).
+
+SQL перехватывается постоянной обёрткой ``execute_wrappers`` на каждом
+соединении, время шаблонов — обёрткой над ``Template.render``. Обе берут
+метрики текущего запроса из contextvar и ничего не делают вне замеряемого
+запроса. contextvar доходит и до потоков ``sync_to_async``, поэтому под ASGI
+замеряются и async-представления; потоковые ответы (SSE) не замеряются.
+"""
+import contextvars
+import functools
+import logging
+import random
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.base import Template
+
+logger = logging.getLogger('ads.metrics')
+
+_current = contextvars.ContextVar('ads_request_metrics', default=None)
+
+DUPLICATES_IN_LOG = 3
+SQL_IN_LOG = 300
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_sql_time = 0.0  # SQL, выполненный во время рендеринга (ленивые queryset)
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обёртка connection.execute_wrapper."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.sql_time += elapsed
+            self.statements[sql] += 1
+            if self.template_depth:
+                self.template_sql_time += elapsed
+
+    def timings(self):
+        """Возвращает (всего, SQL, шаблоны без SQL, Python) в миллисекундах."""
+        total = time.perf_counter() - self.started
+        template = max(self.template_time - self.template_sql_time, 0.0)
+        python = max(total - self.sql_time - template, 0.0)
+        return total * 1000, self.sql_time * 1000, template * 1000, python * 1000
+
+    def duplicates(self):
+        return [(sql, count) for sql, count in self.statements.most_common(DUPLICATES_IN_LOG) if count > 1]
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, context)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:  # include/extends не считаются дважды
+                metrics.template_time += time.perf_counter() - start
+
+    wrapper.ads_metrics = True
+    return wrapper
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@receiver(connection_created, dispatch_uid='ads.metrics')
+def install_query_recorder(connection, **kwargs):
+    """Ставит на соединение обёртку, которая пишет SQL в метрики текущего запроса.
+
+    Вызывается при каждом подключении, в том числе в потоках sync_to_async
+    (модуль импортируется в AdsConfig.ready, до первых соединений).
+    """
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install_template_timer():
+    if not getattr(Template.render, 'ads_metrics', False):
+        Template.render = _timed_render(Template.render)
+
+
+def view_name(request, view_func):
+    """Имя для логов: ``ViewSet.action`` для DRF, иначе view_name из URLConf."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is not None:
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{cls.__name__}.{action}'
+    match = request.resolver_match
+    return match.view_name if match else view_func.__name__
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_template_timer()
+
+    def __call__(self, request):
+        if random.random() >= settings.ADS_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        if self.is_async:
+            return self._acall(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        request.ads_metrics = metrics
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics)
+
+    async def _acall(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        request.ads_metrics = metrics
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, 'ads_metrics', None)
+        if metrics is not None:
+            metrics.view = view_name(request, view_func)
+
+    def report(self, request, response, metrics):
+        if response.streaming:
+            return response  # длительность потока (SSE) — не время обработки запроса
+        total, sql, template, python = metrics.timings()
+        if settings.ADS_METRICS_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={sql:.1f};desc="{metrics.queries} queries", tpl;dur={template:.1f}, '
+                f'app;dur={python:.1f}, total;dur={total:.1f}'
+            )
+        if total < settings.ADS_METRICS_SLOW_MS and metrics.queries < settings.ADS_METRICS_SLOW_QUERIES:
+            return response
+        lines = [
+            f'Медленный запрос {request.method} {request.get_full_path()} ({metrics.view}): '
+            f'{total:.0f} мс, SQL {metrics.queries} запр./{sql:.0f} мс, шаблоны {template:.0f} мс, '
+            f'Python {python:.0f} мс'
+        ]
+        for statement, count in metrics.duplicates():
+            lines.append(f'  {count}x {statement[:SQL_IN_LOG]}')
+        logger.warning('\n'.join(lines), extra={
+            'view': metrics.view, 'duration_ms': round(total, 1), 'queries': metrics.queries,
+        })
+        return response
@@ -0,0 +1,53 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def populate_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.search import SearchVector
+
+    Ad = apps.get_model('ads', 'Ad')
+    Ad.objects.using(schema_editor.connection.alias).update(
+        search_vector=SearchVector('title', weight='A', config='russian')
+        + SearchVector('description', weight='B', config='russian')
+    )
+
+
+def create_gin_index(apps, schema_editor):
+    # GIN-индекс есть только в PostgreSQL; на SQLite поиск идёт по индексу в памяти.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX ads_ad_search_gin ON ads_ad USING gin (search_vector)')
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS ads_ad_search_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0008_ad_is_active_alter_ad_user_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='ad',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='ads_ad_search_gin'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_gin_index, drop_gin_index),
+            ],
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
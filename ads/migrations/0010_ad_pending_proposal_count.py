@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_pending_proposal_count(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    ExchangeProposal = apps.get_model('ads', 'ExchangeProposal')
+    pending = (
+        ExchangeProposal.objects.filter(ad_receiver=OuterRef('pk'), status='pending')
+        .values('ad_receiver').annotate(count=Count('pk')).values('count')
+    )
+    Ad.objects.update(pending_proposal_count=Coalesce(Subquery(pending), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0009_ad_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='pending_proposal_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_pending_proposal_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_receiver(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    ExchangeProposal = apps.get_model('ads', 'ExchangeProposal')
+    owner = Ad.objects.filter(pk=OuterRef('ad_receiver')).values('user')[:1]
+    ExchangeProposal.objects.update(receiver=Subquery(owner))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0014_ad_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangeproposal',
+            name='receiver',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='received_proposals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_receiver, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:10
+# Отдельно от 0015: в PostgreSQL ALTER TABLE после UPDATE в той же транзакции
+# падает с "pending trigger events" из-за отложенных проверок внешних ключей.
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0015_exchangeproposal_receiver'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exchangeproposal',
+            name='receiver',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='received_proposals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['receiver', '-created_at'], name='ads_proposal_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['receiver', 'status', '-created_at'], name='ads_proposal_inbox_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangeproposal',
+            index=models.Index(fields=['sender', 'status', '-created_at'], name='ads_proposal_outbox_status_idx'),
+        ),
+    ]
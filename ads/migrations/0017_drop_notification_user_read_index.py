@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:56
+# Выборки непрочитанных обслуживает частичный ads_notif_unread_idx, полный
+# индекс по (user, is_read, created_at) только удваивал запись при вставке.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0016_proposal_mailbox_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='ads_notif_user_read_idx',
+        ),
+    ]
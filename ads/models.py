@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 
 class Ad(models.Model):
@@ -24,21 +26,44 @@ class Ad(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     condition = models.CharField(max_length=50, choices=CONDITION_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Версия представления: ETag, кэш страниц и карточек
     is_active = models.BooleanField(default=True)  # Добавляем поле для активных объявлений
+    pending_proposal_count = models.PositiveIntegerField(default=0, editable=False)  # Поддерживается ads.services
+    search_vector = SearchVectorField(null=True, editable=False)  # Заполняется ads.search на PostgreSQL
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['category', 'condition']),
             models.Index(fields=['created_at']),
+            GinIndex(fields=['search_vector'], name='ads_ad_search_gin'),
+            # Лента: только активные объявления в порядке keyset-пагинации
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True), name='ads_ad_active_feed_idx'),
+            # Активные объявления пользователя (форма предложения обмена, входящие предложения)
+            models.Index(fields=['user', 'is_active', '-created_at'], name='ads_ad_user_active_idx'),
         ]
 
+    # Поля, которые меняются только точечными UPDATE (F()-выражения, ads.search)
+    DENORMALIZED_FIELDS = ('pending_proposal_count', 'search_vector')
+
     def __str__(self):
         return f"{self.title} ({self.get_category_display()})"
 
+    def save(self, *args, **kwargs):
+        # Обычное сохранение не должно затирать счётчик устаревшим значением из памяти
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
+        elif kwargs.get('update_fields'):
+            # Любое сохранение меняет версию, по которой инвалидируются кэши
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        super().save(*args, **kwargs)
+
     def get_proposal_count(self):
         """Возвращает количество предложений обмена для объявления."""
-        return self.received_proposals.filter(status='pending').count()
+        return self.pending_proposal_count
 
     def can_be_proposed(self):
         """Проверяет, доступно ли объявление для предложений обмена."""
@@ -55,6 +80,8 @@ class ExchangeProposal(models.Model):
     ad_sender = models.ForeignKey(Ad, related_name='sent_proposals', on_delete=models.CASCADE)
     ad_receiver = models.ForeignKey(Ad, related_name='received_proposals', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_proposals')
+    # Владелец ad_receiver: входящие читаются по индексу без JOIN с объявлениями
+    receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_proposals', editable=False)
     comment = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -62,11 +89,22 @@ class ExchangeProposal(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['sender', '-created_at'], name='ads_proposal_sender_idx'),
+            models.Index(fields=['ad_receiver', 'status'], name='ads_proposal_receiver_idx'),
+            models.Index(fields=['ad_sender', 'status'], name='ads_proposal_ad_sender_idx'),
+            models.Index(fields=['receiver', '-created_at'], name='ads_proposal_inbox_idx'),
+            models.Index(fields=['receiver', 'status', '-created_at'], name='ads_proposal_inbox_status_idx'),
+            models.Index(fields=['sender', 'status', '-created_at'], name='ads_proposal_outbox_status_idx'),
         ]
 
     def __str__(self):
         return f"Обмен: {self.ad_sender.title} -> {self.ad_receiver.title}"
 
+    def save(self, *args, **kwargs):
+        if self.receiver_id is None and self.ad_receiver_id is not None:
+            self.receiver_id = self.ad_receiver.user_id
+        super().save(*args, **kwargs)
+
 
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -74,5 +112,41 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], condition=models.Q(is_read=False),
+                         name='ads_notif_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.message[:50]}..."
+
+
+class NotificationEvent(models.Model):
+    """Событие в очереди (outbox) уведомлений.
+
+    Представления пишут одну строку с пачкой пар [user_id, message], а
+    обработчик ``manage.py process_notifications`` превращает события
+    в строки Notification через bulk_create.
+    """
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Событие #{self.pk}: {len(self.payload)} уведомл."
+
+
+class Wish(models.Model):
+    """Что пользователь хотел бы получить в обмен: категория и, необязательно, состояние."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishes')
+    category = models.CharField(max_length=50, choices=Ad.CATEGORY_CHOICES)
+    condition = models.CharField(max_length=50, choices=Ad.CONDITION_CHOICES, blank=True, null=True)  # пусто — любое
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category', 'condition'], name='ads_wish_unique'),
+        ]
+
     def __str__(self):
-        return f"{self.user.username}: {self.message[:50]}..."
\ No newline at end of file
+        return f"{self.user.username} хочет: {self.get_category_display()}"
@@ -0,0 +1,107 @@
+"""Доставка уведомлений и кэш сводки непрочитанных.
+
+Уведомления ставятся в очередь (модель NotificationEvent, одна строка на
+действие пользователя) и создаются пачками обработчиком
+``manage.py process_notifications``. При ``ADS_NOTIFICATIONS_EAGER = True``
+они создаются сразу, в том же запросе.
+
+Сводка (число и последние ``UNREAD_LIMIT`` уведомлений) хранится в кэше
+Django в виде простых словарей, поэтому подходит и для LocMemCache, и для
+FileBasedCache. Сбрасывается сигналами модели и при доставке пачки.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Notification, NotificationEvent
+from .pubsub import get_broker, notification_event
+
+UNREAD_LIMIT = 5
+
+
+def unread_cache_key(user_id):
+    return f'ads:unread-notifications:{user_id}'
+
+
+def get_unread_summary(user_id):
+    """Возвращает {'count': int, 'latest': [{'message', 'created_at'}, ...]}."""
+    key = unread_cache_key(user_id)
+    summary = cache.get(key)
+    if summary is None:
+        unread = Notification.objects.filter(user_id=user_id, is_read=False).order_by('-created_at')
+        latest = list(unread.values('message', 'created_at')[:UNREAD_LIMIT])
+        count = len(latest) if len(latest) < UNREAD_LIMIT else unread.count()
+        summary = {'count': count, 'latest': latest}
+        cache.set(key, summary, settings.ADS_NOTIFICATIONS_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate_unread_summary(user_id):
+    """Сбрасывает сводку сразу и ещё раз после коммита, чтобы не закэшировать незакоммиченное состояние."""
+    key = unread_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def send_notifications(items):
+    """Ставит в очередь уведомления из пар (user_id, message) — одна запись в базу."""
+    items = [[user_id, message] for user_id, message in items]
+    if not items:
+        return
+    if settings.ADS_NOTIFICATIONS_EAGER:
+        deliver(items)
+    else:
+        NotificationEvent.objects.create(payload=items)
+
+
+def deliver(items):
+    """Создаёт уведомления одним bulk_create, схлопывая одинаковые пары.
+
+    Пары удалённых пользователей отбрасываются: иначе bulk_create падает на
+    внешнем ключе, пачка откатывается и очередь встаёт на этих событиях.
+    """
+    unique = dict.fromkeys((user_id, message) for user_id, message in items)
+    existing = set(User.objects.filter(pk__in={user_id for user_id, _ in unique}).values_list('pk', flat=True))
+    unique = [(user_id, message) for user_id, message in unique if user_id in existing]
+    notifications = Notification.objects.bulk_create(
+        [Notification(user_id=user_id, message=message) for user_id, message in unique],
+        batch_size=settings.ADS_NOTIFICATIONS_BATCH_SIZE,
+    )
+    for user_id in {user_id for user_id, _ in unique}:
+        invalidate_unread_summary(user_id)
+    publish_on_commit(notifications)
+    return len(unique)
+
+
+def publish_on_commit(notifications):
+    """После коммита отправляет уведомления подключённым клиентам (ads.pubsub)."""
+    events = [
+        (n.user_id, notification_event({'pk': n.pk, 'message': n.message, 'created_at': n.created_at}))
+        for n in notifications
+    ]
+
+    def publish():
+        broker = get_broker()
+        for user_id, event in events:
+            broker.publish(user_id, event)
+
+    transaction.on_commit(publish)
+
+
+def process_outbox(batch_size=None):
+    """Разбирает одну пачку событий из очереди; возвращает число созданных уведомлений.
+
+    На PostgreSQL события блокируются с SKIP LOCKED, поэтому несколько
+    обработчиков могут работать параллельно, не мешая друг другу.
+    """
+    batch_size = batch_size or settings.ADS_NOTIFICATIONS_BATCH_SIZE
+    with transaction.atomic():
+        events = list(
+            NotificationEvent.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size]
+        )
+        if not events:
+            return 0
+        created = deliver([item for event in events for item in event.payload])
+        NotificationEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+    return created
@@ -0,0 +1,266 @@
+"""Keyset-пагинация (по курсору) для ленты объявлений и API.
+
+Вместо ``COUNT(*)`` и ``OFFSET`` страница выбирается условием
+``(created_at, id) < (последнее значение)``, поэтому глубокие страницы
+стоят столько же, сколько первая. Курсор — непрозрачная base64-строка.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_ORDERING = ('-created_at', '-id')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, reverse=False):
+    payload = {'v': [_encode_value(value) for value in values]}
+    if reverse:
+        payload['r'] = 1
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (значения, признак обратного направления)."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        return [_decode_value(value) for value in payload['v']], bool(payload.get('r'))
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor(token)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        parsed = parse_datetime(value['dt'])
+        if parsed is None:
+            raise ValueError(value)
+        return parsed
+    if not isinstance(value, (int, float, str)):
+        raise TypeError(value)
+    return value
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Пагинатор по ключу сортировки queryset.
+
+    Последним полем ключа всегда идёт ``id``, чтобы ключ был уникальным.
+    Поддерживаются и аннотации (например ``search_rank`` из ads.search).
+    """
+
+    def __init__(self, queryset, page_size, ordering=None):
+        ordering = list(ordering or queryset.query.order_by or DEFAULT_ORDERING)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        self.ordering = ordering
+        self.queryset = queryset
+        self.page_size = page_size
+
+    def _keyset_filter(self, values, reverse):
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            step = Q(**equal, **{f'{name}__{"lt" if descending else "gt"}': value})
+            condition |= step
+            equal[name] = value
+        return condition
+
+    def _field(self, field):
+        """Поле модели или output_field аннотации для ключа сортировки."""
+        name = field.lstrip('-')
+        try:
+            return self.queryset.model._meta.get_field('id' if name == 'pk' else name)
+        except FieldDoesNotExist:
+            return self.queryset.query.annotations[name].output_field
+
+    def _key(self, obj):
+        if isinstance(obj, dict):  # queryset.values()
+            return [obj[field.lstrip('-')] for field in self.ordering]
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def _fetch(self, condition, ordering, limit):
+        return list(self.queryset.filter(condition).order_by(*ordering)[:limit])
+
+    async def _afetch(self, condition, ordering, limit):
+        return [obj async for obj in self.queryset.filter(condition).order_by(*ordering)[:limit]]
+
+    def _query(self, cursor):
+        """Условие выборки, порядок и направление для курсора."""
+        condition = Q()
+        reverse = False
+        if cursor:
+            values, reverse = decode_cursor(cursor)
+            if len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            try:
+                values = [self._field(field).to_python(value) for field, value in zip(self.ordering, values)]
+            except (ValidationError, ValueError, TypeError):
+                raise InvalidCursor(cursor)  # подделанный курсор со значениями не того типа
+            condition = self._keyset_filter(values, reverse)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        return condition, ordering, reverse
+
+    def _page(self, rows, cursor, reverse):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or reverse:
+                next_cursor = encode_cursor(self._key(rows[-1]))
+            if cursor and (has_more or not reverse):
+                previous_cursor = encode_cursor(self._key(rows[0]), reverse=True)
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+    def get_page(self, cursor=None):
+        """Возвращает страницу после/до курсора; ``InvalidCursor`` при битом токене."""
+        condition, ordering, reverse = self._query(cursor)
+        return self._page(self._fetch(condition, ordering, self.page_size + 1), cursor, reverse)
+
+    async def aget_page(self, cursor=None):
+        """Асинхронный get_page для async-представлений (ads.async_views)."""
+        condition, ordering, reverse = self._query(cursor)
+        return self._page(await self._afetch(condition, ordering, self.page_size + 1), cursor, reverse)
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """Keyset-пагинация по объединению нескольких queryset одной модели.
+
+    Каждый queryset читает не больше ``page_size + 1`` строк по своему индексу,
+    страница собирается слиянием в Python. Так OR по разным столбцам (или
+    UNION, с которым не работает select_related) не мешает использовать индексы.
+    """
+
+    def __init__(self, querysets, page_size, ordering=None):
+        super().__init__(querysets[0], page_size, ordering)
+        self.querysets = querysets
+
+    def _fetch(self, condition, ordering, limit):
+        batches = [queryset.filter(condition).order_by(*ordering)[:limit] for queryset in self.querysets]
+        return self._merge(batches, ordering, limit)
+
+    async def _afetch(self, condition, ordering, limit):
+        batches = [
+            [obj async for obj in queryset.filter(condition).order_by(*ordering)[:limit]]
+            for queryset in self.querysets
+        ]
+        return self._merge(batches, ordering, limit)
+
+    @staticmethod
+    def _merge(batches, ordering, limit):
+        rows = {}
+        for batch in batches:
+            for obj in batch:
+                rows.setdefault(obj.pk, obj)  # строка может попасть в несколько источников
+        rows = list(rows.values())
+        for field in reversed(ordering):  # устойчивые сортировки: от младшего поля к старшему
+            rows.sort(key=lambda obj: getattr(obj, field.lstrip('-')), reverse=field.startswith('-'))
+        return rows[:limit]
+
+
+def get_page_size(params, default):
+    """Размер страницы из ``?page_size=`` с ограничением ``ADS_MAX_PAGE_SIZE``."""
+    try:
+        size = int(params.get('page_size', default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, settings.ADS_MAX_PAGE_SIZE))
+
+
+def page_querystring(params, cursor):
+    """Строка запроса для ссылки на соседнюю страницу с сохранением фильтров."""
+    query = {key: value for key, value in params.items() if key != 'cursor' and value}
+    query['cursor'] = cursor
+    return urlencode(query)
+
+
+class KeysetPagination(BasePagination):
+    """DRF-пагинация на основе KeysetPaginator."""
+
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = get_page_size(request.query_params, settings.ADS_API_PAGE_SIZE)
+        if isinstance(queryset, (list, tuple)):  # несколько источников, см. MergedKeysetPaginator
+            paginator = MergedKeysetPaginator(queryset, page_size)
+        else:
+            paginator = KeysetPaginator(queryset, page_size)
+        try:
+            self.page = paginator.get_page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Неверный курсор.')
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
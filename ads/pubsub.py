@@ -0,0 +1,153 @@
+"""Pub/sub для потоковой доставки уведомлений (SSE, ads.views.notifications_stream).
+
+``InProcessBroker`` раздаёт события подписчикам внутри одного процесса.
+``PollingBroker`` подходит, когда уведомления создаёт другой процесс
+(например, ``manage.py process_notifications``): один фоновый опрос базы на
+процесс раздаёт новые строки всем подключённым пользователям, так что число
+запросов не зависит от числа соединений. Бэкенд выбирается настройкой
+``ADS_PUBSUB_BACKEND``.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """Очередь событий одного подключения.
+
+    Очередь ограничена: если клиент не успевает читать, накопленные события
+    выбрасываются и вместо них отправляется ``resync`` — клиент должен
+    перечитать сводку уведомлений целиком.
+    """
+
+    def __init__(self, broker, user_id, queue_size):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def push(self, event):
+        """Вызывается только в потоке event loop подписчика."""
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {'type': 'resync'}
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._count = 0
+
+    def subscribe(self, user_id):
+        """Создаёт подписку; вызывается из event loop. Бросает TooManySubscribers."""
+        with self._lock:
+            if self._count >= settings.ADS_STREAM_MAX_CONNECTIONS:
+                raise TooManySubscribers()
+            if len(self._subscribers.get(user_id, ())) >= settings.ADS_STREAM_MAX_PER_USER:
+                raise TooManySubscribers()
+            subscription = Subscription(self, user_id, settings.ADS_STREAM_QUEUE_SIZE)
+            self._subscribers[user_id].add(subscription)
+            self._count += 1
+        self.subscribed(subscription)
+        return subscription
+
+    def subscribed(self, subscription):
+        """Точка расширения для бэкендов, которым нужен фоновый процесс."""
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    @property
+    def subscriber_count(self):
+        return self._count
+
+    def user_ids(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, user_id, event):
+        """Отправляет событие всем подключениям пользователя; потокобезопасно."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:  # event loop подписчика уже закрыт
+                self.unsubscribe(subscription)
+
+
+class PollingBroker(InProcessBroker):
+    """Брокер, который сам находит новые уведомления одним опросом базы на процесс."""
+
+    def __init__(self):
+        super().__init__()
+        self._task = None
+        self._last_id = None
+
+    def publish(self, user_id, event):
+        # События найдёт фоновый опрос; прямые публикации не нужны
+        pass
+
+    def subscribed(self, subscription):
+        if self._task is None or self._task.done():
+            self._task = subscription.loop.create_task(self._poll())
+
+    async def _poll(self):
+        from django.db.models import Max
+
+        from ads.models import Notification
+
+        if self._last_id is None:
+            self._last_id = (await Notification.objects.aaggregate(last=Max('pk')))['last'] or 0
+        while self.subscriber_count:
+            await asyncio.sleep(settings.ADS_STREAM_POLL_INTERVAL)
+            user_ids = self.user_ids()
+            if not user_ids:
+                continue
+            rows = Notification.objects.filter(pk__gt=self._last_id, user_id__in=user_ids).order_by('pk')
+            async for notification in rows.values('pk', 'user_id', 'message', 'created_at'):
+                self._last_id = notification['pk']
+                super().publish(notification['user_id'], notification_event(notification))
+
+
+def notification_event(notification):
+    return {
+        'type': 'notification',
+        'id': notification['pk'],
+        'message': notification['message'],
+        'created_at': notification['created_at'].isoformat(),
+    }
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.ADS_PUBSUB_BACKEND)()
+        return _broker
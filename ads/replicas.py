@@ -0,0 +1,102 @@
+"""Чтение с реплик БД для безопасных запросов с «прилипанием» к основной базе.
+
+``ReplicaRoutingMiddleware`` выбирает одну реплику из ``ADS_DB_REPLICAS`` на
+весь GET/HEAD/OPTIONS-запрос; ``ReplicaRouter`` отправляет на неё чтения.
+Запись всегда идёт в ``default``. После первой записи в запросе чтения тоже
+переходят на ``default``, а ответ получает cookie ``ADS_REPLICA_PIN_COOKIE``:
+следующие ``ADS_REPLICA_PIN_SECONDS`` секунд этот клиент читает с основной
+базы и видит свои изменения, даже если реплика отстаёт.
+
+Вне запросов (команды, фоновые задачи) всё читается с ``default``.
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = contextvars.ContextVar('ads_db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self, read_alias=None):
+        self.read_alias = read_alias  # None — читать с default
+        self.wrote = False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.wrote:
+            return None
+        return state.read_alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же строки, что и default
+        aliases = {DEFAULT_DB_ALIAS, *settings.ADS_DB_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.ADS_DB_REPLICAS:
+            return False  # схему реплики получают от основной базы
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if not settings.ADS_DB_REPLICAS:
+            return self.get_response(request)
+        if self.is_async:
+            return self._acall(request)
+
+        state, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    async def _acall(self, request):
+        # Контекст копируется в sync_to_async и async ORM, состояние — общий объект
+        state, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    def _start(self, request):
+        pinned = settings.ADS_REPLICA_PIN_COOKIE in request.COOKIES
+        if request.method in SAFE_METHODS and not pinned:
+            state = RoutingState(random.choice(settings.ADS_DB_REPLICAS))
+        else:
+            state = RoutingState()
+        return state, _state.set(state)
+
+    def _finish(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                settings.ADS_REPLICA_PIN_COOKIE, '1', max_age=settings.ADS_REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
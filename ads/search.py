@@ -0,0 +1,291 @@
+"""Полнотекстовый поиск по объявлениям.
+
+На PostgreSQL поиск идёт по индексированной колонке ``Ad.search_vector``
+(tsvector + GIN), на остальных базах (SQLite в тестах) — по инвертированному
+индексу в памяти процесса. Бэкенд выбирается настройкой ``ADS_SEARCH_BACKEND``
+или автоматически по типу соединения.
+"""
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+# Окончания русских слов, от длинных к коротким (упрощённый snowball).
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ого', 'его', 'ому', 'ему',
+    'ыми', 'ими', 'ость', 'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ой', 'ей', 'ий',
+    'ый', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ов', 'ев', 'ия', 'ья',
+    'ью', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+ENGLISH_ENDINGS = ('ing', 'ies', 'es', 'ed', 's')
+MIN_STEM_LENGTH = 3
+
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+
+
+def stem(word):
+    """Приводит слово к основе: нижний регистр, ё -> е, срезание окончания."""
+    word = word.lower().replace('ё', 'е')
+    endings = RUSSIAN_ENDINGS if CYRILLIC_RE.search(word) else ENGLISH_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на основы слов."""
+    return [stem(token) for token in TOKEN_RE.findall(text or '')]
+
+
+class BaseSearchBackend:
+    """Общий интерфейс поисковых бэкендов."""
+
+    def search(self, queryset, query):
+        """Фильтрует queryset по запросу и сортирует по релевантности (аннотация ``search_rank``)."""
+        raise NotImplementedError
+
+    def match(self, queryset, query):
+        """Только фильтр по запросу, без релевантности и сортировки (для агрегатов)."""
+        return self.search(queryset, query).order_by()
+
+    def index_ads(self, ads):
+        """Обновляет индекс для переданных объявлений."""
+        raise NotImplementedError
+
+    def remove_ads(self, ad_ids):
+        """Удаляет объявления из индекса."""
+
+    def reset(self):
+        """Сбрасывает состояние в памяти процесса, если оно есть."""
+
+    @staticmethod
+    def order_by_rank(queryset):
+        return queryset.order_by('-search_rank', '-created_at', '-id')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Поиск через tsvector-колонку с GIN-индексом и ts_rank."""
+
+    config = 'russian'
+
+    def vector(self):
+        from django.contrib.postgres.search import SearchVector
+
+        return (
+            SearchVector('title', weight='A', config=self.config)
+            + SearchVector('description', weight='B', config=self.config)
+        )
+
+    def build_query(self, query):
+        from django.contrib.postgres.search import SearchQuery
+
+        # Каждое слово ищется по префиксу: "теле" найдёт "телефон" и "телевизор".
+        terms = TOKEN_RE.findall(query or '')
+        if not terms:
+            return None
+        raw = ' & '.join(f'{term}:*' for term in terms)
+        return SearchQuery(raw, search_type='raw', config=self.config)
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchRank
+
+        search_query = self.build_query(query)
+        if search_query is None:
+            return queryset.none()
+        # ts_rank возвращает real; приведение к double precision нужно, чтобы значение в курсоре
+        # (float Python) сравнивалось с ним точно и строки с равным рангом не терялись между страницами
+        queryset = queryset.filter(search_vector=search_query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+        )
+        return self.order_by_rank(queryset)
+
+    def match(self, queryset, query):
+        search_query = self.build_query(query)
+        if search_query is None:
+            return queryset.none()
+        return queryset.filter(search_vector=search_query)
+
+    def index_ads(self, ads):
+        from ads.models import Ad
+
+        Ad.objects.filter(pk__in=[ad.pk for ad in ads]).update(search_vector=self.vector())
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """Инвертированный индекс в памяти процесса для SQLite и тестов.
+
+    Индекс строится лениво при первом поиске и дальше поддерживается сигналами
+    сохранения/удаления объявлений. Изменения применяются после коммита, чтобы
+    откат не оставлял в общем индексе процесса лишних или пропавших записей.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = defaultdict(dict)  # основа -> {ad_id: вес}
+        self._documents = {}  # ad_id -> множество основ
+        self._terms = []  # отсортированные основы для префиксного поиска
+        self._terms_dirty = False
+
+    def reset(self):
+        with self._lock:
+            self._built = False
+            self._postings.clear()
+            self._documents.clear()
+            self._terms = []
+            self._terms_dirty = False
+
+    def _build(self):
+        from ads.models import Ad
+
+        for pk, title, description in Ad.objects.values_list('pk', 'title', 'description').iterator():
+            self._add(pk, title, description)
+        self._built = True
+
+    def _add(self, pk, title, description):
+        self._remove(pk)
+        weights = defaultdict(float)
+        for term in tokenize(title):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(description):
+            weights[term] += DESCRIPTION_WEIGHT
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._terms_dirty = True
+            self._postings[term][pk] = weight
+        self._documents[pk] = set(weights)
+
+    def _remove(self, pk):
+        for term in self._documents.pop(pk, ()):
+            postings = self._postings[term]
+            postings.pop(pk, None)
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+
+    def _matching_terms(self, prefix):
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect_left(self._terms, prefix)
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def scores(self, query):
+        """Возвращает {ad_id: релевантность} для объявлений, содержащих все слова запроса."""
+        prefixes = set(tokenize(query))
+        if not prefixes:
+            return {}
+        with self._lock:
+            if not self._built:
+                self._build()
+            result = None
+            for prefix in prefixes:
+                matched = defaultdict(float)
+                for term in self._matching_terms(prefix):
+                    for pk, weight in self._postings[term].items():
+                        matched[pk] = max(matched[pk], weight)
+                if result is None:
+                    result = matched
+                else:
+                    result = {pk: score + matched[pk] for pk, score in result.items() if pk in matched}
+                if not result:
+                    return {}
+            return dict(result)
+
+    def search(self, queryset, query):
+        scores = self.scores(query)
+        if not scores:
+            return queryset.none()
+        rank = Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        queryset = queryset.filter(pk__in=scores.keys()).annotate(search_rank=rank)
+        return self.order_by_rank(queryset)
+
+    def match(self, queryset, query):
+        scores = self.scores(query)
+        if not scores:
+            return queryset.none()
+        return queryset.filter(pk__in=scores.keys())
+
+    def index_ads(self, ads):
+        rows = [(ad.pk, ad.title, ad.description) for ad in ads]
+        transaction.on_commit(lambda: self._index_rows(rows))
+
+    def _index_rows(self, rows):
+        with self._lock:
+            if not self._built:
+                return
+            for row in rows:
+                self._add(*row)
+
+    def remove_ads(self, ad_ids):
+        ad_ids = list(ad_ids)
+        transaction.on_commit(lambda: self._remove_rows(ad_ids))
+
+    def _remove_rows(self, ad_ids):
+        with self._lock:
+            for pk in ad_ids:
+                self._remove(pk)
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """Возвращает экземпляр поискового бэкенда (один на процесс)."""
+    path = getattr(settings, 'ADS_SEARCH_BACKEND', None)
+    if not path:
+        if connection.vendor == 'postgresql':
+            path = 'ads.search.PostgresSearchBackend'
+        else:
+            path = 'ads.search.InMemorySearchBackend'
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def reset_search_index():
+    """Сбрасывает индексы в памяти; они перестроятся из базы при следующем поиске."""
+    for backend in list(_backends.values()):
+        backend.reset()
+
+
+def search_ads(queryset, query):
+    """Применяет полнотекстовый поиск к queryset объявлений."""
+    return get_search_backend().search(queryset, query)
+
+
+def match_ads(queryset, query):
+    """Оставляет в queryset объявления, найденные по запросу, без сортировки по релевантности."""
+    return get_search_backend().match(queryset, query)
+
+
+def filter_ads(queryset, params):
+    """Фильтры ленты и API: ?category=, ?condition= и поиск ?q= (без него — новые сначала)."""
+    category = params.get('category')
+    condition = params.get('condition')
+    query = params.get('q')
+    if category:
+        queryset = queryset.filter(category=category)
+    if condition:
+        queryset = queryset.filter(condition=condition)
+    if query:
+        return search_ads(queryset, query)
+    return queryset.order_by('-created_at')
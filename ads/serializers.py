@@ -1,36 +1,157 @@
-from rest_framework import serializers
-from .models import Ad, ExchangeProposal
+import datetime
 
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
-class AdSerializer(serializers.ModelSerializer):
+from .models import Ad, ExchangeProposal, Wish
+
+
+def sparse_fields(params, available):
+    """Поля из ?fields=a,b или ?omit=a,b в порядке available; None — параметров нет, нужны все."""
+    fields, omit = params.get('fields'), params.get('omit')
+    if not fields and not omit:
+        return None
+    if fields and omit:
+        raise serializers.ValidationError({'fields': 'Укажите либо fields, либо omit.'})
+    names = {name.strip() for name in (fields or omit).split(',') if name.strip()}
+    unknown = names - set(available)
+    if unknown:
+        raise serializers.ValidationError({'fields' if fields else 'omit': f'Неизвестные поля: {", ".join(sorted(unknown))}.'})
+    if fields:
+        return [name for name in available if name in names]
+    return [name for name in available if name not in names]
+
+
+class SparseFieldsMixin:
+    """Принимает fields=[...] и отдаёт только эти поля (см. sparse_fields)."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class AdSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     category = serializers.ChoiceField(choices=Ad.CATEGORY_CHOICES)
     condition = serializers.ChoiceField(choices=Ad.CONDITION_CHOICES)
-    proposal_count = serializers.SerializerMethodField()
+    proposal_count = serializers.IntegerField(source='pending_proposal_count', read_only=True)
 
     class Meta:
         model = Ad
         fields = ['id', 'user', 'title', 'description', 'image_url', 'category', 'condition', 'is_active', 'proposal_count', 'created_at']
         read_only_fields = ['id', 'user', 'created_at', 'proposal_count']
 
-    def get_proposal_count(self, obj):
-        print(f"Object type: {type(obj)}, Object: {obj}")
-        if isinstance(obj, dict):
-            return 0
-        return obj.get_proposal_count()
+
+class AdValuesSerializer:
+    """Только чтение: ответ AdSerializer из строк ``.values()``, без полей DRF.
+
+    Для больших страниц списка: не создаются экземпляры Ad/User и не
+    вызываются поля сериализатора по каждому значению. Результат совпадает с
+    AdSerializer байт в байт (см. тесты), поэтому при изменении AdSerializer
+    этот класс нужно обновить вместе с ним.
+    """
+
+    # Поле ответа -> выражение для .values()
+    COLUMNS = {
+        'id': 'id',
+        'user': 'user__username',  # StringRelatedField: str(User) — это username
+        'title': 'title',
+        'description': 'description',
+        'image_url': 'image_url',
+        'category': 'category',
+        'condition': 'condition',
+        'is_active': 'is_active',
+        'proposal_count': 'pending_proposal_count',
+        'created_at': 'created_at',
+    }
+    # Как ChoiceField.to_representation: строка значения -> исходное значение выбора
+    CATEGORY_VALUES = {str(value): value for value, _ in Ad.CATEGORY_CHOICES}
+    CONDITION_VALUES = {str(value): value for value, _ in Ad.CONDITION_CHOICES}
+
+    def __init__(self, rows, fields=None):
+        self.rows = rows
+        # Порядок ключей — как у AdSerializer
+        self.fields = [name for name in AdSerializer.Meta.fields if fields is None or name in fields]
+
+    @classmethod
+    def values(cls, queryset, fields=None):
+        """queryset.values() с колонками полей, ключом сортировки (для курсора) и updated_at (для ETag)."""
+        fields = AdSerializer.Meta.fields if fields is None else fields
+        columns = {'id', 'updated_at', *(cls.COLUMNS[name] for name in fields)}
+        columns.update(field.lstrip('-') for field in queryset.query.order_by)
+        return queryset.values(*columns)
+
+    @property
+    def data(self):
+        categories, conditions = self.CATEGORY_VALUES, self.CONDITION_VALUES
+        datetime_format = api_settings.DATETIME_FORMAT
+        zone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+        def created(value):
+            # DateTimeField.to_representation и enforce_timezone: при USE_TZ=False
+            # база отдаёт naive-значения, они выводятся как есть
+            if datetime_format is None or isinstance(value, str):
+                return value
+            if zone is not None:
+                value = value.astimezone(zone) if timezone.is_aware(value) else timezone.make_aware(value, zone)
+            elif timezone.is_aware(value):
+                value = timezone.make_naive(value, datetime.timezone.utc)
+            if datetime_format.lower() != ISO_8601:
+                return value.strftime(datetime_format)
+            value = value.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+        converters = {
+            'id': int,
+            'user': str,
+            'title': str,
+            'description': str,
+            'image_url': str,
+            'category': lambda value: categories.get(str(value), value),
+            'condition': lambda value: conditions.get(str(value), value),
+            'is_active': bool,
+            'proposal_count': int,
+            'created_at': created,
+        }
+        fields = [(name, self.COLUMNS[name], converters[name]) for name in self.fields]
+        result = []
+        for row in self.rows:
+            item = {}
+            for name, column, convert in fields:
+                value = row[column]
+                # Как Serializer.to_representation: None отдаётся без преобразования
+                item[name] = None if value is None else convert(value)
+            result.append(item)
+        return result
 
 
 class ExchangeProposalSerializer(serializers.ModelSerializer):
     ad_sender = serializers.PrimaryKeyRelatedField(queryset=Ad.objects.filter(is_active=True))
     ad_receiver = serializers.PrimaryKeyRelatedField(queryset=Ad.objects.filter(is_active=True))
-    status = serializers.ChoiceField(choices=ExchangeProposal.STATUS_CHOICES, default='pending')
+    # Статус меняется только через accept/reject (ads.services.decide_proposal)
+    status = serializers.ChoiceField(choices=ExchangeProposal.STATUS_CHOICES, read_only=True)
 
     class Meta:
         model = ExchangeProposal
         fields = ['id', 'ad_sender', 'ad_receiver', 'comment', 'status', 'created_at']
         read_only_fields = ['id', 'created_at']
 
-    def validate(self, data):
-        if not data.get('status'):
-            data['status'] = 'pending'
-        return data
\ No newline at end of file
+    def update(self, instance, validated_data):
+        # Объявления предложения не меняются: от них зависят счётчики и уведомления
+        validated_data.pop('ad_sender', None)
+        validated_data.pop('ad_receiver', None)
+        return super().update(instance, validated_data)
+
+
+class WishSerializer(serializers.ModelSerializer):
+    category = serializers.ChoiceField(choices=Ad.CATEGORY_CHOICES)
+    condition = serializers.ChoiceField(choices=Ad.CONDITION_CHOICES, required=False, allow_null=True)
+
+    class Meta:
+        model = Wish
+        fields = ['id', 'category', 'condition', 'created_at']
+        read_only_fields = ['id', 'created_at']
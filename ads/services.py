@@ -0,0 +1,163 @@
+"""Операции над объявлениями и предложениями обмена, затрагивающие несколько строк или таблиц."""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cards import invalidate_cards
+from .http_cache import bump_content_version
+from .matching import get_matching_graph
+from .models import Ad, ExchangeProposal
+from .notifications import send_notifications
+from .search import get_search_backend
+from .serializers import AdSerializer
+
+
+def change_pending_count(ad_ids, delta):
+    """Атомарно сдвигает счётчик ожидающих предложений у объявлений.
+
+    Не опускает счётчик ниже нуля: при расхождении (строки до backfill, гонки)
+    CHECK-ограничение иначе сорвало бы принятие предложения. Расхождения
+    исправляет ``manage.py repair_proposal_counts``.
+    """
+    Ad.objects.filter(pk__in=ad_ids).update(
+        pending_proposal_count=Greatest(F('pending_proposal_count') + delta, 0), updated_at=timezone.now()
+    )
+    bump_content_version()
+
+
+MAILBOXES = ('inbox', 'outbox', 'all')
+
+
+def proposal_mailbox(user, box, status=None):
+    """Запросы ящика предложений пользователя: 'inbox', 'outbox' или 'all'.
+
+    Возвращает список queryset для MergedKeysetPaginator: каждый идёт по своему
+    индексу (receiver/sender, status, created_at), связи подтянуты select_related.
+    """
+    base = ExchangeProposal.objects.select_related('sender', 'receiver', 'ad_sender', 'ad_receiver')
+    if status:
+        base = base.filter(status=status)
+    querysets = []
+    if box in ('inbox', 'all'):
+        querysets.append(base.filter(receiver=user))
+    if box in ('outbox', 'all'):
+        querysets.append(base.filter(sender=user))
+    return querysets
+
+
+class ProposalError(Exception):
+    """Предложение нельзя принять или отклонить; текст исключения показывается пользователю."""
+
+
+def _accepted_messages(proposal):
+    return [
+        (proposal.sender_id,
+         f'Ваше предложение на "{proposal.ad_receiver.title}" принято. Вы получили '
+         f'"{proposal.ad_receiver.title}" от {proposal.ad_receiver.user.username}.'),
+        (proposal.ad_receiver.user_id,
+         f'Вы приняли предложение от {proposal.sender.username}. Вы получили '
+         f'"{proposal.ad_sender.title}".'),
+    ]
+
+
+def _rejected_message(proposal):
+    return proposal.sender_id, f'Ваше предложение на "{proposal.ad_receiver.title}" отклонено.'
+
+
+def decide_proposal(proposal, status):
+    """Принимает (``'accepted'``) или отклоняет (``'rejected'``) ожидающее предложение.
+
+    Всё выполняется одной короткой транзакцией: оба объявления блокируются
+    SELECT ... FOR UPDATE в порядке id, статус меняется условным
+    UPDATE ... WHERE status='pending'. При принятии оба объявления закрываются,
+    а все остальные ожидающие предложения с их участием отклоняются пачкой.
+    Возвращает список автоматически отклонённых предложений.
+    """
+    ad_ids = sorted({proposal.ad_sender_id, proposal.ad_receiver_id})
+    competing = []
+    with transaction.atomic():
+        ads = list(Ad.objects.select_for_update().filter(pk__in=ad_ids).order_by('pk'))
+        if status == 'accepted' and not all(ad.is_active for ad in ads):
+            raise ProposalError('Одно из объявлений уже неактивно.')
+
+        updated = ExchangeProposal.objects.filter(pk=proposal.pk, status='pending').update(status=status)
+        if not updated:
+            raise ProposalError('Это предложение уже обработано.')
+        change_pending_count([proposal.ad_receiver_id], -1)
+        closed_proposals, closed_ads = [proposal.pk], []
+
+        if status == 'accepted':
+            Ad.objects.filter(pk__in=ad_ids).update(is_active=False, updated_at=timezone.now())
+            closed_ads = ad_ids
+            invalidate_cards(ad_ids)
+            # OF self: строки объявлений из JOIN не блокируются повторно и вразнобой
+            competing = list(
+                ExchangeProposal.objects.select_for_update(of=('self',))
+                .filter(Q(ad_sender_id__in=ad_ids) | Q(ad_receiver_id__in=ad_ids), status='pending')
+                .select_related('ad_receiver')
+            )
+            if competing:
+                ExchangeProposal.objects.filter(pk__in=[p.pk for p in competing]).update(status='rejected')
+                closed_proposals += [p.pk for p in competing]
+                # Один UPDATE на каждое встречающееся значение уменьшения
+                by_delta = defaultdict(list)
+                for ad_id, count in Counter(p.ad_receiver_id for p in competing).items():
+                    by_delta[count].append(ad_id)
+                for count, receiver_ids in by_delta.items():
+                    change_pending_count(receiver_ids, -count)
+            notifications = _accepted_messages(proposal)
+        else:
+            notifications = [_rejected_message(proposal)]
+
+        notifications += [_rejected_message(p) for p in competing]
+        send_notifications(notifications)
+        # UPDATE не вызывает сигналы; граф меняется только после коммита
+        transaction.on_commit(lambda: _forget_in_graph(closed_proposals, closed_ads))
+
+    proposal.status = status
+    if status == 'accepted':
+        proposal.ad_sender.is_active = proposal.ad_receiver.is_active = False
+    for p in competing:
+        p.status = 'rejected'
+    return competing
+
+
+def _forget_in_graph(proposal_ids, ad_ids):
+    graph = get_matching_graph()
+    graph.remove_proposals(proposal_ids)
+    graph.remove_ads(ad_ids)
+
+
+def validate_ads(rows):
+    """Проверяет строки правилами AdSerializer.
+
+    Возвращает список (индекс, validated_data) для корректных строк
+    и словарь {индекс: ошибки} для остальных.
+    """
+    serializer = AdSerializer(many=True).child
+    valid, errors = [], {}
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except ValidationError as exc:
+            errors[index] = exc.detail
+    return valid, errors
+
+
+def bulk_create_ads(items, batch_size=None):
+    """Создаёт объявления из пар (validated_data, user) одной транзакцией.
+
+    bulk_create не вызывает post_save, поэтому поисковый индекс и граф
+    обменов обновляются явно; индекс в памяти и граф — только после коммита.
+    """
+    ads = [Ad(user=user, **data) for data, user in items]
+    with transaction.atomic():
+        ads = Ad.objects.bulk_create(ads, batch_size=batch_size)
+        bump_content_version()
+        get_search_backend().index_ads(ads)
+        transaction.on_commit(lambda: get_matching_graph().sync_ads(ads))
+    return ads
@@ -0,0 +1,121 @@
+import copy
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from django.contrib.auth.models import User
+
+from .cards import invalidate_cards
+from .http_cache import bump_content_version
+from .matching import get_matching_graph
+from .models import Ad, ExchangeProposal, Notification, Wish
+from .notifications import invalidate_unread_summary, publish_on_commit
+from .search import get_search_backend
+from .services import change_pending_count
+
+SEARCH_FIELDS = {'title', 'description'}
+MATCHING_FIELDS = {'user', 'category', 'condition', 'is_active'}
+
+
+@receiver(post_save, sender=Ad)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    """Переиндексирует объявление при изменении заголовка или описания."""
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    get_search_backend().index_ads([instance])
+
+
+@receiver(post_delete, sender=Ad)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove_ads([instance.pk])
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+def drop_cached_card(sender, instance, **kwargs):
+    invalidate_cards([instance.pk])
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+@receiver(post_delete, sender=User)
+def change_list_version(sender, **kwargs):
+    bump_content_version()
+
+
+@receiver(post_save, sender=User)
+def change_list_version_on_rename(sender, update_fields=None, **kwargs):
+    # Имя владельца показывается в карточках; вход (last_login) ленту не меняет
+    if update_fields is None or 'username' in update_fields:
+        bump_content_version()
+
+
+# Граф обменов общий для процесса, поэтому меняется только после коммита:
+# откат не должен оставлять в нём лишних или пропавших рёбер. Объект
+# копируется, чтобы после коммита учесть состояние на момент сохранения.
+
+@receiver(post_save, sender=Ad)
+def update_matching_ad(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not MATCHING_FIELDS.intersection(update_fields):
+        return
+    ad = copy.copy(instance)
+    transaction.on_commit(lambda: get_matching_graph().sync_ads([ad]))
+
+
+@receiver(post_delete, sender=Ad)
+def remove_matching_ad(sender, instance, **kwargs):
+    ad_id = instance.pk
+    transaction.on_commit(lambda: get_matching_graph().remove_ads([ad_id]))
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def count_new_proposal(sender, instance, created, **kwargs):
+    """Новое ожидающее предложение увеличивает счётчик объявления-получателя."""
+    if created and instance.status == 'pending':
+        change_pending_count([instance.ad_receiver_id], 1)
+
+
+@receiver(post_delete, sender=ExchangeProposal)
+def uncount_deleted_proposal(sender, instance, **kwargs):
+    if instance.status == 'pending':
+        change_pending_count([instance.ad_receiver_id], -1)
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def update_matching_proposal(sender, instance, **kwargs):
+    proposal = copy.copy(instance)
+    transaction.on_commit(lambda: get_matching_graph().sync_proposals([proposal]))
+
+
+@receiver(post_delete, sender=ExchangeProposal)
+def remove_matching_proposal(sender, instance, **kwargs):
+    proposal_id = instance.pk
+    transaction.on_commit(lambda: get_matching_graph().remove_proposals([proposal_id]))
+
+
+@receiver(post_save, sender=Wish)
+def update_matching_wish(sender, instance, **kwargs):
+    wish = copy.copy(instance)
+    transaction.on_commit(lambda: get_matching_graph().sync_wishes([wish]))
+
+
+@receiver(post_delete, sender=Wish)
+def remove_matching_wish(sender, instance, **kwargs):
+    wish_id = instance.pk
+    transaction.on_commit(lambda: get_matching_graph().remove_wishes([wish_id]))
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def reset_unread_summary(sender, instance, **kwargs):
+    invalidate_unread_summary(instance.user_id)
+    if kwargs.get('created'):
+        publish_on_commit([instance])
+
+
+@receiver(post_save, sender=User)
+def reset_new_user_summary(sender, instance, created, **kwargs):
+    # id пользователя может быть переиспользован (например, после отката транзакции)
+    if created:
+        invalidate_unread_summary(instance.pk)
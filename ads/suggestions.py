@@ -0,0 +1,280 @@
+"""Подбор объявлений пользователя, которые можно предложить в обмен на просматриваемое.
+
+Индекс кандидатов заранее строится по всем активным объявлениям: для каждого
+хранится нормированный разреженный вектор hashed TF-IDF (основы слов из
+ads.search), коды категории и состояния и владелец. Ответ на запрос — срез
+строк владельца и их скалярные произведения с вектором объявления, без
+обращения к таблице объявлений.
+
+В запросе индекс не строится. Для нескольких процессов его пишет в файл
+``ADS_SUGGESTIONS_INDEX_PATH`` команда ``manage.py build_suggestions``
+(например, по cron), а процессы перечитывают файл при его изменении. Без этой
+настройки индекс строится в фоновом потоке процесса и перестраивается не чаще
+раза в ``ADS_SUGGESTIONS_REFRESH`` секунд; пока первого индекса нет, подсказок нет.
+"""
+import logging
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from .models import Ad
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+TITLE_WEIGHT = 2.0
+TEXT_WEIGHT = 0.5
+CATEGORY_WEIGHT = 0.3
+CONDITION_WEIGHT = 0.2
+
+CATEGORY_CODES = {value: code for code, (value, _) in enumerate(Ad.CATEGORY_CHOICES)}
+CONDITION_CODES = {value: code for code, (value, _) in enumerate(Ad.CONDITION_CHOICES)}
+# Значения вне choices получают отдельный код, который ни с чем не совпадает
+UNKNOWN_CATEGORY = len(CATEGORY_CODES)
+UNKNOWN_CONDITION = len(CONDITION_CODES)
+# Насколько состояния сопоставимы при обмене; пары вне списка — 0
+CONDITION_PAIRS = {
+    ('new', 'like_new'): 0.7,
+    ('new', 'used'): 0.2,
+    ('like_new', 'used'): 0.5,
+}
+
+
+def _condition_similarity():
+    """Матрица CONDITION_PAIRS в порядке CONDITION_CODES, с нулевой строкой для неизвестного."""
+    matrix = np.zeros((UNKNOWN_CONDITION + 1, UNKNOWN_CONDITION + 1), dtype=np.float32)
+    for code in CONDITION_CODES.values():
+        matrix[code, code] = 1.0
+    for (first, second), value in CONDITION_PAIRS.items():
+        matrix[CONDITION_CODES[first], CONDITION_CODES[second]] = value
+        matrix[CONDITION_CODES[second], CONDITION_CODES[first]] = value
+    return matrix
+
+
+CONDITION_SIMILARITY = _condition_similarity()
+
+
+def hashed_terms(title, description, dimensions):
+    """Возвращает {столбец: вес} для текста: хеш основы по модулю размерности, знак — от старшего бита."""
+    features = {}
+    for weight, text in ((TITLE_WEIGHT, title), (1.0, description)):
+        for term in tokenize(text):
+            value = zlib.crc32(term.encode())
+            column = value % dimensions
+            sign = 1.0 if value & 0x80000000 else -1.0
+            features[column] = features.get(column, 0.0) + sign * weight
+    return features
+
+
+class SuggestionIndex:
+    """Векторы объявлений хранятся построчно разреженно (CSR): для строки i
+    столбцы ``indices[indptr[i]:indptr[i + 1]]`` и веса ``data[...]``.
+    У объявления обычно несколько десятков основ при ``ADS_SUGGESTIONS_DIMENSIONS``
+    столбцах, поэтому это в разы меньше плотной матрицы в каждом процессе.
+    """
+
+    FORMAT = 2  # версия файла индекса; при несовпадении файл нужно перестроить
+
+    def __init__(self, ids, owners, categories, conditions, indptr, indices, data, idf, built_at=None):
+        self.ids = ids
+        self.owners = owners
+        self.categories = categories
+        self.conditions = conditions
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.idf = idf
+        self.built_at = built_at or time.time()
+        # Строки, отсортированные по владельцу: кандидаты пользователя — непрерывный срез
+        self._by_owner = np.argsort(owners, kind='stable')
+        self._owners_sorted = owners[self._by_owner]
+
+    @classmethod
+    def from_rows(cls, rows, dimensions):
+        """Строит индекс из кортежей (id, user_id, category, condition, title, description)."""
+        ids, owners, categories, conditions = [], [], [], []
+        doc_rows, columns, values = [], [], []
+        for row, (pk, user_id, category, condition, title, description) in enumerate(rows):
+            ids.append(pk)
+            owners.append(user_id)
+            categories.append(CATEGORY_CODES.get(category, UNKNOWN_CATEGORY))
+            conditions.append(CONDITION_CODES.get(condition, UNKNOWN_CONDITION))
+            features = hashed_terms(title, description, dimensions)
+            doc_rows.extend([row] * len(features))
+            columns.extend(features)
+            values.extend(features.values())
+
+        count = len(ids)
+        columns = np.asarray(columns, dtype=np.int32)
+        values = np.asarray(values, dtype=np.float32)
+        doc_rows = np.asarray(doc_rows, dtype=np.int64)
+
+        document_frequency = np.bincount(columns, minlength=dimensions)
+        idf = (np.log((1.0 + count) / (1.0 + document_frequency)) + 1.0).astype(np.float32)
+        # Разные основы с противоположными знаками могли взаимно погаситься
+        kept = values != 0
+        doc_rows, columns, values = doc_rows[kept], columns[kept], values[kept]
+
+        # Сублинейный TF со знаком хеша: sign * (1 + log|tf|)
+        data = np.sign(values) * (1.0 + np.log(np.abs(values), dtype=np.float32)) * idf[columns]
+        norms = np.sqrt(np.bincount(doc_rows, weights=data * data, minlength=count)).astype(np.float32)
+        data /= norms[doc_rows]
+        indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(doc_rows, minlength=count), out=indptr[1:])
+        return cls(
+            np.asarray(ids, dtype=np.int64),
+            np.asarray(owners, dtype=np.int64),
+            np.asarray(categories, dtype=np.int8),
+            np.asarray(conditions, dtype=np.int8),
+            indptr,
+            columns,
+            data.astype(np.float32),
+            idf,
+        )
+
+    @classmethod
+    def build(cls, dimensions=None):
+        rows = (
+            Ad.objects.filter(is_active=True)
+            .values_list('pk', 'user_id', 'category', 'condition', 'title', 'description')
+            .iterator(chunk_size=5000)
+        )
+        return cls.from_rows(rows, dimensions or settings.ADS_SUGGESTIONS_DIMENSIONS)
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(
+            tmp_path, format=np.array(self.FORMAT), ids=self.ids, owners=self.owners,
+            categories=self.categories, conditions=self.conditions, indptr=self.indptr,
+            indices=self.indices, data=self.data, idf=self.idf, built_at=np.array(self.built_at),
+        )
+        os.replace(tmp_path, path)  # читатели никогда не видят недописанный файл
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if 'format' not in data or int(data['format']) != cls.FORMAT:
+                raise ValueError(f'{path}: индекс в старом формате, перестройте его manage.py build_suggestions')
+            return cls(
+                data['ids'], data['owners'], data['categories'], data['conditions'],
+                data['indptr'], data['indices'], data['data'], data['idf'], float(data['built_at']),
+            )
+
+    def vectorize(self, title, description):
+        vector = np.zeros(len(self.idf), dtype=np.float32)
+        for column, value in hashed_terms(title, description, len(self.idf)).items():
+            if value:
+                vector[column] = np.sign(value) * (1.0 + np.log(abs(value))) * self.idf[column]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def similarity(self, rows, vector):
+        """Скалярные произведения строк rows с плотным vector."""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        # Позиции всех ненулевых элементов выбранных строк подряд
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        products = self.data[positions] * vector[self.indices[positions]]
+        return np.bincount(np.repeat(np.arange(len(rows)), lengths), weights=products, minlength=len(rows))
+
+    def suggest(self, ad, user_id, limit):
+        """Возвращает [(ad_id, оценка)] объявлений user_id, лучших для обмена на ad."""
+        start, stop = np.searchsorted(self._owners_sorted, [user_id, user_id + 1])
+        rows = self._by_owner[start:stop]
+        rows = rows[self.ids[rows] != ad.pk]
+        if not len(rows):
+            return []
+        text = self.similarity(rows, self.vectorize(ad.title, ad.description))
+        category_code = CATEGORY_CODES.get(ad.category, UNKNOWN_CATEGORY)
+        category = ((self.categories[rows] == category_code) & (category_code != UNKNOWN_CATEGORY)).astype(np.float32)
+        condition = CONDITION_SIMILARITY[self.conditions[rows], CONDITION_CODES.get(ad.condition, UNKNOWN_CONDITION)]
+        scores = TEXT_WEIGHT * np.clip(text, 0.0, 1.0) + CATEGORY_WEIGHT * category + CONDITION_WEIGHT * condition
+        best = np.argsort(-scores, kind='stable')[:limit]
+        return [(int(self.ids[rows[i]]), round(float(scores[i]), 4)) for i in best]
+
+
+_index = None
+_index_mtime = None
+_building = False
+_lock = threading.Lock()
+
+
+def build_suggestion_index():
+    """Строит индекс по базе в текущем потоке и делает его текущим для процесса."""
+    global _index, _index_mtime
+    index = SuggestionIndex.build()
+    with _lock:
+        _index, _index_mtime = index, None
+    return index
+
+
+def _build_in_background():
+    global _building
+    try:
+        build_suggestion_index()
+    except Exception:
+        logger.exception('Не удалось построить индекс подсказок')
+    finally:
+        _building = False
+        connections.close_all()  # соединения этого потока
+
+
+def get_suggestion_index():
+    """Текущий индекс или None, если его ещё нет; сам запрос индекс никогда не строит.
+
+    С ADS_SUGGESTIONS_INDEX_PATH индекс читается из файла manage.py build_suggestions
+    и перечитывается при его изменении. Без неё индекс строится в фоновом потоке:
+    при первом обращении и затем раз в ADS_SUGGESTIONS_REFRESH секунд, а до
+    завершения запросы получают прежний индекс (или None).
+    """
+    global _index, _index_mtime, _building
+    path = settings.ADS_SUGGESTIONS_INDEX_PATH
+    if path:
+        with _lock:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return _index  # файл ещё не построен
+            if mtime != _index_mtime:
+                _index_mtime = mtime
+                try:
+                    _index = SuggestionIndex.load(path)
+                except (OSError, ValueError, KeyError):
+                    logger.exception('Не удалось загрузить индекс подсказок %s', path)
+            return _index
+
+    with _lock:
+        index = _index
+        start = not _building and (index is None or time.time() - index.built_at > settings.ADS_SUGGESTIONS_REFRESH)
+        if start:
+            _building = True
+    if start:
+        threading.Thread(target=_build_in_background, name='suggestion-index', daemon=True).start()
+    return index
+
+
+def reset_suggestion_index():
+    global _index, _index_mtime
+    with _lock:
+        _index = _index_mtime = None
+
+
+def suggest_ads(ad, user, limit=None):
+    """Активные объявления пользователя, которые стоит предложить за ad: [(Ad, оценка)].
+
+    Пока индекс не построен, подсказок нет.
+    """
+    index = get_suggestion_index()
+    if index is None:
+        return []
+    ranked = index.suggest(ad, user.pk, limit or settings.ADS_SUGGESTIONS_LIMIT)
+    if not ranked:
+        return []
+    # Индекс обновляется периодически: снятые с тех пор объявления отбрасываются
+    ads = Ad.objects.filter(is_active=True, user=user).in_bulk([pk for pk, _ in ranked])
+    return [(ads[pk], score) for pk, score in ranked if pk in ads]
@@ -1,16 +1,57 @@
-from django.test import TestCase, Client
-from django.urls import reverse, resolve
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory
+from django.urls import include, path, reverse, resolve
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from rest_framework.test import APIClient
 from rest_framework import status
-from ads.models import Ad, ExchangeProposal, Notification
+from rest_framework.renderers import JSONRenderer
+from ads.models import Ad, ExchangeProposal, Notification, NotificationEvent, Wish
 from ads.forms import AdForm, ExchangeProposalForm
 from ads.views import ad_list, ad_create, ad_edit, ad_delete, exchange_proposal_create, exchange_proposal_update, exchange_proposal_list
 from ads.api_views import AdViewSet, ExchangeProposalViewSet
+from ads.serializers import AdSerializer, AdValuesSerializer
+from ads import async_views, matching, pubsub
+from ads.cards import card_key, render_cards
+from ads.checks import check_pubsub_backend
+from ads.facets import facets_cache_key, get_facets
+from ads.log import KeyValueFormatter, QueueListenerHandler, SamplingFilter
+from ads.matching import MatchingGraph, get_matching_graph
+from ads.replicas import ReplicaRouter, ReplicaRoutingMiddleware
+from ads.pagination import InvalidCursor, KeysetPaginator, MergedKeysetPaginator, decode_cursor, encode_cursor
+from ads.notifications import process_outbox, send_notifications
+from ads.suggestions import (
+    CATEGORY_WEIGHT, CONDITION_WEIGHT, SuggestionIndex, build_suggestion_index, get_suggestion_index,
+    reset_suggestion_index, suggest_ads,
+)
+from ads.search import InMemorySearchBackend, get_search_backend, match_ads, reset_search_index, search_ads, stem, tokenize
+from ads.services import ProposalError, decide_proposal, proposal_mailbox
+from django.conf import settings
 from django.contrib import messages
-from django.test.utils import override_settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Count, QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext, override_settings
+from asgiref.sync import sync_to_async
+from contextlib import redirect_stdout
+from io import StringIO
+import asyncio
+import base64
+import json
+import logging
+import logging.handlers
+import numpy as np
+import os
+import re
+import runpy
+import tempfile
+import threading
+import unittest
+import unittest.mock
+from types import ModuleType
 
 
 class AdModelTest(TestCase):
@@ -55,7 +96,9 @@ class AdModelTest(TestCase):
         user2 = User.objects.create_user(username='user2', password='testpass123')
         ad2 = Ad.objects.create(user=user2, title='Ad 2', category='books', condition='used', is_active=True)
         ExchangeProposal.objects.create(ad_sender=ad2, ad_receiver=self.ad, sender=user2, comment='Test')
-        self.assertEqual(self.ad.get_proposal_count(), 1)
+        self.ad.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ad.get_proposal_count(), 1)
 
     def test_can_be_proposed(self):
         self.assertTrue(self.ad.can_be_proposed())
@@ -178,6 +221,7 @@ class ExchangeProposalFormTest(TestCase):
 
 class AdViewsTest(TestCase):
     def setUp(self):
+        reset_search_index()
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='testpass123')
         self.user2 = User.objects.create_user(username='user2', password='testpass123')
@@ -425,6 +469,7 @@ class ExchangeProposalViewsTest(TestCase):
         self.assertEqual(self.proposal.status, 'accepted')
         self.assertFalse(self.ad1.is_active, "Объявление отправителя должно быть неактивным")
         self.assertFalse(self.ad2.is_active, "Объявление получателя должно быть неактивным")
+        process_outbox()
         self.assertEqual(Notification.objects.filter(user=self.user1).count(), 1, "Уведомление для отправителя")
         self.assertEqual(Notification.objects.filter(user=self.user2).count(), 1, "Уведомление для получателя")
 
@@ -437,6 +482,7 @@ class ExchangeProposalViewsTest(TestCase):
         self.assertRedirects(response, reverse('exchange_proposal_list'))
         self.proposal.refresh_from_db()
         self.assertEqual(self.proposal.status, 'rejected')
+        process_outbox()
         self.assertEqual(Notification.objects.filter(user=self.user1).count(), 1, "Уведомление для отправителя")
 
     def test_exchange_proposal_update_unauthorized(self):
@@ -502,15 +548,15 @@ class AdAPIViewTest(TestCase):
     def test_ad_list_api(self):
         response = self.client.get(reverse('ad-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], 'Test Ad')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['title'], 'Test Ad')
 
     def test_ad_list_api_inactive(self):
         self.ad.is_active = False
         self.ad.save()
         response = self.client.get(reverse('ad-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_ad_create_api_authenticated(self):
         self.client.login(username='testuser', password='testpass123')
@@ -616,15 +662,15 @@ class ExchangeProposalAPIViewTest(TestCase):
         self.client.login(username='user2', password='testpass123')
         response = self.client.get(reverse('exchangeproposal-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['comment'], 'Test proposal')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['comment'], 'Test proposal')
 
     def test_proposal_list_api_empty(self):
         self.client.login(username='user1', password='testpass123')
         self.proposal.delete()
         response = self.client.get(reverse('exchangeproposal-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_proposal_create_api_authenticated(self):
         self.client.login(username='user1', password='testpass123')
@@ -637,7 +683,6 @@ class ExchangeProposalAPIViewTest(TestCase):
             },
             format='json'
         )
-        print(f"Response status: {response.status_code}, Response data: {response.data}")
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue(ExchangeProposal.objects.filter(comment='API proposal').exists())
 
@@ -663,6 +708,7 @@ class ExchangeProposalAPIViewTest(TestCase):
         self.assertEqual(self.proposal.status, 'accepted')
         self.assertFalse(Ad.objects.get(id=self.ad1.id).is_active)
         self.assertFalse(Ad.objects.get(id=self.ad2.id).is_active)
+        process_outbox()
         self.assertEqual(Notification.objects.filter(user=self.user1).count(), 1)
         self.assertEqual(Notification.objects.filter(user=self.user2).count(), 1)
 
@@ -674,8 +720,26 @@ class ExchangeProposalAPIViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.proposal.refresh_from_db()
         self.assertEqual(self.proposal.status, 'rejected')
+        process_outbox()
         self.assertEqual(Notification.objects.filter(user=self.user1).count(), 1)
 
+    def test_status_not_changed_by_update(self):
+        self.client.login(username='user1', password='testpass123')
+        response = self.client.patch(reverse('exchangeproposal-detail', args=[self.proposal.id]),
+                                     {'status': 'accepted', 'comment': 'Уточнение'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.proposal.refresh_from_db()
+        self.assertEqual(self.proposal.status, 'pending')
+        self.assertEqual(self.proposal.comment, 'Уточнение')
+        self.assertTrue(Ad.objects.get(id=self.ad1.id).is_active)
+        self.assertEqual(NotificationEvent.objects.count(), 0)
+
+    def test_update_only_by_sender(self):
+        self.client.login(username='user2', password='testpass123')
+        response = self.client.patch(reverse('exchangeproposal-detail', args=[self.proposal.id]),
+                                     {'comment': 'Чужое'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_proposal_accept_api_unauthorized(self):
         self.client.login(username='user1', password='testpass123')
         response = self.client.post(
@@ -684,6 +748,1781 @@ class ExchangeProposalAPIViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class SearchTest(TestCase):
+    def setUp(self):
+        reset_search_index()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.phone = Ad.objects.create(
+            user=self.user,
+            title='Смартфон Samsung',
+            description='Телефон в отличном состоянии, есть зарядка',
+            category='electronics',
+            condition='used',
+        )
+        self.books = Ad.objects.create(
+            user=self.user,
+            title='Детективы',
+            description='Подборка книг, подойдут любителям телефонных разговоров',
+            category='books',
+            condition='used',
+        )
+
+    def test_stem(self):
+        self.assertEqual(stem('Книги'), stem('книгой'))
+        self.assertEqual(stem('Phones'), 'phon')
+        self.assertEqual(tokenize('Ёлка, ёлки!'), ['елк', 'елк'])
+
+    def test_russian_stemming(self):
+        ads = search_ads(Ad.objects.all(), 'книга')
+        self.assertEqual(list(ads), [self.books])
+
+    def test_prefix_matching(self):
+        ads = search_ads(Ad.objects.all(), 'смарт')
+        self.assertEqual(list(ads), [self.phone])
+
+    def test_all_terms_required(self):
+        self.assertEqual(list(search_ads(Ad.objects.all(), 'телефон зарядка')), [self.phone])
+        self.assertFalse(search_ads(Ad.objects.all(), 'телефон велосипед').exists())
+
+    def test_ranking_prefers_title(self):
+        self.phone.title = 'Телефон Samsung'
+        self.phone.save()
+        ads = list(search_ads(Ad.objects.all(), 'телефон'))
+        self.assertEqual(ads, [self.phone, self.books])
+        self.assertGreater(ads[0].search_rank, ads[1].search_rank)
+
+    def test_index_follows_updates(self):
+        self.assertTrue(search_ads(Ad.objects.all(), 'детектив').exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books.title = 'Романы'
+            self.books.save()
+        self.assertFalse(search_ads(Ad.objects.all(), 'детектив').exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books.delete()
+        self.assertFalse(search_ads(Ad.objects.all(), 'роман').exists())
+
+    def test_rolled_back_save_not_indexed(self):
+        backend = get_search_backend()
+        if not isinstance(backend, InMemorySearchBackend):
+            self.skipTest('Индекс в памяти используется только без PostgreSQL')
+        self.assertEqual(set(backend.scores('детектив')), {self.books.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.books.title = 'Романы'
+                self.books.save()
+                raise RuntimeError()
+        self.assertEqual(set(backend.scores('детектив')), {self.books.pk})
+        self.assertEqual(backend.scores('роман'), {})
+
+    def test_lazy_build_from_database(self):
+        backend = InMemorySearchBackend()
+        self.assertEqual(set(backend.scores('samsung')), {self.phone.pk})
+
+    def test_empty_query(self):
+        self.assertFalse(search_ads(Ad.objects.all(), '!!!').exists())
+
+    def test_api_search(self):
+        response = APIClient().get(reverse('ad-list'), {'q': 'книг'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([ad['id'] for ad in response.data['results']], [self.books.id])
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        reset_search_index()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        created_at = timezone.now()
+        self.ads = []
+        for i in range(7):
+            ad = Ad.objects.create(user=self.user, title=f'Объявление {i}', description='Описание',
+                                   category='books', condition='used')
+            self.ads.append(ad)
+        # Два объявления с одинаковым created_at проверяют разбор ничьих по id
+        Ad.objects.filter(pk__in=[ad.pk for ad in self.ads[:2]]).update(created_at=created_at)
+        for i, ad in enumerate(self.ads[2:], start=1):
+            Ad.objects.filter(pk=ad.pk).update(created_at=created_at + timedelta(minutes=i))
+        self.expected = list(Ad.objects.order_by('-created_at', '-id'))
+
+    def test_cursor_roundtrip(self):
+        values = [timezone.now(), 0.25, 42]
+        self.assertEqual(decode_cursor(encode_cursor(values, reverse=True)), (values, True))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor')
+
+    def test_walk_forward_and_back(self):
+        paginator = KeysetPaginator(Ad.objects.all(), 3)
+        first = paginator.get_page()
+        self.assertFalse(first.has_previous())
+        second = paginator.get_page(first.next_cursor)
+        third = paginator.get_page(second.next_cursor)
+        self.assertEqual(list(first) + list(second) + list(third), self.expected)
+        self.assertFalse(third.has_next())
+        back = paginator.get_page(third.previous_cursor)
+        self.assertEqual(list(back), list(second))
+        self.assertTrue(back.has_previous())
+        self.assertEqual(list(paginator.get_page(back.previous_cursor)), list(first))
+        self.assertFalse(paginator.get_page(back.previous_cursor).has_previous())
+
+    def test_no_count_or_offset(self):
+        paginator = KeysetPaginator(Ad.objects.all(), 3)
+        cursor = paginator.get_page().next_cursor
+        with self.assertNumQueries(1):
+            page = paginator.get_page(cursor)
+        self.assertEqual(len(page), 3)
+
+    def test_ad_list_view_cursor(self):
+        response = self.client.get(reverse('ad_list'), {'page_size': 4})
+        self.assertEqual(list(response.context['page_obj']), self.expected[:4])
+        next_query = response.context['next_query']
+        response = self.client.get(reverse('ad_list') + '?' + next_query)
+        self.assertEqual(list(response.context['page_obj']), self.expected[4:])
+        self.assertContains(response, 'Пред')
+
+    def test_ad_list_view_invalid_cursor(self):
+        response = self.client.get(reverse('ad_list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page_obj']), self.expected[:5])
+
+    def test_api_cursor(self):
+        client = APIClient()
+        response = client.get(reverse('ad-list'), {'page_size': 5})
+        self.assertIsNone(response.data['previous'])
+        ids = [ad['id'] for ad in response.data['results']]
+        response = client.get(response.data['next'])
+        ids += [ad['id'] for ad in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, [ad.id for ad in self.expected])
+        self.assertEqual(client.get(reverse('ad-list'), {'cursor': 'garbage'}).status_code, 404)
+
+    def test_forged_cursor_types(self):
+        for payload in ({'v': ['abc', 1]}, {'v': [{'dt': timezone.now().isoformat()}, 'zz']}):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+            with self.subTest(payload=payload):
+                response = self.client.get(reverse('ad_list'), {'cursor': cursor})
+                self.assertEqual(list(response.context['page_obj']), self.expected[:5])
+                self.assertEqual(APIClient().get(reverse('ad-list'), {'cursor': cursor}).status_code, 404)
+
+    def test_api_cursor_with_search(self):
+        client = APIClient()
+        response = client.get(reverse('ad-list'), {'q': 'объявление', 'page_size': 4})
+        ids = [ad['id'] for ad in response.data['results']]
+        response = client.get(response.data['next'])
+        ids += [ad['id'] for ad in response.data['results']]
+        self.assertEqual(sorted(ids), sorted(ad.id for ad in self.ads))
+
+
+class QueryCountTest(TestCase):
+    """Число запросов не должно расти вместе с числом объявлений на странице."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.other_ad = Ad.objects.create(user=self.other, title='Other ad', description='Other',
+                                          category='books', condition='used')
+        self.ads = []
+        for i in range(10):
+            ad = Ad.objects.create(user=self.owner, title=f'Ad number {i}', description='Description',
+                                   category='electronics', condition='new')
+            ExchangeProposal.objects.create(ad_sender=self.other_ad, ad_receiver=ad, sender=self.other)
+            self.ads.append(ad)
+
+    def test_ad_list(self):
+        with self.assertNumQueries(2):  # страница и счётчики фильтров (ads.facets)
+            response = self.client.get(reverse('ad_list'))
+        self.assertContains(response, 'owner')
+
+    def test_ad_detail(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('ad_detail', args=[self.ads[0].id]))
+        self.assertEqual(response.context['proposal_count'], 1)
+
+    def test_api_ad_list(self):
+        with self.assertNumQueries(1):
+            response = APIClient().get(reverse('ad-list'), {'page_size': 11})
+        counts = {ad['id']: ad['proposal_count'] for ad in response.data['results']}
+        self.assertEqual(counts, {**{ad.id: 1 for ad in self.ads}, self.other_ad.id: 0})
+
+    def test_api_ad_detail(self):
+        with self.assertNumQueries(1):
+            response = APIClient().get(reverse('ad-detail', args=[self.ads[0].id]))
+        self.assertEqual(response.data['proposal_count'], 1)
+
+
+class PendingProposalCountTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.ad1 = Ad.objects.create(user=self.user1, title='Ad 1', description='First ad',
+                                     category='electronics', condition='new')
+        self.ad2 = Ad.objects.create(user=self.user2, title='Ad 2', description='Second ad',
+                                     category='books', condition='used')
+
+    def assertPendingCount(self, ad, expected):
+        ad.refresh_from_db()
+        self.assertEqual(ad.pending_proposal_count, expected)
+
+    def test_create_view_increments(self):
+        self.client.login(username='user1', password='testpass123')
+        self.client.post(reverse('exchange_proposal_create', args=[self.ad2.id]),
+                         {'ad_sender': self.ad1.id, 'comment': 'Обмен'})
+        self.assertPendingCount(self.ad2, 1)
+
+    def test_update_view_decrements(self):
+        for status_value in ('rejected', 'accepted'):
+            proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+            self.assertPendingCount(self.ad2, 1)
+            self.client.login(username='user2', password='testpass123')
+            self.client.post(reverse('exchange_proposal_update', args=[proposal.id]), {'status': status_value})
+            self.assertPendingCount(self.ad2, 0)
+
+    def test_api_create_accept_reject(self):
+        client = APIClient()
+        client.login(username='user1', password='testpass123')
+        client.post(reverse('exchangeproposal-list'), {'ad_sender': self.ad1.id, 'ad_receiver': self.ad2.id},
+                    format='json')
+        client.post(reverse('exchangeproposal-list'), {'ad_sender': self.ad1.id, 'ad_receiver': self.ad2.id},
+                    format='json')
+        self.assertPendingCount(self.ad2, 2)
+        first, second = ExchangeProposal.objects.order_by('id')
+        client.login(username='user2', password='testpass123')
+        client.post(reverse('exchangeproposal-reject', args=[first.id]))
+        self.assertPendingCount(self.ad2, 1)
+        client.post(reverse('exchangeproposal-accept', args=[second.id]))
+        self.assertPendingCount(self.ad2, 0)
+
+    def test_api_update_keeps_counter(self):
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        ad3 = Ad.objects.create(user=self.user2, title='Ad 3', description='x', category='books', condition='new')
+        client = APIClient()
+        client.login(username='user1', password='testpass123')
+        response = client.patch(reverse('exchangeproposal-detail', args=[proposal.id]),
+                                {'status': 'accepted', 'ad_receiver': ad3.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        proposal.refresh_from_db()
+        self.assertEqual((proposal.status, proposal.ad_receiver_id), ('pending', self.ad2.id))
+        self.assertPendingCount(self.ad2, 1)
+        self.assertPendingCount(ad3, 0)
+
+    def test_api_resolve_twice(self):
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        client = APIClient()
+        client.login(username='user2', password='testpass123')
+        self.assertEqual(client.post(reverse('exchangeproposal-reject', args=[proposal.id])).status_code, 200)
+        self.assertEqual(client.post(reverse('exchangeproposal-reject', args=[proposal.id])).status_code, 400)
+        self.assertPendingCount(self.ad2, 0)
+
+    def test_stale_save_keeps_counter(self):
+        ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        self.ad2.title = 'Ad 2 updated'
+        self.ad2.save()
+        self.assertPendingCount(self.ad2, 1)
+
+    def test_delete_pending_decrements(self):
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        proposal.delete()
+        self.assertPendingCount(self.ad2, 0)
+
+    def test_drifted_counter_does_not_block_accept(self):
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        Ad.objects.filter(pk=self.ad2.pk).update(pending_proposal_count=0)  # строка до backfill
+        client = APIClient()
+        client.login(username='user2', password='testpass123')
+        self.assertEqual(client.post(reverse('exchangeproposal-accept', args=[proposal.id])).status_code, 200)
+        proposal.refresh_from_db()
+        self.assertEqual(proposal.status, 'accepted')
+        self.assertPendingCount(self.ad2, 0)
+
+    def test_repair_command(self):
+        ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        Ad.objects.filter(pk=self.ad2.pk).update(pending_proposal_count=5)
+        Ad.objects.filter(pk=self.ad1.pk).update(pending_proposal_count=3)
+        out = StringIO()
+        call_command('repair_proposal_counts', '--dry-run', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertPendingCount(self.ad2, 5)
+        call_command('repair_proposal_counts', '--batch-size', '1', stdout=StringIO())
+        self.assertPendingCount(self.ad2, 1)
+        self.assertPendingCount(self.ad1, 0)
+
+
+class NotificationCacheTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        Notification.objects.create(user=self.user, message='Первое уведомление')
+        self.client.login(username='testuser', password='testpass123')
+
+    def notification_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in queries.captured_queries if 'ads_notification' in q['sql']]
+
+    def test_cached_after_first_render(self):
+        response, queries = self.notification_queries(reverse('ad_list'))
+        self.assertTrue(queries)
+        self.assertEqual(response.context['unread_notifications_count'], 1)
+        response, queries = self.notification_queries(reverse('ad_list'))
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'Первое уведомление')
+
+    def test_anonymous_has_no_queries(self):
+        self.client.logout()
+        response, queries = self.notification_queries(reverse('register'))
+        self.assertEqual(queries, [])
+        self.assertNotIn('unread_notifications', response.context)
+
+    def test_invalidated_on_create(self):
+        self.client.get(reverse('ad_list'))
+        Notification.objects.create(user=self.user, message='Второе уведомление')
+        response = self.client.get(reverse('ad_list'))
+        self.assertEqual(response.context['unread_notifications_count'], 2)
+        self.assertContains(response, 'Второе уведомление')
+
+    def test_invalidated_on_mark_read(self):
+        self.client.get(reverse('ad_list'))
+        self.client.post(reverse('mark_notifications_read'))
+        response = self.client.get(reverse('ad_list'))
+        self.assertEqual(response.context['unread_notifications_count'], 0)
+        self.assertNotContains(response, 'Первое уведомление')
+
+    def test_count_beyond_latest(self):
+        for i in range(6):
+            Notification.objects.create(user=self.user, message=f'Уведомление {i}')
+        response = self.client.get(reverse('ad_list'))
+        self.assertEqual(response.context['unread_notifications_count'], 7)
+        self.assertEqual(len(response.context['unread_notifications']), 5)
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            caches_setting = {'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': cache_dir,
+            }}
+            with override_settings(CACHES=caches_setting):
+                cache.clear()
+                self.client.get(reverse('ad_list'))
+                response, queries = self.notification_queries(reverse('ad_list'))
+                self.assertEqual(queries, [])
+                self.assertEqual(response.context['unread_notifications_count'], 1)
+
+
+class IndexUsageTest(TestCase):
+    """EXPLAIN ключевых запросов: план должен идти по составным индексам.
+
+    На PostgreSQL последовательное сканирование отключается, иначе на маленьких
+    тестовых таблицах планировщик всегда выбирает seq scan.
+    """
+
+    def setUp(self):
+        reset_search_index()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.ad = Ad.objects.create(user=self.user, title='Test Ad', description='Test',
+                                    category='electronics', condition='new')
+        self.other_ad = Ad.objects.create(user=self.other, title='Other Ad', description='Other',
+                                          category='books', condition='used')
+        ExchangeProposal.objects.create(ad_sender=self.other_ad, ad_receiver=self.ad, sender=self.other)
+        Notification.objects.create(user=self.user, message='Test notification')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), f'{index_names} не используется:\n{plan}')
+
+    def test_active_feed(self):
+        self.assertUsesIndex(Ad.objects.filter(is_active=True).order_by('-created_at', '-id')[:6],
+                             'ads_ad_active_feed_idx')
+
+    @unittest.skipUnless(connection.vendor == 'postgresql',
+                         'SQLite не сопоставляет условие "WHERE is_active" с колонкой индекса')
+    def test_user_active_ads(self):
+        self.assertUsesIndex(Ad.objects.filter(user=self.user, is_active=True), 'ads_ad_user_active_idx')
+
+    def test_sent_proposals(self):
+        self.assertUsesIndex(ExchangeProposal.objects.filter(sender=self.other).order_by('-created_at')[:20],
+                             'ads_proposal_sender_idx')
+
+    def test_proposal_inbox(self):
+        self.assertUsesIndex(ExchangeProposal.objects.filter(receiver=self.user).order_by('-created_at')[:20],
+                             'ads_proposal_inbox_idx', 'ads_proposal_inbox_status_idx')
+
+    def test_proposal_outbox_by_status(self):
+        self.assertUsesIndex(
+            ExchangeProposal.objects.filter(sender=self.other, status='pending').order_by('-created_at')[:20],
+            'ads_proposal_outbox_status_idx', 'ads_proposal_sender_idx',
+        )
+
+    def test_pending_proposals_for_ad(self):
+        self.assertUsesIndex(ExchangeProposal.objects.filter(ad_receiver=self.ad, status='pending'),
+                             'ads_proposal_receiver_idx')
+
+    def test_competing_proposals_from_ad(self):
+        self.assertUsesIndex(ExchangeProposal.objects.filter(ad_sender=self.other_ad, status='pending'),
+                             'ads_proposal_ad_sender_idx')
+
+    def test_unread_notifications(self):
+        self.assertUsesIndex(
+            Notification.objects.filter(user=self.user, is_read=False).order_by('-created_at')[:5],
+            'ads_notif_unread_idx',
+        )
+
+    def test_facets(self):
+        self.assertUsesIndex(
+            Ad.objects.filter(is_active=True).order_by('category', 'condition')
+            .values_list('category', 'condition').annotate(count=Count('pk')),
+            'ads_ad_categor_bb3ce9_idx',
+        )
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Полнотекстовый индекс есть только в PostgreSQL')
+    def test_search(self):
+        self.assertUsesIndex(search_ads(Ad.objects.filter(is_active=True), 'test'), 'ads_ad_search_gin')
+
+
+class ImportExportCommandTest(TestCase):
+    def setUp(self):
+        reset_search_index()
+        self.user = User.objects.create_user(username='partner', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def write_jsonl(self, name, rows):
+        with open(self.path(name), 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        return self.path(name)
+
+    def test_import_jsonl(self):
+        path = self.write_jsonl('ads.jsonl', [
+            {'title': 'Велосипед горный', 'description': 'Почти новый', 'category': 'sports', 'condition': 'like_new'},
+            {'title': 'Куртка', 'description': 'Тёплая', 'category': 'clothing', 'condition': 'used', 'user': 'other'},
+            {'title': 'Книга', 'description': 'Роман', 'category': 'books', 'condition': 'used'},
+        ])
+        out = StringIO()
+        call_command('import_ads', path, '--user', 'partner', '--batch-size', '2', stdout=out)
+        self.assertIn('Импортировано: 3', out.getvalue())
+        self.assertEqual(Ad.objects.get(title='Куртка').user, self.other)
+        self.assertEqual(Ad.objects.filter(user=self.user).count(), 2)
+        self.assertTrue(search_ads(Ad.objects.all(), 'велосипед').exists())
+
+    def test_invalid_rows_cancel_import(self):
+        path = self.write_jsonl('ads.jsonl', [
+            {'title': 'Велосипед горный', 'description': 'Почти новый', 'category': 'sports', 'condition': 'like_new'},
+            {'title': 'Куртка', 'description': 'Тёплая', 'category': 'clothing', 'condition': 'used', 'user': 'other'},
+            {'title': 'Плохая категория', 'description': 'x', 'category': 'cars', 'condition': 'new'},
+            {'title': 'Чужой', 'description': 'x', 'category': 'books', 'condition': 'new', 'user': 'ghost'},
+            {'title': 'Книга', 'description': 'Роман', 'category': 'books', 'condition': 'used'},
+        ])
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Строк с ошибками: 2'):
+            call_command('import_ads', path, '--user', 'partner', '--batch-size', '2', stdout=StringIO(), stderr=err)
+        self.assertIn('Строка 3', err.getvalue())
+        self.assertIn('Строка 4', err.getvalue())
+        self.assertEqual(Ad.objects.count(), 0)
+
+    def test_unreadable_row_after_first_batch_cancels_import(self):
+        path = self.write_jsonl('ads.jsonl', [
+            {'title': f'Книга {i}', 'description': 'x', 'category': 'books', 'condition': 'used'} for i in range(3)
+        ])
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('{"title": "оборванная строка\n')
+        Ad.objects.create(user=self.user, title='Было до импорта', description='x', category='books', condition='new')
+        with self.assertRaisesMessage(CommandError, 'Не удалось прочитать файл'):
+            call_command('import_ads', path, '--user', 'partner', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(Ad.objects.count(), 1)
+
+    def test_import_requires_owner(self):
+        path = self.write_jsonl('ads.jsonl', [
+            {'title': 'Без владельца', 'description': 'x', 'category': 'books', 'condition': 'new'},
+        ])
+        with self.assertRaisesMessage(CommandError, 'Строк с ошибками: 1'):
+            call_command('import_ads', path, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(Ad.objects.exists())
+
+    def test_export_import_roundtrip(self):
+        for i in range(5):
+            Ad.objects.create(user=self.user, title=f'Объявление {i}', description='Описание, с запятой',
+                              category='books', condition='used')
+        Ad.objects.create(user=self.user, title='Неактивное', description='x', category='books',
+                          condition='used', is_active=False)
+        for fmt in ('jsonl', 'csv'):
+            path = self.path(f'export.{fmt}')
+            call_command('export_ads', path, '--chunk-size', '2', stdout=StringIO())
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 5 if fmt == 'jsonl' else 6)
+
+        call_command('import_ads', self.path('export.csv'), stdout=StringIO())
+        self.assertEqual(Ad.objects.filter(is_active=True).count(), 10)
+        with open(self.path('export.jsonl'), encoding='utf-8') as f:
+            first = json.loads(f.readline())
+        self.assertEqual(first['user'], 'partner')
+        self.assertEqual(first['description'], 'Описание, с запятой')
+
+
+class AdBulkAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.url = reverse('ad-bulk')
+
+    def item(self, title, **extra):
+        return {'title': title, 'description': 'Описание', 'category': 'books', 'condition': 'used', **extra}
+
+    def test_bulk_create(self):
+        self.client.login(username='testuser', password='testpass123')
+        payload = [self.item('Первая книга'), self.item('Вторая книга'), self.item('Третья книга')]
+        with self.assertNumQueries(5):  # сессия, пользователь, SAVEPOINT, INSERT, RELEASE
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([ad['index'] for ad in response.data['created']], [0, 1, 2])
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(Ad.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(response.data['created'][0]['user'], 'testuser')
+
+    def test_partial_errors(self):
+        self.client.login(username='testuser', password='testpass123')
+        payload = [self.item('Хорошая'), self.item('Плохая', category='cars'), {'title': 'Без полей'}]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([ad['title'] for ad in response.data['created']], ['Хорошая'])
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('category', response.data['errors'][0]['errors'])
+        self.assertEqual(Ad.objects.count(), 1)
+
+    def test_all_invalid(self):
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(self.url, [{'title': 'x'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ad.objects.exists())
+
+    @override_settings(ADS_BULK_MAX_ITEMS=2)
+    def test_limits_and_shape(self):
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(self.url, [self.item('a')] * 3, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, self.item('Одна'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unauthenticated(self):
+        response = self.client.post(self.url, [self.item('Первая книга')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DecideProposalTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.bidder = User.objects.create_user(username='bidder', password='testpass123')
+        self.rival = User.objects.create_user(username='rival', password='testpass123')
+        self.ad = Ad.objects.create(user=self.owner, title='Гитара', description='x', category='other', condition='used')
+        self.bid_ad = Ad.objects.create(user=self.bidder, title='Самокат', description='x', category='sports',
+                                        condition='used')
+        self.rival_ad = Ad.objects.create(user=self.rival, title='Книга', description='x', category='books',
+                                          condition='new')
+        self.proposal = ExchangeProposal.objects.create(ad_sender=self.bid_ad, ad_receiver=self.ad, sender=self.bidder)
+        # Конкуренты: другое предложение на то же объявление и предложение с участием объявления отправителя
+        self.rival_proposal = ExchangeProposal.objects.create(ad_sender=self.rival_ad, ad_receiver=self.ad,
+                                                              sender=self.rival)
+        self.counter_proposal = ExchangeProposal.objects.create(ad_sender=self.rival_ad, ad_receiver=self.bid_ad,
+                                                                sender=self.rival)
+        self.unrelated = ExchangeProposal.objects.create(ad_sender=self.bid_ad, ad_receiver=self.rival_ad,
+                                                         sender=self.bidder)
+
+    def test_accept_rejects_competitors(self):
+        rejected = decide_proposal(self.proposal, 'accepted')
+        # unrelated тоже задействует объявление отправителя, поэтому отклоняется
+        self.assertEqual({p.pk for p in rejected},
+                         {self.rival_proposal.pk, self.counter_proposal.pk, self.unrelated.pk})
+        statuses = dict(ExchangeProposal.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[self.proposal.pk], 'accepted')
+        self.assertEqual(statuses[self.rival_proposal.pk], 'rejected')
+        self.assertEqual(statuses[self.counter_proposal.pk], 'rejected')
+        counts = dict(Ad.objects.values_list('pk', 'pending_proposal_count'))
+        self.assertEqual(counts, {self.ad.pk: 0, self.bid_ad.pk: 0, self.rival_ad.pk: 0})
+        self.assertFalse(Ad.objects.filter(pk__in=[self.ad.pk, self.bid_ad.pk], is_active=True).exists())
+        process_outbox()
+        self.assertEqual(Notification.objects.filter(user=self.rival).count(), 2)
+
+    def test_competitors_locked_without_joined_ads(self):
+        select_for_update = QuerySet.select_for_update
+        with CaptureQueriesContext(connection) as queries, unittest.mock.patch.object(
+                QuerySet, 'select_for_update', autospec=True, side_effect=select_for_update) as lock:
+            decide_proposal(self.proposal, 'accepted')
+        self.assertIn(('self',), [call.kwargs.get('of') for call in lock.call_args_list])
+        if connection.features.has_select_for_update_of:
+            self.assertTrue(any('FOR UPDATE OF "ads_exchangeproposal"' in query['sql'] for query in queries))
+
+    def test_second_accept_fails(self):
+        decide_proposal(self.proposal, 'accepted')
+        self.rival_proposal.refresh_from_db()
+        with self.assertRaises(ProposalError):
+            decide_proposal(self.rival_proposal, 'accepted')
+
+    def test_stale_instance_cannot_accept_twice(self):
+        stale = ExchangeProposal.objects.get(pk=self.rival_proposal.pk)
+        decide_proposal(self.proposal, 'accepted')
+        with self.assertRaisesMessage(ProposalError, 'неактивно'):
+            decide_proposal(stale, 'accepted')
+        with self.assertRaisesMessage(ProposalError, 'уже обработано'):
+            decide_proposal(stale, 'rejected')
+        self.assertEqual(ExchangeProposal.objects.filter(status='accepted').count(), 1)
+
+    def test_reject_keeps_others(self):
+        self.assertEqual(decide_proposal(self.proposal, 'rejected'), [])
+        self.assertEqual(ExchangeProposal.objects.filter(status='pending').count(), 3)
+        self.assertTrue(Ad.objects.get(pk=self.ad.pk).is_active)
+
+    def test_api_accept_requires_pending(self):
+        client = APIClient()
+        client.login(username='owner', password='testpass123')
+        self.assertEqual(client.post(reverse('exchangeproposal-accept', args=[self.proposal.id])).status_code, 200)
+        response = client.post(reverse('exchangeproposal-accept', args=[self.rival_proposal.id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ExchangeProposal.objects.filter(status='accepted').count(), 1)
+
+
+class NotificationOutboxTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.ad1 = Ad.objects.create(user=self.user1, title='Ad 1', description='x', category='books', condition='new')
+        self.ad2 = Ad.objects.create(user=self.user2, title='Ad 2', description='x', category='books', condition='new')
+
+    def test_request_writes_single_event(self):
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        self.client.login(username='user2', password='testpass123')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('exchange_proposal_update', args=[proposal.id]), {'status': 'accepted'})
+        writes = [q['sql'] for q in queries.captured_queries
+                  if q['sql'].startswith('INSERT') and 'notification' in q['sql']]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('ads_notificationevent', writes[0])
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(process_outbox(), 2)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_burst_is_coalesced(self):
+        for _ in range(3):
+            send_notifications([(self.user1.id, 'Одинаковое'), (self.user2.id, 'Другое')])
+        with self.assertNumQueries(6):  # SAVEPOINT, SELECT событий, SELECT пользователей, INSERT, DELETE, RELEASE
+            self.assertEqual(process_outbox(), 2)
+        self.assertEqual(Notification.objects.filter(user=self.user1).count(), 1)
+        self.assertEqual(process_outbox(), 0)
+
+    def test_deleted_user_does_not_block_queue(self):
+        send_notifications([(self.user1.id, 'Первое')])
+        send_notifications([(self.user2.id, 'Удалённому'), (self.user1.id, 'Второе')])
+        self.user2.delete()
+        self.assertEqual(process_outbox(), 2)
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertEqual(Notification.objects.filter(user=self.user1).count(), 2)
+
+    def test_delivery_invalidates_summary(self):
+        self.client.login(username='user1', password='testpass123')
+        self.client.get(reverse('ad_list'))
+        send_notifications([(self.user1.id, 'Новое событие')])
+        process_outbox()
+        response = self.client.get(reverse('ad_list'))
+        self.assertEqual(response.context['unread_notifications_count'], 1)
+
+    def test_batches_and_command(self):
+        for i in range(5):
+            send_notifications([(self.user1.id, f'Уведомление {i}')])
+        self.assertEqual(process_outbox(batch_size=2), 2)
+        out = StringIO()
+        call_command('process_notifications', '--batch-size', '2', stdout=out)
+        self.assertIn('Создано уведомлений: 3', out.getvalue())
+        self.assertEqual(Notification.objects.count(), 5)
+
+    @override_settings(ADS_NOTIFICATIONS_EAGER=True)
+    def test_eager_mode(self):
+        send_notifications([(self.user1.id, 'Сразу')])
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertTrue(Notification.objects.filter(user=self.user1, message='Сразу').exists())
+
+
+@override_settings(ADS_STREAM_ENABLED=True, ADS_PUBSUB_BACKEND='ads.pubsub.InProcessBroker')
+class NotificationStreamTest(TestCase):
+    def setUp(self):
+        pubsub._broker = None
+        self.user = User.objects.create_user(username='user1', password='testpass123')
+
+    def test_anonymous_gets_401(self):
+        response = self.client.get(reverse('notifications_stream'))
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(ADS_STREAM_ENABLED=False)
+    def test_disabled_under_wsgi(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('notifications_stream'))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stream_delivers_published_event(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('notifications_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        pubsub.get_broker().publish(self.user.pk, {'type': 'notification', 'message': 'Привет'})
+        chunk = (await asyncio.wait_for(anext(stream), 1)).decode()
+        self.assertTrue(chunk.startswith('event: notification\n'))
+        self.assertIn('Привет', chunk)
+        await stream.aclose()
+
+    @override_settings(ADS_STREAM_MAX_PER_USER=1)
+    async def test_connection_limit(self):
+        await self.async_client.aforce_login(self.user)
+        first = await self.async_client.get(reverse('notifications_stream'))
+        second = await self.async_client.get(reverse('notifications_stream'))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 503)
+        await first.streaming_content.aclose()
+
+    @override_settings(ADS_STREAM_QUEUE_SIZE=2)
+    async def test_slow_client_gets_resync(self):
+        broker = pubsub.get_broker()
+        subscription = broker.subscribe(self.user.pk)
+        for i in range(3):
+            broker.publish(self.user.pk, {'type': 'notification', 'id': i})
+        await asyncio.sleep(0)
+        self.assertEqual(await subscription.get(timeout=1), {'type': 'resync'})
+        self.assertTrue(subscription.queue.empty())
+        subscription.close()
+        self.assertEqual(broker.subscriber_count, 0)
+
+    def test_new_notification_published_after_commit(self):
+        received = []
+        broker = pubsub.get_broker()
+        broker.publish = lambda user_id, event: received.append((user_id, event))
+        with self.captureOnCommitCallbacks(execute=True):
+            send_notifications([(self.user.id, 'Новое предложение')])
+            process_outbox()
+            self.assertEqual(received, [])
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0][0], self.user.id)
+        self.assertEqual(received[0][1]['message'], 'Новое предложение')
+
+
+    @override_settings(ADS_PUBSUB_BACKEND='ads.pubsub.PollingBroker', ADS_STREAM_POLL_INTERVAL=0.01)
+    async def test_worker_notification_reaches_subscriber(self):
+        broker = pubsub.get_broker()
+        subscription = broker.subscribe(self.user.pk)
+        while broker._last_id is None:  # опрос запомнил последнее уведомление
+            await asyncio.sleep(0.01)
+        await sync_to_async(send_notifications)([(self.user.id, 'Из очереди')])
+        await sync_to_async(call_command)('process_notifications', stdout=StringIO())
+        event = await subscription.get(timeout=2)
+        self.assertEqual(event['type'], 'notification')
+        self.assertEqual(event['message'], 'Из очереди')
+        subscription.close()
+        broker._task.cancel()
+
+    def test_in_process_broker_needs_eager(self):
+        with override_settings(ADS_NOTIFICATIONS_EAGER=False):
+            self.assertEqual([error.id for error in check_pubsub_backend(None)], ['ads.E001'])
+        with override_settings(ADS_NOTIFICATIONS_EAGER=True):
+            self.assertEqual(check_pubsub_backend(None), [])
+        with override_settings(ADS_PUBSUB_BACKEND='ads.pubsub.PollingBroker'):
+            self.assertEqual(check_pubsub_backend(None), [])
+
+
+class MatchingTest(TestCase):
+    def setUp(self):
+        get_matching_graph().reset()
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpass123') for i in range(3)]
+        self.ads = [
+            Ad.objects.create(user=self.users[0], title='Книга', description='x', category='books', condition='new'),
+            Ad.objects.create(user=self.users[1], title='Телефон', description='x', category='electronics', condition='used'),
+            Ad.objects.create(user=self.users[2], title='Мяч', description='x', category='sports', condition='new'),
+        ]
+
+    def find(self, ad, max_length=4):
+        cycles, truncated = get_matching_graph().find_cycles(ad.pk, max_length, 20, 10000)
+        self.assertFalse(truncated)
+        return [[(step['ad'], step['giver'], step['receiver']) for step in cycle] for cycle in cycles]
+
+    def make_triangle(self):
+        Wish.objects.create(user=self.users[0], category='electronics')
+        Wish.objects.create(user=self.users[1], category='sports', condition='new')
+        Wish.objects.create(user=self.users[2], category='books')
+
+    def test_direct_swap_from_proposal_and_wish(self):
+        self.find(self.ads[0])  # граф строится до изменений и дальше обновляется сигналами
+        with self.captureOnCommitCallbacks(execute=True):
+            ExchangeProposal.objects.create(ad_sender=self.ads[0], ad_receiver=self.ads[1], sender=self.users[0])
+        self.assertEqual(self.find(self.ads[0]), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Wish.objects.create(user=self.users[1], category='books')
+        u0, u1 = self.users[0].pk, self.users[1].pk
+        self.assertEqual(self.find(self.ads[0]), [[(self.ads[0].pk, u0, u1), (self.ads[1].pk, u1, u0)]])
+
+    def test_three_party_cycle(self):
+        self.make_triangle()
+        u0, u1, u2 = (user.pk for user in self.users)
+        self.assertEqual(self.find(self.ads[0]), [[
+            (self.ads[0].pk, u0, u2), (self.ads[1].pk, u1, u0), (self.ads[2].pk, u2, u1),
+        ]])
+        self.assertEqual(self.find(self.ads[0], max_length=2), [])
+
+    def test_incremental_updates(self):
+        self.make_triangle()
+        self.assertEqual(len(self.find(self.ads[0])), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ads[2].is_active = False
+            self.ads[2].save()
+        self.assertEqual(self.find(self.ads[0]), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ads[2].is_active = True
+            self.ads[2].save()
+            Wish.objects.filter(user=self.users[1]).delete()
+        self.assertEqual(self.find(self.ads[0]), [])
+
+    def test_rolled_back_changes_not_in_graph(self):
+        self.make_triangle()
+        self.assertEqual(len(self.find(self.ads[0])), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.ads[2].is_active = False
+                self.ads[2].save()
+                Ad.objects.create(user=self.users[2], title='Ракетка', description='x', category='sports', condition='new')
+                raise RuntimeError()
+        self.assertEqual(len(self.find(self.ads[0])), 1)
+
+    def test_accepted_proposal_leaves_graph(self):
+        self.make_triangle()
+        extra = Ad.objects.create(user=self.users[1], title='Ноутбук', description='x', category='electronics', condition='new')
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ads[2], ad_receiver=extra, sender=self.users[2])
+        self.find(self.ads[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            decide_proposal(proposal, 'accepted')
+        self.assertEqual(self.find(self.ads[0]), [])
+
+    def test_incremental_graph_matches_rebuild(self):
+        self.find(self.ads[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_triangle()
+            ExchangeProposal.objects.create(ad_sender=self.ads[1], ad_receiver=self.ads[0], sender=self.users[1])
+        incremental = [self.find(ad) for ad in self.ads]
+        get_matching_graph().reset()
+        self.assertEqual([self.find(ad) for ad in self.ads], incremental)
+
+    def test_stale_graph_is_rebuilt(self):
+        self.make_triangle()
+        self.assertEqual(len(self.find(self.ads[0])), 1)
+        # Изменение из другого процесса: сигналы сюда не доходят
+        Ad.objects.filter(pk=self.ads[2].pk).update(is_active=False)
+        self.assertEqual(len(self.find(self.ads[0])), 1)
+        with override_settings(ADS_MATCHING_REFRESH=-1):
+            self.assertEqual(self.find(self.ads[0]), [])
+
+    def test_api_skips_closed_ads(self):
+        self.make_triangle()
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        url = reverse('ad-cycles', args=[self.ads[0].pk])
+        self.assertEqual(len(client.get(url).data['cycles']), 1)
+        Ad.objects.filter(pk=self.ads[2].pk).update(is_active=False)  # граф ещё не знает
+        self.assertEqual(client.get(url).data['cycles'], [])
+
+    def test_changes_during_build_are_kept(self):
+        self.make_triangle()
+        graph = MatchingGraph()
+        load = matching._Graph.load
+
+        def load_then_close_ad(state, *rows):
+            load(state, *rows)
+            graph.remove_ads([self.ads[2].pk])  # коммит другого потока, пока граф строится
+
+        with unittest.mock.patch.object(matching._Graph, 'load', load_then_close_ad):
+            self.assertEqual(graph.find_cycles(self.ads[0].pk, 4, 20, 10000), ([], False))
+
+    def test_search_does_not_block_writers(self):
+        self.make_triangle()
+        graph = MatchingGraph()
+        graph.find_cycles(self.ads[0].pk, 4, 20, 10000)
+        distances = matching._Graph._distances
+        writers = []
+
+        def distances_with_writer(state, *args):
+            writer = threading.Thread(target=graph.remove_ads, args=([self.ads[2].pk],))
+            writer.start()
+            writer.join(timeout=5)
+            writers.append(writer.is_alive())
+            return distances(state, *args)
+
+        with unittest.mock.patch.object(matching._Graph, '_distances', distances_with_writer):
+            graph.find_cycles(self.ads[0].pk, 4, 20, 10000)
+        self.assertEqual(writers, [False])
+        self.assertEqual(graph.find_cycles(self.ads[0].pk, 4, 20, 10000), ([], False))
+
+    def test_budget(self):
+        graph = MatchingGraph()
+        graph.load(
+            ads=[(i, i, 'books', 'new') for i in range(1, 200)],
+            wishes=[(i, i, 'books', None) for i in range(1, 200)],
+        )
+        cycles, truncated = graph.find_cycles(1, 4, 1000, 50)
+        self.assertTrue(truncated)
+        cycles, truncated = graph.find_cycles(1, 2, 5, 100000)
+        self.assertEqual(len(cycles), 5)
+
+    def test_api(self):
+        self.make_triangle()
+        client = APIClient()
+        url = reverse('ad-cycles', args=[self.ads[0].pk])
+        self.assertEqual(client.get(url).status_code, 403)
+        client.force_authenticate(user=self.users[0])
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        cycle = response.data['cycles'][0]
+        self.assertEqual(cycle['length'], 3)
+        self.assertEqual([step['ad']['title'] for step in cycle['steps']], ['Книга', 'Телефон', 'Мяч'])
+        self.assertEqual(cycle['steps'][0]['receiver'], 'user2')
+        self.assertEqual(client.get(url, {'max_length': 2}).data['cycles'], [])
+
+    def test_wish_api(self):
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        response = client.post(reverse('wish-list'), {'category': 'books'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data['condition'])
+        response = client.post(reverse('wish-list'), {'category': 'books'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(client.get(reverse('wish-list')).data), 1)
+
+
+class SuggestionTest(TestCase):
+    def setUp(self):
+        reset_suggestion_index()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.user = User.objects.create_user(username='user1', password='testpass123')
+        self.ad = Ad.objects.create(user=self.owner, title='Смартфон Samsung Galaxy', description='Телефон в хорошем состоянии',
+                                    category='electronics', condition='used')
+        self.phone = Ad.objects.create(user=self.user, title='Телефон Samsung', description='Старый смартфон',
+                                       category='electronics', condition='used')
+        self.book = Ad.objects.create(user=self.user, title='Книга про Python', description='Учебник',
+                                      category='books', condition='new')
+        self.headphones = Ad.objects.create(user=self.user, title='Наушники', description='Беспроводные',
+                                            category='electronics', condition='new')
+        self.index = build_suggestion_index()
+
+    def test_ranking(self):
+        ranked = [ad for ad, _ in suggest_ads(self.ad, self.user)]
+        self.assertEqual(ranked, [self.phone, self.headphones, self.book])
+        self.assertEqual(suggest_ads(self.ad, self.owner), [])
+
+    def test_served_from_index(self):
+        get_suggestion_index()
+        with self.assertNumQueries(1):  # только загрузка найденных объявлений по pk
+            self.assertEqual(len(suggest_ads(self.ad, self.user, limit=2)), 2)
+
+    def test_first_request_does_not_build(self):
+        reset_suggestion_index()
+        with unittest.mock.patch('ads.suggestions.threading.Thread') as thread, self.assertNumQueries(0):
+            self.assertEqual(suggest_ads(self.ad, self.user), [])
+        thread.assert_called_once()
+        with unittest.mock.patch('ads.suggestions.connections'):
+            thread.call_args.kwargs['target']()
+        self.assertEqual(suggest_ads(self.ad, self.user)[0][0], self.phone)
+
+    def test_stale_index(self):
+        index = get_suggestion_index()
+        self.phone.is_active = False
+        self.phone.save()
+        new_ad = Ad.objects.create(user=self.user, title='Смартфон Samsung', description='Телефон',
+                                   category='electronics', condition='used')
+        self.assertNotIn(self.phone, [ad for ad, _ in suggest_ads(self.ad, self.user)])
+        with override_settings(ADS_SUGGESTIONS_REFRESH=-1), \
+                unittest.mock.patch('ads.suggestions.threading.Thread') as thread:
+            # Пока идёт перестройка, отдаётся прежний индекс и второй поток не запускается
+            self.assertIs(get_suggestion_index(), index)
+            self.assertIs(get_suggestion_index(), index)
+            thread.assert_called_once()
+            with unittest.mock.patch('ads.suggestions.connections'):
+                thread.call_args.kwargs['target']()
+            ranked = [ad for ad, _ in suggest_ads(self.ad, self.user)]
+        self.assertIsNot(get_suggestion_index(), index)
+        self.assertEqual(ranked[0], new_ad)
+
+    def test_sparse_vectors(self):
+        index = self.index
+        # Строки нормированы, а столбцов заметно меньше размерности
+        rows = np.arange(len(index.ids))
+        lengths = np.diff(index.indptr)
+        self.assertLess(lengths.max(), len(index.idf) // 4)
+        norms = np.bincount(np.repeat(rows, lengths), weights=index.data ** 2, minlength=len(rows))
+        np.testing.assert_allclose(norms, 1.0, rtol=1e-5)
+        row = int(np.flatnonzero(index.ids == self.phone.pk)[0])
+        vector = index.vectorize(self.phone.title, self.phone.description)
+        self.assertAlmostEqual(float(index.similarity(np.array([row]), vector)[0]), 1.0, places=5)
+
+    def test_unknown_choices(self):
+        index = SuggestionIndex.from_rows([
+            (-1, self.user.pk, 'vehicles', 'broken', 'Велосипед', ''),
+            (-2, self.user.pk, 'electronics', 'like_new', 'Велосипед', ''),
+        ], 64)
+        self.ad.category, self.ad.condition = 'vehicles', 'broken'
+        self.ad.title = self.ad.description = 'Велосипед'
+        scores = dict(index.suggest(self.ad, self.user.pk, 5))
+        # Неизвестные значения не совпадают ни с electronics, ни друг с другом
+        self.assertEqual(scores[-1], scores[-2])
+        self.ad.category, self.ad.condition = 'electronics', 'new'
+        scores = dict(index.suggest(self.ad, self.user.pk, 5))
+        self.assertAlmostEqual(scores[-2] - scores[-1], CATEGORY_WEIGHT + CONDITION_WEIGHT * 0.7, places=4)
+
+    def test_index_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'suggestions.npz')
+            with override_settings(ADS_SUGGESTIONS_INDEX_PATH=path):
+                call_command('build_suggestions', stdout=StringIO())
+                index = get_suggestion_index()
+                self.assertEqual(sorted(index.ids.tolist()), sorted(Ad.objects.values_list('pk', flat=True)))
+                self.assertEqual(suggest_ads(self.ad, self.user)[0][0], self.phone)
+
+    def test_index_file_not_built_yet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'suggestions.npz')
+            with override_settings(ADS_SUGGESTIONS_INDEX_PATH=path), \
+                    unittest.mock.patch('ads.suggestions.threading.Thread') as thread:
+                reset_suggestion_index()
+                self.assertEqual(suggest_ads(self.ad, self.user), [])
+                np.savez(path, ids=np.array([self.phone.pk]))  # файл старого формата
+                with self.assertLogs('ads.suggestions', 'ERROR'):
+                    self.assertIsNone(get_suggestion_index())
+                self.assertIsNone(get_suggestion_index())  # не перечитывается до изменения
+            thread.assert_not_called()
+
+    def test_empty_index(self):
+        index = SuggestionIndex.from_rows([], 64)
+        self.assertEqual(index.suggest(self.ad, self.user.pk, 5), [])
+
+    def test_detail_panel_and_api(self):
+        self.client.login(username='user1', password='testpass123')
+        response = self.client.get(reverse('ad_detail', args=[self.ad.id]))
+        self.assertEqual(response.context['suggestions'][0][0], self.phone)
+        self.assertContains(response, f'?ad_sender={self.phone.pk}')
+        response = self.client.get(reverse('ad_detail', args=[self.phone.id]))
+        self.assertNotIn('suggestions', response.context)
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get(reverse('ad-suggestions', args=[self.ad.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['ad']['id'] for item in response.data],
+                         [self.phone.id, self.headphones.id, self.book.id])
+        self.assertGreater(response.data[0]['score'], response.data[-1]['score'])
+
+
+class HttpCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.ad1 = Ad.objects.create(user=self.user1, title='Ad 1', description='x', category='books', condition='new')
+        self.ad2 = Ad.objects.create(user=self.user2, title='Ad 2', description='x', category='books', condition='new')
+
+    def test_ad_list_not_modified(self):
+        response = self.client.get(reverse('ad_list'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0), self.assertTemplateNotUsed('ads/ad_list.html'):
+            response = self.client.get(reverse('ad_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('ad_list'), {'category': 'books'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_full_page_cache(self):
+        first = self.client.get(reverse('ad_list'))
+        with self.assertNumQueries(0), self.assertTemplateNotUsed('ads/ad_list.html'):
+            second = self.client.get(reverse('ad_list'))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_owner_rename_changes_page(self):
+        etag = self.client.get(reverse('ad_list'))['ETag']
+        self.client.login(username='user1', password='testpass123')  # вход ленту не сбрасывает
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('ad_list'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.user1.username = 'renamed'
+        self.user1.save()
+        response = self.client.get(reverse('ad_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'renamed')
+
+        client = APIClient()
+        etag = client.get(reverse('ad-list'))['ETag']
+        User.objects.filter(pk=self.user1.pk).update(username='renamed-again')
+        response = client.get(reverse('ad-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_changes_etag(self):
+        etag = self.client.get(reverse('ad_list'))['ETag']
+        self.ad1.title = 'Новое название'
+        self.ad1.save()
+        response = self.client.get(reverse('ad_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новое название')
+
+    def test_deactivation_by_update_changes_etag(self):
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        etag = self.client.get(reverse('ad_list'))['ETag']
+        decide_proposal(proposal, 'accepted')
+        response = self.client.get(reverse('ad_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Ad 1')
+
+    def test_ad_detail_last_modified(self):
+        response = self.client.get(reverse('ad_detail', args=[self.ad1.id]))
+        response = self.client.get(reverse('ad_detail', args=[self.ad1.id]),
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_authenticated_not_cached(self):
+        self.client.login(username='user1', password='testpass123')
+        response = self.client.get(reverse('ad_list'))
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_api_conditional_get(self):
+        client = APIClient()
+        response = client.get(reverse('ad-list'))
+        with self.assertNumQueries(1):
+            self.assertEqual(client.get(reverse('ad-list'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        url = reverse('ad-detail', args=[self.ad2.id])
+        etag = client.get(url)['ETag']
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['proposal_count'], 1)
+
+
+class AdCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.ad1 = Ad.objects.create(user=self.user1, title='Ad 1', description='x', category='books', condition='new')
+        self.ad2 = Ad.objects.create(user=self.user2, title='Ad 2', description='x', category='books', condition='new')
+
+    def test_cards_shared_between_users(self):
+        self.client.login(username='user1', password='testpass123')
+        response = self.client.get(reverse('ad_list'))
+        self.assertTemplateUsed(response, 'ads/_ad_card.html')
+        self.assertContains(response, reverse('ad_edit', args=[self.ad1.id]))
+        self.assertContains(response, reverse('exchange_proposal_create', args=[self.ad2.id]))
+
+        self.client.login(username='user2', password='testpass123')
+        with self.assertTemplateNotUsed('ads/_ad_card.html'):
+            response = self.client.get(reverse('ad_list'))
+        self.assertContains(response, reverse('ad_edit', args=[self.ad2.id]))
+        self.assertNotContains(response, reverse('ad_edit', args=[self.ad1.id]))
+        self.assertContains(response, reverse('ad_detail', args=[self.ad1.id]))
+
+    def test_edit_invalidates_card(self):
+        render_cards([self.ad1])
+        self.ad1.title = 'Новое название'
+        self.ad1.save()
+        self.assertIsNone(cache.get(card_key(self.ad1.id)))
+        _, start, _ = render_cards([self.ad1])[0]
+        self.assertIn('Новое название', start)
+
+    def test_stale_version_is_rerendered(self):
+        render_cards([self.ad1])
+        Ad.objects.filter(pk=self.ad1.pk).update(title='Обновлено', updated_at=timezone.now())
+        self.ad1.refresh_from_db()
+        self.assertIn('Обновлено', render_cards([self.ad1])[0][1])
+
+    def test_deactivation_invalidates_card(self):
+        render_cards([self.ad1, self.ad2])
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ad1, ad_receiver=self.ad2, sender=self.user1)
+        decide_proposal(proposal, 'accepted')
+        self.assertEqual(cache.get_many([card_key(self.ad1.id), card_key(self.ad2.id)]), {})
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='testpass123')
+        for i in range(3):
+            Ad.objects.create(user=self.user, title=f'Ad {i}', description='x', category='books', condition='new')
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=1.0)
+    def test_server_timing_header(self):
+        self.client.login(username='user1', password='testpass123')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('ad_list'))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn(f'desc="{len(queries.captured_queries)} queries"', timing)
+        for metric in ('tpl;dur=', 'app;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=1.0)
+    async def test_async_views_measured(self):
+        await self.async_client.aforce_login(self.user)
+        with override_settings(ROOT_URLCONF=ASYNC_URLCONF):
+            response = await self.async_client.get('/api/ads/')
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=1.0)
+    def test_streaming_not_measured(self):
+        from ads.metrics import RequestMetricsMiddleware
+
+        middleware = RequestMetricsMiddleware(lambda request: StreamingHttpResponse(iter(['data'])))
+        response = middleware(RequestFactory().get('/notifications/stream/'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=0.0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse('ad_list'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=1.0, ADS_METRICS_SLOW_QUERIES=1)
+    def test_slow_log_names_drf_action_and_duplicates(self):
+        self.client.login(username='user1', password='testpass123')
+        with self.assertLogs('ads.metrics', 'WARNING') as logs:
+            self.client.get(reverse('ad-list'))
+        self.assertIn('AdViewSet.list', logs.output[0])
+        self.assertEqual(logs.records[0].view, 'AdViewSet.list')
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=1.0, ADS_METRICS_SLOW_MS=1000000, ADS_METRICS_SLOW_QUERIES=1000)
+    def test_fast_request_not_logged(self):
+        with self.assertNoLogs('ads.metrics'):
+            self.client.get(reverse('ad_list'))
+
+    @override_settings(ADS_METRICS_SAMPLE_RATE=1.0)
+    def test_duplicated_statements_reported(self):
+        from ads.metrics import RequestMetrics
+
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for ad in Ad.objects.all():
+                User.objects.get(pk=ad.user_id)
+        self.assertEqual(metrics.queries, 4)
+        (statement, count), = metrics.duplicates()
+        self.assertEqual(count, 3)
+        self.assertIn('auth_user', statement)
+
+
+class LoggingTest(TestCase):
+    def make_record(self, name, level=logging.INFO, msg='сообщение %s', args=(1,)):
+        return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+    def test_sampling_by_logger_prefix(self):
+        sampling = SamplingFilter(rate=1.0, rates={'ads': 1.0, 'ads.views': 0.0})
+        self.assertFalse(sampling.filter(self.make_record('ads.views')))
+        self.assertFalse(sampling.filter(self.make_record('ads.views.detail')))
+        self.assertTrue(sampling.filter(self.make_record('ads.viewsets')))
+        self.assertTrue(sampling.filter(self.make_record('ads.views', logging.WARNING)))
+        self.assertTrue(sampling.filter(self.make_record('django.request')))
+
+    def test_queue_handler_writes_in_background(self):
+        target = logging.handlers.BufferingHandler(capacity=100)
+        target.name = 'ads-test-target'
+        handler = QueueListenerHandler(handlers=['ads-test-target'])
+        handler.setFormatter(KeyValueFormatter('%(message)s'))
+        self.addCleanup(target.close)
+        try:
+            handler.handle(self.make_record('ads.test', args=([1, 2],)))
+        finally:
+            handler.close()  # дожидается, пока фоновый поток разберёт очередь
+        record, = target.buffer
+        self.assertEqual(record.msg, 'сообщение [1, 2]')
+        self.assertIsNone(record.args)
+
+    def test_queue_handler_unknown_target(self):
+        handler = QueueListenerHandler(handlers=['ads-test-missing'])
+        self.addCleanup(handler.close)
+        with self.assertRaisesMessage(ValueError, "'ads-test-missing'"):
+            handler.start()
+
+    def test_key_value_formatter_appends_extra(self):
+        record = self.make_record('ads.metrics')
+        record.queries = 3
+        self.assertEqual(KeyValueFormatter('%(message)s').format(record), 'сообщение 1 queries=3')
+
+    def test_proposal_create_logs_instead_of_print(self):
+        user1 = User.objects.create_user(username='user1', password='testpass123')
+        user2 = User.objects.create_user(username='user2', password='testpass123')
+        Ad.objects.create(user=user1, title='Ad 1', description='x', category='books', condition='new')
+        ad2 = Ad.objects.create(user=user2, title='Ad 2', description='x', category='books', condition='new')
+        self.client.login(username='user1', password='testpass123')
+        with self.assertLogs('ads.views', 'DEBUG') as logs, redirect_stdout(StringIO()) as stdout:
+            response = self.client.get(reverse('exchange_proposal_create', args=[ad2.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('has_ads=True', logs.output[0])
+        self.assertEqual(stdout.getvalue(), '')
+
+
+class ProposalMailboxTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.ad1 = Ad.objects.create(user=self.user1, title='Ad 1', description='x', category='books', condition='new')
+        self.ad2 = Ad.objects.create(user=self.user2, title='Ad 2', description='x', category='books', condition='new')
+        now = timezone.now()
+        self.proposals = []
+        for i in range(7):
+            # чередуем входящие и исходящие для user1
+            sender_ad, receiver_ad = (self.ad2, self.ad1) if i % 2 else (self.ad1, self.ad2)
+            proposal = ExchangeProposal.objects.create(
+                ad_sender=sender_ad, ad_receiver=receiver_ad, sender=sender_ad.user,
+                status='rejected' if i % 3 == 0 else 'pending',
+            )
+            ExchangeProposal.objects.filter(pk=proposal.pk).update(created_at=now - timedelta(minutes=i))
+            self.proposals.append(proposal)
+
+    def test_receiver_is_ad_owner(self):
+        self.assertEqual({p.receiver_id for p in self.proposals if p.ad_receiver_id == self.ad1.id}, {self.user1.id})
+
+    def test_merged_pages_in_order_both_directions(self):
+        paginator = MergedKeysetPaginator(proposal_mailbox(self.user1, 'all'), 3)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([p.pk for page in pages for p in page], [p.pk for p in self.proposals])
+        previous = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual([p.pk for p in previous], [p.pk for p in pages[-2]])
+
+    def test_api_inbox_outbox_and_status(self):
+        client = APIClient()
+        client.login(username='user1', password='testpass123')
+        inbox = client.get(reverse('exchangeproposal-inbox')).data['results']
+        self.assertEqual([item['id'] for item in inbox], [p.pk for p in self.proposals[1::2]])
+        outbox = client.get(reverse('exchangeproposal-outbox'), {'status': 'rejected'}).data['results']
+        self.assertEqual([item['id'] for item in outbox], [self.proposals[0].pk, self.proposals[6].pk])
+        response = client.get(reverse('exchangeproposal-inbox'), {'status': 'unknown'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(client.get(reverse('exchangeproposal-list')).data['results']), 7)
+
+    def test_list_queries_do_not_grow(self):
+        self.client.login(username='user1', password='testpass123')
+        self.client.get(reverse('exchange_proposal_list'))  # прогрев кэша уведомлений
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('exchange_proposal_list'))
+        for _ in range(10):
+            ExchangeProposal.objects.create(ad_sender=self.ad2, ad_receiver=self.ad1, sender=self.user2)
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(reverse('exchange_proposal_list'))
+        self.assertEqual(len(after.captured_queries), len(before.captured_queries))
+        self.assertContains(response, reverse('proposal_inbox'))
+
+    def test_box_view_status_filter(self):
+        self.client.login(username='user2', password='testpass123')
+        response = self.client.get(reverse('proposal_inbox'), {'status': 'rejected'})
+        self.assertEqual([p.pk for p in response.context['page_obj']], [self.proposals[0].pk, self.proposals[6].pk])
+        self.assertContains(response, 'Принять', count=0)
+        response = self.client.get(reverse('proposal_inbox'), {'status': 'pending'})
+        self.assertContains(response, 'Принять', count=len(response.context['page_obj']))
+
+
+@override_settings(ADS_DB_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def run_request(self, request, write=False):
+        seen = {}
+
+        def view(request):
+            seen['before'] = self.router.db_for_read(Ad)
+            if write:
+                seen['write'] = self.router.db_for_write(Ad)
+                seen['after'] = self.router.db_for_read(Ad)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return seen, response
+
+    def test_safe_request_reads_from_one_replica(self):
+        seen, response = self.run_request(self.factory.get('/ads/'))
+        self.assertIn(seen['before'], ['replica1', 'replica2'])
+        self.assertNotIn(settings.ADS_REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_write_pins_client_to_primary(self):
+        seen, response = self.run_request(self.factory.post('/ads/create/'), write=True)
+        self.assertIsNone(seen['before'])
+        self.assertEqual(seen['write'], 'default')
+        self.assertEqual(response.cookies[settings.ADS_REPLICA_PIN_COOKIE]['max-age'], settings.ADS_REPLICA_PIN_SECONDS)
+
+        request = self.factory.get('/ads/')
+        request.COOKIES[settings.ADS_REPLICA_PIN_COOKIE] = '1'
+        seen, _ = self.run_request(request)
+        self.assertIsNone(seen['before'])
+
+    def test_write_during_get_switches_reads_to_primary(self):
+        seen, response = self.run_request(self.factory.get('/ads/'), write=True)
+        self.assertIn(seen['before'], ['replica1', 'replica2'])
+        self.assertIsNone(seen['after'])
+        self.assertIn(settings.ADS_REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_outside_request_reads_primary(self):
+        self.assertIsNone(self.router.db_for_read(Ad))
+        self.assertEqual(self.router.db_for_write(Ad), 'default')
+
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'ads'))
+        self.assertIsNone(self.router.allow_migrate('default', 'ads'))
+
+    @override_settings(ADS_DB_REPLICAS=[])
+    def test_disabled_without_replicas(self):
+        seen, response = self.run_request(self.factory.get('/ads/'), write=True)
+        self.assertIsNone(seen['before'])
+        self.assertNotIn(settings.ADS_REPLICA_PIN_COOKIE, response.cookies)
+
+
+
+@override_settings(ADS_DB_REPLICAS=[settings.TEST_REPLICA_ALIAS])
+class ReplicaQueriesTest(TransactionTestCase):
+    """Запросы через middleware на настоящем втором соединении — зеркале default.
+
+    TransactionTestCase: реплика — отдельное соединение и видит только
+    закоммиченные строки, как и настоящая реплика.
+    """
+    databases = {'default', settings.TEST_REPLICA_ALIAS}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='replicauser', password='testpass')
+        self.ad = Ad.objects.create(
+            user=self.user, title='Replica Ad', description='Desc', category='books', condition='used'
+        )
+        self.client.login(username='replicauser', password='testpass')
+
+    def request(self, method, url, **kwargs):
+        """Возвращает ответ и SQL, выполненный на default и на реплике."""
+        replica = connections[settings.TEST_REPLICA_ALIAS]
+        with CaptureQueriesContext(connections['default']) as primary_queries, \
+                CaptureQueriesContext(replica) as replica_queries:
+            response = getattr(self.client, method)(url, **kwargs)
+        return (
+            response,
+            ' '.join(query['sql'] for query in primary_queries),
+            ' '.join(query['sql'] for query in replica_queries),
+        )
+
+    def test_get_reads_from_replica(self):
+        response, primary_sql, replica_sql = self.request('get', reverse('ad_detail', args=[self.ad.pk]))
+        self.assertContains(response, 'Replica Ad')
+        self.assertIn('"ads_ad"', replica_sql)
+        self.assertEqual(primary_sql, '')
+        self.assertNotIn(settings.ADS_REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_get_after_post_reads_primary(self):
+        response, primary_sql, _ = self.request('post', reverse('ad_create'), data={
+            'title': 'Pinned Ad', 'description': 'Desc', 'category': 'books', 'condition': 'new',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('INSERT INTO "ads_ad"', primary_sql)
+        self.assertIn(settings.ADS_REPLICA_PIN_COOKIE, self.client.cookies)
+
+        ad = Ad.objects.get(title='Pinned Ad')
+        response, primary_sql, replica_sql = self.request('get', reverse('ad_detail', args=[ad.pk]))
+        self.assertContains(response, 'Pinned Ad')
+        self.assertIn('"ads_ad"', primary_sql)
+        self.assertEqual(replica_sql, '')
+
+    def test_no_migrations_on_replica(self):
+        self.assertFalse(router.allow_migrate_model(settings.TEST_REPLICA_ALIAS, Ad))
+        self.assertTrue(router.allow_migrate_model('default', Ad))
+
+
+class DatabaseSettingsTest(TestCase):
+    """Соединения и реплики настраиваются переменными окружения при загрузке settings."""
+
+    def load_settings(self, **env):
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'barter_platform', 'settings.py')
+        with unittest.mock.patch.dict(os.environ, env):
+            for name in ('DATABASE_POOL', 'DATABASE_CONN_MAX_AGE', 'BARTER_ASGI', 'DATABASE_REPLICA_HOSTS'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return runpy.run_path(path)
+
+    def test_persistent_connections_with_health_checks(self):
+        database = self.load_settings()['DATABASES']['default']
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+    def test_no_persistent_connections_under_asgi(self):
+        self.assertEqual(self.load_settings(BARTER_ASGI='1')['DATABASES']['default']['CONN_MAX_AGE'], 0)
+
+    def test_replicas_share_connection_settings(self):
+        namespace = self.load_settings(DATABASE_REPLICA_HOSTS='db2,db3:5433', DATABASE_CONN_MAX_AGE='30')
+        self.assertEqual(namespace['ADS_DB_REPLICAS'], ['replica1', 'replica2'])
+        replica = namespace['DATABASES']['replica2']
+        self.assertEqual((replica['HOST'], replica['PORT'], replica['CONN_MAX_AGE']), ('db3', '5433', 30))
+        self.assertEqual(replica['TEST'], {'MIRROR': 'default'})
+
+    def test_pool(self):
+        try:
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            with self.assertRaises(ImproperlyConfigured):
+                self.load_settings(DATABASE_POOL='1')
+            return
+        database = self.load_settings(DATABASE_POOL='1', DATABASE_POOL_MAX_SIZE='20')['DATABASES']['default']
+        self.assertEqual(database['OPTIONS']['pool']['max_size'], 20)
+        self.assertNotIn('CONN_MAX_AGE', database)
+
+
+ASYNC_URLCONF = ModuleType('ads.tests_async_urls')
+ASYNC_URLCONF.urlpatterns = [
+    path('ads/', async_views.ad_list),
+    path('ads/<int:pk>/', async_views.ad_detail),
+    path('proposals/', async_views.exchange_proposal_list),
+    path('api/ads/', async_views.api_ad_list),
+    path('api/ads/<int:pk>/', async_views.api_ad_detail),
+    path('', include('barter_platform.urls')),
+]
+
+
+class AsyncViewsTest(TestCase):
+    """Async-версии (ADS_ASYNC_VIEWS) отдают то же, что синхронные."""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.ads = [
+            Ad.objects.create(user=self.user1 if i % 2 else self.user2, title=f'Объявление {i}',
+                              description='x', category='books', condition='new')
+            for i in range(8)
+        ]
+        self.proposal = ExchangeProposal.objects.create(
+            ad_sender=self.ads[1], ad_receiver=self.ads[0], sender=self.user1, comment='Асинхронное предложение'
+        )
+        build_suggestion_index()  # подсказки на странице объявления — в обоих вариантах
+
+    def strip_csrf(self, content):
+        return re.sub(rb'name="csrfmiddlewaretoken" value="[^"]+"', b'', content)
+
+    async def get_both(self, url, user=None, **headers):
+        if user is not None:
+            await self.client.aforce_login(user)
+            await self.async_client.aforce_login(user)
+        expected = await sync_to_async(self.client.get)(url, **headers)
+        with override_settings(ROOT_URLCONF=ASYNC_URLCONF):
+            response = await self.async_client.get(url, **headers)
+        return expected, response
+
+    def test_urlconf_uses_async_views(self):
+        self.assertIs(resolve('/ads/', urlconf=ASYNC_URLCONF).func, async_views.ad_list)
+        self.assertIs(resolve('/api/ads/1/', urlconf=ASYNC_URLCONF).func, async_views.api_ad_detail)
+
+    async def test_html_views_match_sync(self):
+        for url in ['/ads/', '/ads/?category=books&page_size=3', f'/ads/{self.ads[0].pk}/', '/proposals/']:
+            with self.subTest(url=url):
+                expected, response = await self.get_both(url, self.user1)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.strip_csrf(response.content), self.strip_csrf(expected.content))
+        self.assertContains(response, 'Асинхронное предложение')
+
+    async def test_anonymous_and_missing(self):
+        with override_settings(ROOT_URLCONF=ASYNC_URLCONF):
+            response = await self.async_client.get('/proposals/')
+            self.assertEqual(response.status_code, 302)
+            response = await self.async_client.get('/ads/999999/')
+            self.assertEqual(response.status_code, 404)
+            response = await self.async_client.get('/ads/')
+            self.assertTrue(response.has_header('ETag'))
+
+    async def test_api_matches_drf(self):
+        for url in ['/api/ads/', '/api/ads/?page_size=3&condition=new', f'/api/ads/{self.ads[2].pk}/',
+                    '/api/ads/?fields=id,title', f'/api/ads/{self.ads[2].pk}/?omit=description']:
+            with self.subTest(url=url):
+                expected, response = await self.get_both(url)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response['ETag'], expected['ETag'])
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+
+    async def test_api_conditional_and_fallbacks(self):
+        with override_settings(ROOT_URLCONF=ASYNC_URLCONF):
+            response = await self.async_client.get('/api/ads/')
+            cached = await self.async_client.get('/api/ads/', headers={'If-None-Match': response['ETag']})
+            self.assertEqual(cached.status_code, 304)
+            response = await self.async_client.get('/api/ads/', {'cursor': 'broken'})
+            self.assertEqual(response.status_code, 404)  # ответ DRF
+            await self.async_client.aforce_login(self.user1)
+            response = await self.async_client.post('/api/ads/', {
+                'title': 'Создано через async URL', 'description': 'x', 'category': 'books', 'condition': 'new',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+
+
+class FacetsTest(TestCase):
+    def setUp(self):
+        reset_search_index()
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='testpass123')
+        for title, category, condition in [
+            ('Телефон Nokia', 'electronics', 'used'),
+            ('Телефон Samsung', 'electronics', 'new'),
+            ('Книга про телефоны', 'books', 'used'),
+            ('Книга рецептов', 'books', 'new'),
+            ('Куртка', 'clothing', 'used'),
+        ]:
+            Ad.objects.create(user=self.user, title=title, description='x', category=category, condition=condition)
+        Ad.objects.create(user=self.user, title='Телефон снят', description='x', category='electronics',
+                          condition='new', is_active=False)
+
+    def counts(self, facets, name):
+        return {item['value']: item['count'] for item in facets[name] if item['count']}
+
+    def test_counts_for_search(self):
+        match_ads(Ad.objects.all(), 'телефон')  # индекс поиска строится заранее
+        with self.assertNumQueries(1):
+            facets = get_facets({'q': 'телефон'})
+        self.assertEqual(self.counts(facets, 'category'), {'electronics': 2, 'books': 1})
+        self.assertEqual(self.counts(facets, 'condition'), {'used': 2, 'new': 1})
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(facets['category'][0], {'value': 'electronics', 'label': 'Электроника', 'count': 2})
+
+    def test_selected_filter_applies_to_other_facet(self):
+        facets = get_facets({'category': 'books', 'condition': 'used'})
+        # Категории — с учётом состояния "used", состояния — с учётом категории "books"
+        self.assertEqual(self.counts(facets, 'category'), {'electronics': 1, 'books': 1, 'clothing': 1})
+        self.assertEqual(self.counts(facets, 'condition'), {'used': 1, 'new': 1})
+        self.assertEqual(facets['total'], 1)
+
+    def test_cached_per_normalized_query(self):
+        get_facets({'q': 'Книга  рецептов'})
+        self.assertEqual(facets_cache_key('рецептов книга'), facets_cache_key('Книга  рецептов'))
+        self.assertNotEqual(facets_cache_key(''), facets_cache_key('книга'))
+        with self.assertNumQueries(0):
+            facets = get_facets({'q': 'рецептов КНИГА', 'category': 'books'})
+        self.assertEqual(facets['total'], 1)
+
+    def test_ad_list_shows_counts(self):
+        response = self.client.get(reverse('ad_list'), {'q': 'телефон'})
+        self.assertContains(response, 'Электроника (2)')
+        self.assertContains(response, '<option value="clothing" disabled>Одежда (0)</option>', html=True)
+
+    def test_api(self):
+        response = APIClient().get(reverse('ad-facets'), {'q': 'книга', 'condition': 'new'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counts(response.data, 'category'), {'books': 1})
+        self.assertEqual(self.counts(response.data, 'condition'), {'used': 1, 'new': 1})
+        self.assertEqual(response.data['total'], 1)
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='testpass123')
+        self.ad = Ad.objects.create(user=self.user, title='Телефон', description='Длинное описание ' * 50,
+                                    image_url='https://example.com/phone.jpg', category='electronics', condition='new')
+        self.client = APIClient()
+
+    def test_fields_trim_output_and_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('ad-list'), {'fields': 'id,title,category,image_url'})
+        self.assertEqual(response.json()['results'], [{
+            'id': self.ad.id, 'title': 'Телефон', 'image_url': 'https://example.com/phone.jpg', 'category': 'electronics',
+        }])
+        sql = queries.captured_queries[-1]['sql']
+        for column in ('description', 'pending_proposal_count', 'auth_user'):
+            self.assertNotIn(column, sql)
+
+    def test_omit(self):
+        response = self.client.get(reverse('ad-detail', args=[self.ad.id]), {'omit': 'description,proposal_count'})
+        self.assertEqual(list(response.json()), [
+            'id', 'user', 'title', 'image_url', 'category', 'condition', 'is_active', 'created_at',
+        ])
+        self.assertEqual(response.json()['user'], 'user1')
+
+    def test_etag_depends_on_fields(self):
+        url = reverse('ad-detail', args=[self.ad.id])
+        full = self.client.get(url)
+        sparse = self.client.get(url, {'fields': 'id,title'})
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+        response = self.client.get(url, {'fields': 'id,title'}, HTTP_IF_NONE_MATCH=sparse['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=sparse['ETag']).status_code, 200)
+
+    def test_invalid_fields(self):
+        response = self.client.get(reverse('ad-list'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['fields'])
+        response = self.client.get(reverse('ad-list'), {'fields': 'id', 'omit': 'title'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_writes_return_full_representation(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(f"{reverse('ad-detail', args=[self.ad.id])}?fields=id", {'title': 'Новый'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('description', response.json())
+
+
+class AdValuesSerializerTest(TestCase):
+    """AdValuesSerializer должен давать тот же JSON, что и AdSerializer."""
+
+    def setUp(self):
+        reset_search_index()
+        self.user = User.objects.create_user(username='владелец', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.ads = [
+            Ad.objects.create(user=self.user, title='Телефон "Nokia" <3310>', description='Строка\nс переносом',
+                              image_url='https://example.com/a.jpg?x=1&y=2', category='electronics', condition='new'),
+            Ad.objects.create(user=other, title='Книга', description='', category='books', condition='like_new'),
+            Ad.objects.create(user=other, title='Снято', description='x', category='sports', condition='used',
+                              is_active=False),
+        ]
+        ExchangeProposal.objects.create(ad_sender=self.ads[1], ad_receiver=self.ads[0], sender=other)
+        # Время без микросекунд и значение вне CATEGORY_CHOICES (старые данные)
+        Ad.objects.filter(pk=self.ads[1].pk).update(created_at=timezone.now().replace(microsecond=0),
+                                                    category='legacy')
+
+    def render_both(self, fields=None):
+        queryset = Ad.objects.order_by('-created_at', '-id')
+        expected = AdSerializer(queryset.select_related('user'), many=True, fields=fields).data
+        rows = AdValuesSerializer.values(queryset, fields)
+        renderer = JSONRenderer()
+        return renderer.render(AdValuesSerializer(rows, fields).data), renderer.render(expected)
+
+    def test_same_json(self):
+        actual, expected = self.render_both()
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(json.loads(actual)), 3)
+
+    def test_same_json_for_field_subsets(self):
+        for fields in (['id', 'title', 'category', 'image_url'], ['user', 'created_at'], []):
+            with self.subTest(fields=fields):
+                self.assertEqual(*self.render_both(fields))
+
+    def test_same_json_in_other_timezone(self):
+        with timezone.override('Europe/Moscow'):
+            actual, expected = self.render_both()
+        self.assertEqual(actual, expected)
+        self.assertIn(b'+03:00', actual)
+
+    @override_settings(USE_TZ=False, TIME_ZONE='Europe/Moscow')
+    def test_same_json_without_time_zones(self):
+        actual, expected = self.render_both()
+        self.assertEqual(actual, expected)
+        self.assertNotIn(b'+03:00', actual)
+        self.assertNotIn(b'Z"', actual)
+
+    def test_api_list_uses_values(self):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('ad-list'), {'page_size': 1})
+        self.assertNotIn('password', queries.captured_queries[-1]['sql'])
+        second = client.get(response.data['next'])
+        feed = Ad.objects.filter(is_active=True).order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual([ad['id'] for ad in response.data['results'] + second.data['results']], list(feed))
+        response = client.get(reverse('ad-list'), {'q': 'телефон'})
+        self.assertEqual(response.data['results'][0]['proposal_count'], 1)
+
+
 class UrlTests(TestCase):
     def test_ad_list_url(self):
         resolver = resolve('/ads/')
@@ -1,16 +1,25 @@
+from django.conf import settings
 from django.urls import path
 from ads import views
 
+# Под ASGI чтение ленты, объявления и списка предложений обслуживают async-версии
+read_views = views
+if settings.ADS_ASYNC_VIEWS:
+    from ads import async_views as read_views
+
 urlpatterns = [
-    path('ads/', views.ad_list, name='ad_list'),
+    path('ads/', read_views.ad_list, name='ad_list'),
     path('ads/create/', views.ad_create, name='ad_create'),
-    path('ads/<int:pk>/', views.ad_detail, name='ad_detail'),
+    path('ads/<int:pk>/', read_views.ad_detail, name='ad_detail'),
     path('ads/<int:pk>/edit/', views.ad_edit, name='ad_edit'),
     path('ads/<int:pk>/delete/', views.ad_delete, name='ad_delete'),
     path('register/', views.register, name='register'),
     path('ads/<int:ad_receiver_id>/propose/', views.exchange_proposal_create, name='exchange_proposal_create'),
-    path('proposals/', views.exchange_proposal_list, name='exchange_proposal_list'),
+    path('proposals/', read_views.exchange_proposal_list, name='exchange_proposal_list'),
+    path('proposals/inbox/', views.proposal_box, {'box': 'inbox'}, name='proposal_inbox'),
+    path('proposals/outbox/', views.proposal_box, {'box': 'outbox'}, name='proposal_outbox'),
     path('proposals/<int:pk>/update/', views.exchange_proposal_update, name='exchange_proposal_update'),
     path('notifications/mark-read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('notifications/stream/', views.notifications_stream, name='notifications_stream'),
 
 ]
\ No newline at end of file
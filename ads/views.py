@@ -1,11 +1,27 @@
+import asyncio
+import json
+import logging
+
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm
-from django.db.models import Q
-from django.core.paginator import Paginator
-from .models import Ad, ExchangeProposal, Notification
+from django.conf import settings
+from django.db import transaction
+from .models import Ad, ExchangeProposal
+from .cards import render_cards
+from .facets import get_facets
 from .forms import AdForm, ExchangeProposalForm
+from .http_cache import ad_versions, cached_page, cached_render, content_version
+from .notifications import invalidate_unread_summary, send_notifications
+from .pagination import InvalidCursor, KeysetPaginator, MergedKeysetPaginator, get_page_size, page_querystring
+from .pubsub import TooManySubscribers, get_broker
+from .search import filter_ads
+from .services import ProposalError, decide_proposal, proposal_mailbox
+from .suggestions import suggest_ads
+
+logger = logging.getLogger(__name__)
 
 
 # Константы для сообщений
@@ -26,13 +42,6 @@ ERROR_MESSAGES = {
 }
 
 
-def add_notifications_to_context(context, user):
-    """Добавляет непрочитанные уведомления в контекст для шаблонов."""
-    if user.is_authenticated:
-        context['unread_notifications'] = user.notifications.filter(is_read=False).order_by('-created_at')[:5]
-    return context
-
-
 @login_required
 def ad_create(request):
     if request.method == 'POST':
@@ -48,7 +57,7 @@ def ad_create(request):
         form = AdForm()
 
     context = {'form': form}
-    return render(request, 'ads/ad_form.html', add_notifications_to_context(context, request.user))
+    return render(request, 'ads/ad_form.html', context)
 
 
 @login_required
@@ -67,7 +76,7 @@ def ad_edit(request, pk):
     else:
         form = AdForm(instance=ad)
     context = {'form': form, 'title': 'Редактировать объявление'}
-    return render(request, 'ads/ad_form.html', add_notifications_to_context(context, request.user))
+    return render(request, 'ads/ad_form.html', context)
 
 
 @login_required
@@ -82,41 +91,64 @@ def ad_delete(request, pk):
         messages.success(request, SUCCESS_MESSAGES['ad_deleted'])
         return redirect('ad_list')
     context = {'ad': ad}
-    return render(request, 'ads/ad_delete.html', add_notifications_to_context(context, request.user))
+    return render(request, 'ads/ad_delete.html', context)
 
 
-def ad_list(request):
-    ads = Ad.objects.filter(is_active=True).order_by('-created_at')
-
-    query = request.GET.get('q')
-    category = request.GET.get('category')
-    condition = request.GET.get('condition')
-    if query:
-        ads = ads.filter(Q(title__icontains=query) | Q(description__icontains=query))
-    if category:
-        ads = ads.filter(category=category)
-    if condition:
-        ads = ads.filter(condition=condition)
-
-    paginator = Paginator(ads, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+def ad_list_queryset(request):
+    return filter_ads(Ad.objects.filter(is_active=True).select_related('user'), request.GET)
 
-    context = {
+
+def ad_list_paginator(request):
+    return KeysetPaginator(ad_list_queryset(request), get_page_size(request.GET, settings.ADS_PAGE_SIZE))
+
+
+def ad_list_context(request, page_obj):
+    return {
         'page_obj': page_obj,
-        'query': query or '',
-        'category': category or '',
-        'condition': condition or '',
-        'categories': Ad.CATEGORY_CHOICES,
-        'conditions': Ad.CONDITION_CHOICES,
+        'cards': render_cards(page_obj),
+        'next_query': page_querystring(request.GET, page_obj.next_cursor) if page_obj.has_next() else '',
+        'previous_query': page_querystring(request.GET, page_obj.previous_cursor) if page_obj.has_previous() else '',
+        'query': request.GET.get('q', ''),
+        'category': request.GET.get('category', ''),
+        'condition': request.GET.get('condition', ''),
+        'facets': get_facets(request.GET),
     }
-    return render(request, 'ads/ad_list.html', add_notifications_to_context(context, request.user))
 
 
-def ad_detail(request, pk):
-    ad = get_object_or_404(Ad, pk=pk, is_active=True)
+def ad_list_cached(request):
+    """304 или страница ленты из кэша без запросов к базе; None — страницу нужно построить."""
+    return cached_page(request, 'ads/ad_list.html', [content_version()])
+
+
+def ad_list_response(request, page_obj):
+    """Рендеринг ленты по готовой странице (ads.async_views)."""
+    return cached_render(request, 'ads/ad_list.html', ad_list_context(request, page_obj), [content_version()])
+
+
+def ad_list_page(request):
+    paginator = ad_list_paginator(request)
+    try:
+        return paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return paginator.get_page()
+
+
+def ad_list(request):
+    # Страница и счётчики фильтров считаются, только если страницы нет в кэше
+    return cached_render(request, 'ads/ad_list.html', lambda: ad_list_context(request, ad_list_page(request)),
+                         [content_version()])
+
+
+def ad_detail_response(request, ad):
     context = {'ad': ad, 'proposal_count': ad.get_proposal_count()}
-    return render(request, 'ads/ad_detail.html', add_notifications_to_context(context, request.user))
+    if request.user.is_authenticated and ad.user_id != request.user.pk:
+        context['suggestions'] = suggest_ads(ad, request.user)
+    return cached_render(request, 'ads/ad_detail.html', context,
+                         [*ad_versions([ad]), ad.user.username], last_modified=ad.updated_at)
+
+
+def ad_detail(request, pk):
+    return ad_detail_response(request, get_object_or_404(Ad.objects.select_related('user'), pk=pk, is_active=True))
 
 
 @login_required
@@ -129,11 +161,10 @@ def exchange_proposal_create(request, ad_receiver_id):
         messages.error(request, 'Нельзя предлагать обмен на своё объявление.')
         return redirect('ad_list')
 
-    # Проверяем активные объявления
-    user_ads = Ad.objects.filter(user=request.user, is_active=True)
-    ads_count = user_ads.count()
-    print(f"User={request.user.username}, Ads count={ads_count}, Ad titles={[ad.title for ad in user_ads]}")
-    if ads_count == 0:
+    # Сами объявления выберет поле формы — здесь достаточно EXISTS
+    has_ads = Ad.objects.filter(user=request.user, is_active=True).exists()
+    logger.debug('Предложение обмена: user=%s ad_receiver=%s has_ads=%s', request.user.pk, ad_receiver.pk, has_ads)
+    if not has_ads:
         messages.error(request, 'Нет активных объявлений для обмена. Создайте новое объявление или проверьте статус существующих.')
         return redirect('ad_create')
 
@@ -146,38 +177,69 @@ def exchange_proposal_create(request, ad_receiver_id):
             proposal = form.save(commit=False)
             proposal.ad_receiver = ad_receiver
             proposal.sender = request.user
-            proposal.save()
+            with transaction.atomic():  # вместе со счётчиком предложений (ads.signals)
+                proposal.save()
             messages.success(request, SUCCESS_MESSAGES['proposal_sent'])
-            Notification.objects.create(
-                user=ad_receiver.user,
-                message=f'Новое предложение обмена на "{ad_receiver.title}" от {request.user.username}.'
-            )
+            send_notifications([
+                (ad_receiver.user_id,
+                 f'Новое предложение обмена на "{ad_receiver.title}" от {request.user.username}.'),
+            ])
             return redirect('exchange_proposal_list')
         messages.error(request, 'Ошибка в форме предложения.')
     else:
-        form = ExchangeProposalForm(user=request.user)
-        print(f"Form initialized for GET: Fields={form.fields['ad_sender'].queryset.count()}")
+        # ?ad_sender= приходит из подсказок на странице объявления
+        form = ExchangeProposalForm(user=request.user, initial={'ad_sender': request.GET.get('ad_sender')})
+
+    context = {'form': form, 'ad_receiver': ad_receiver, 'has_ads': has_ads}
+    return render(request, 'ads/exchange_proposal_form.html', context)
 
-    context = {'form': form, 'ad_receiver': ad_receiver, 'has_ads': ads_count > 0}
-    print("Rendering form template")
-    return render(request, 'ads/exchange_proposal_form.html', add_notifications_to_context(context, request.user))
+
+def proposal_paginator(request, user, box, status=None):
+    page_size = get_page_size(request.GET, settings.ADS_PROPOSALS_PAGE_SIZE)
+    return MergedKeysetPaginator(proposal_mailbox(user, box, status), page_size)
+
+
+def _proposal_page(request, box, status=None):
+    paginator = proposal_paginator(request, request.user, box, status)
+    try:
+        return paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return paginator.get_page()
 
 
 @login_required
 def exchange_proposal_list(request):
-    sent_proposals = ExchangeProposal.objects.filter(sender=request.user)
-    received_proposals = ExchangeProposal.objects.filter(ad_receiver__user=request.user)
+    # Первые страницы обоих ящиков; полные списки — в proposal_box
+    context = {
+        'sent_proposals': _proposal_page(request, 'outbox'),
+        'received_proposals': _proposal_page(request, 'inbox'),
+    }
+    return render(request, 'ads/exchange_proposal_list.html', context)
+
 
+@login_required
+def proposal_box(request, box):
+    status = request.GET.get('status')
+    if status not in dict(ExchangeProposal.STATUS_CHOICES):
+        status = None
+    page_obj = _proposal_page(request, box, status)
     context = {
-        'sent_proposals': sent_proposals,
-        'received_proposals': received_proposals,
+        'box': box,
+        'incoming': box == 'inbox',
+        'page_obj': page_obj,
+        'next_query': page_querystring(request.GET, page_obj.next_cursor) if page_obj.has_next() else '',
+        'previous_query': page_querystring(request.GET, page_obj.previous_cursor) if page_obj.has_previous() else '',
+        'status': status or '',
+        'statuses': ExchangeProposal.STATUS_CHOICES,
     }
-    return render(request, 'ads/exchange_proposal_list.html', add_notifications_to_context(context, request.user))
+    return render(request, 'ads/proposal_box.html', context)
 
 
 @login_required
 def exchange_proposal_update(request, pk):
-    proposal = get_object_or_404(ExchangeProposal, pk=pk)
+    proposal = get_object_or_404(
+        ExchangeProposal.objects.select_related('sender', 'ad_sender', 'ad_receiver__user'), pk=pk
+    )
 
     # Проверка прав доступа
     if proposal.ad_receiver.user != request.user:
@@ -192,52 +254,17 @@ def exchange_proposal_update(request, pk):
             messages.error(request, 'Неверный статус.')
             return redirect('exchange_proposal_list')
 
-        # Проверка, что предложение ещё в обработке
-        if proposal.status != 'pending':
-            messages.error(request, 'Это предложение уже обработано.')
+        try:
+            decide_proposal(proposal, status)
+        except ProposalError as exc:
+            messages.error(request, str(exc))
             return redirect('exchange_proposal_list')
 
-        # Обновляем статус предложения
-        proposal.status = status
-        proposal.save()
-
-        # Обработка принятия предложения
-        if status == 'accepted':
-            # Деактивируем оба объявления
-            proposal.ad_sender.is_active = False
-            proposal.ad_sender.save()
-            proposal.ad_receiver.is_active = False
-            proposal.ad_receiver.save()
-
-            # Уведомление отправителя
-            Notification.objects.create(
-                user=proposal.sender,
-                message=f'Ваше предложение на "{proposal.ad_receiver.title}" принято. Вы получили '
-                        f'"{proposal.ad_receiver.title}" от {proposal.ad_receiver.user.username}.'
-            )
-
-            # Уведомление получателя
-            Notification.objects.create(
-                user=proposal.ad_receiver.user,
-                message=f'Вы приняли предложение от {proposal.sender.username}. Вы получили '
-                        f'"{proposal.ad_sender.title}".'
-            )
-
-            messages.success(request, 'Предложение успешно обновлено.')
-            return redirect('exchange_proposal_list')
-
-        # Обработка отклонения предложения
-        elif status == 'rejected':
-            # Уведомление только для отправителя
-            Notification.objects.create(
-                user=proposal.sender,
-                message=f'Ваше предложение на "{proposal.ad_receiver.title}" отклонено.'
-            )
-            messages.success(request, 'Предложение успешно обновлено.')
-            return redirect('exchange_proposal_list')
+        messages.success(request, 'Предложение успешно обновлено.')
+        return redirect('exchange_proposal_list')
 
     context = {'proposal': proposal}
-    return render(request, 'ads/exchange_proposal_update.html', add_notifications_to_context(context, request.user))
+    return render(request, 'ads/exchange_proposal_update.html', context)
 
 
 def register(request):
@@ -251,12 +278,54 @@ def register(request):
     else:
         form = UserCreationForm()
     context = {'form': form}
-    return render(request, 'registration/register.html', add_notifications_to_context(context, request.user))
+    return render(request, 'registration/register.html', context)
 
 
 @login_required
 def mark_notifications_read(request):
     if request.method == 'POST':
         request.user.notifications.filter(is_read=False).update(is_read=True)
+        invalidate_unread_summary(request.user.pk)
         messages.success(request, SUCCESS_MESSAGES['notifications_read'])
-    return redirect('ad_list')
\ No newline at end of file
+    return redirect('ad_list')
+
+
+async def notifications_stream(request):
+    """Server-sent events с новыми уведомлениями пользователя (рассчитано на ASGI).
+
+    Запросов к базе на соединение нет: события приходят из ads.pubsub,
+    а молчание прерывается комментариями-пингами. Соединение без событий
+    закрывается через ADS_STREAM_IDLE_TIMEOUT, браузер переподключится сам.
+    """
+    if not settings.ADS_STREAM_ENABLED:
+        # Под WSGI StreamingHttpResponse буферизует async-итератор: воркер занят до таймаута
+        raise Http404
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    try:
+        subscription = get_broker().subscribe(user.pk)
+    except TooManySubscribers:
+        return HttpResponse(status=503, headers={'Retry-After': '30'})
+
+    async def events():
+        idle = 0
+        try:
+            yield 'retry: 5000\n\n'
+            while idle < settings.ADS_STREAM_IDLE_TIMEOUT:
+                try:
+                    event = await subscription.get(timeout=settings.ADS_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    idle += settings.ADS_STREAM_HEARTBEAT
+                    yield ': ping\n\n'
+                    continue
+                idle = 0
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingHttpResponse(
+        events(),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'barter_platform.settings')
+# Включает функции, которым нужен event loop (SSE-поток уведомлений)
+os.environ.setdefault('BARTER_ASGI', '1')
 
 application = get_asgi_application()
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'ads',
     'rest_framework',
     'drf_yasg',
@@ -44,6 +49,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ads.metrics.RequestMetricsMiddleware',
+    'ads.replicas.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -64,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'ads.context_processors.notifications',
             ],
         },
     },
@@ -72,6 +80,9 @@ TEMPLATES = [
 WSGI_APPLICATION = 'barter_platform.wsgi.application'
 
 
+# Запущены ли мы под ASGI (переменную выставляет barter_platform/asgi.py)
+RUNNING_ASGI = os.environ.get('BARTER_ASGI') == '1'
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -86,6 +97,114 @@ DATABASES = {
     }
 }
 
+# Соединения с PostgreSQL. DATABASE_POOL=1 включает пул psycopg 3
+# (pip install "psycopg[binary,pool]"): он нужен под ASGI, где постоянные
+# соединения Django привязаны к потокам и не переиспользуются. Без пула
+# соединение живёт DATABASE_CONN_MAX_AGE секунд и проверяется перед
+# повторным использованием.
+if os.environ.get('DATABASE_POOL') == '1':
+    try:
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise ImproperlyConfigured('DATABASE_POOL=1 требует пакет psycopg[pool].')
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+            'max_lifetime': float(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 1800)),
+            'max_idle': float(os.environ.get('DATABASE_POOL_MAX_IDLE', 300)),
+            'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+            'check': ConnectionPool.check_connection,  # проверка при выдаче из пула
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DATABASE_CONN_MAX_AGE', 0 if RUNNING_ASGI else 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Реплики только для чтения (ads.replicas): DATABASE_REPLICA_HOSTS=host1,host2:5433.
+# DATABASE_REPLICA_NAME позволяет поднять «реплику» локально — отдельной базой
+# на том же сервере. В тестах реплики зеркалируют default.
+ADS_DB_REPLICAS = []
+for _index, _host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(','))):
+    _host, _, _port = _host.strip().partition(':')
+    _alias = f'replica{_index + 1}'
+    DATABASES[_alias] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('DATABASE_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    ADS_DB_REPLICAS.append(_alias)
+
+# Для manage.py test без реплик — зеркало default: ReplicaRoutingTest проверяет
+# маршрутизацию на отдельном соединении. ADS_DB_REPLICAS тесты задают сами.
+TEST_REPLICA_ALIAS = 'replica'
+if not ADS_DB_REPLICAS and sys.argv[1:2] == ['test']:
+    DATABASES[TEST_REPLICA_ALIAS] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['ads.replicas.ReplicaRouter']
+# Сколько секунд после записи клиент читает с основной базы (запас на отставание реплик)
+ADS_REPLICA_PIN_SECONDS = 10
+ADS_REPLICA_PIN_COOKIE = 'ads_primary'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Для нескольких процессов на одной машине подойдёт FileBasedCache:
+# {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'cache'}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'barter-platform',
+    }
+}
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+# Логгеры ads.* пишут через очередь (ads.log.QueueListenerHandler): вывод идёт
+# в фоновом потоке. Записи ниже WARNING проходят с долей из 'rates'.
+
+ADS_LOG_LEVEL = os.environ.get('ADS_LOG_LEVEL', 'INFO')  # DEBUG — отладочные сообщения views
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'ads.log.SamplingFilter',
+            'rate': 1.0,
+            'rates': {'ads.views': 1.0 if DEBUG else 0.1},
+        },
+    },
+    'formatters': {
+        'structured': {
+            '()': 'ads.log.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+        'queue': {
+            '()': 'ads.log.QueueListenerHandler',
+            'handlers': ['console'],
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        'ads': {
+            'handlers': ['queue'],
+            'level': ADS_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,4 +253,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Настройки редиректов для авторизации
 LOGIN_REDIRECT_URL = 'ad_list'  # Редирект после входа на /ads/
 LOGOUT_REDIRECT_URL = 'ad_list'  # Редирект после выхода на /ads/
-LOGIN_URL = 'login'  # URL для страницы входа
\ No newline at end of file
+LOGIN_URL = 'login'  # URL для страницы входа
+
+# Размер страниц ленты объявлений и API (переопределяется параметром ?page_size=)
+ADS_PAGE_SIZE = 5
+ADS_API_PAGE_SIZE = 20
+ADS_MAX_PAGE_SIZE = 100
+ADS_PROPOSALS_PAGE_SIZE = 10
+
+# Время жизни кэша счётчиков фильтров ленты (ads.facets), секунды
+ADS_FACETS_CACHE_TIMEOUT = 60
+
+# Максимум объявлений в одном запросе POST /api/ads/bulk/
+ADS_BULK_MAX_ITEMS = 500
+
+# Время жизни кэша сводки непрочитанных уведомлений, секунды
+ADS_NOTIFICATIONS_CACHE_TIMEOUT = 300
+
+# Уведомления создаются обработчиком очереди (manage.py process_notifications).
+# True — создавать сразу в запросе, без очереди.
+ADS_NOTIFICATIONS_EAGER = False
+ADS_NOTIFICATIONS_BATCH_SIZE = 500
+
+# Асинхронные версии читающих представлений (ads.async_views): по умолчанию
+# включены под ASGI, ADS_ASYNC_VIEWS=0/1 задаёт явно.
+ADS_ASYNC_VIEWS = os.environ.get('ADS_ASYNC_VIEWS', '1' if RUNNING_ASGI else '0') == '1'
+
+# Потоковая доставка уведомлений (SSE, /notifications/stream/).
+# Включена только под ASGI: под WSGI каждое соединение занимало бы поток.
+ADS_STREAM_ENABLED = RUNNING_ASGI
+# Уведомления из очереди создаёт отдельный процесс-обработчик, их находит только
+# ads.pubsub.PollingBroker; InProcessBroker — лишь при ADS_NOTIFICATIONS_EAGER.
+ADS_PUBSUB_BACKEND = 'ads.pubsub.InProcessBroker' if ADS_NOTIFICATIONS_EAGER else 'ads.pubsub.PollingBroker'
+ADS_STREAM_MAX_CONNECTIONS = 5000
+ADS_STREAM_MAX_PER_USER = 5
+ADS_STREAM_QUEUE_SIZE = 20
+ADS_STREAM_HEARTBEAT = 15  # секунды между комментариями-пингами
+ADS_STREAM_IDLE_TIMEOUT = 300  # соединение без событий закрывается, клиент переподключится
+ADS_STREAM_POLL_INTERVAL = 2  # только для PollingBroker
+
+# Поиск цепочек обмена (ads.matching): максимальная длина цикла,
+# число возвращаемых цепочек, бюджет обхода графа на один запрос и возраст
+# графа в секундах, после которого он перестраивается (изменения из других процессов)
+ADS_MATCHING_MAX_LENGTH = 4
+ADS_MATCHING_MAX_RESULTS = 20
+ADS_MATCHING_MAX_VISITS = 200000
+ADS_MATCHING_REFRESH = 300
+
+# Подбор объявлений для обмена (ads.suggestions): размерность hashed TF-IDF,
+# число подсказок и период перестроения индекса в фоновом потоке процесса, секунды.
+# ADS_SUGGESTIONS_INDEX_PATH — файл индекса от manage.py build_suggestions (по cron);
+# если он задан, процессы индекс только читают.
+ADS_SUGGESTIONS_DIMENSIONS = 256
+ADS_SUGGESTIONS_LIMIT = 5
+ADS_SUGGESTIONS_REFRESH = 600
+ADS_SUGGESTIONS_INDEX_PATH = os.environ.get('ADS_SUGGESTIONS_INDEX_PATH', '')
+
+# HTTP-кэш ленты и страниц объявлений (ads.http_cache): время жизни готовых
+# страниц для анонимных пользователей и версия, которую увеличивают при
+# изменении шаблонов, чтобы сбросить ETag у клиентов.
+ADS_PAGE_CACHE_TIMEOUT = 300
+# Время жизни отрендеренных карточек ленты (ads.cards)
+ADS_CARD_CACHE_TIMEOUT = 24 * 60 * 60
+ADS_HTTP_CACHE_VERSION = 1
+
+# Метрики запросов (ads.metrics): доля замеряемых запросов, заголовок
+# Server-Timing и пороги, после которых запрос пишется в лог ads.metrics
+ADS_METRICS_SAMPLE_RATE = float(os.environ.get('ADS_METRICS_SAMPLE_RATE', 1.0 if DEBUG else 0.05))
+ADS_METRICS_SERVER_TIMING = True
+ADS_METRICS_SLOW_MS = 500
+ADS_METRICS_SLOW_QUERIES = 30
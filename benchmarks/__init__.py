@@ -0,0 +1 @@
+"""Бенчмарки платформы. Запуск: ``python -m benchmarks.<имя> --help``."""
@@ -0,0 +1,74 @@
+"""Бенчмарк рендеринга ленты: карточки без кэша и из кэша (ads.cards).
+
+Объявления создаются в памяти, база не нужна.
+
+    python -m benchmarks.ad_cards --cards 20 --iterations 500
+"""
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=20, help='Карточек на странице.')
+    parser.add_argument('--iterations', type=int, default=500)
+    options = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'barter_platform.settings')
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.template.loader import render_to_string
+    from django.utils import timezone
+
+    from ads.cards import card_key, render_cards
+    from ads.models import Ad
+    from ads.pagination import CursorPage
+
+    viewer = User(pk=1, username='viewer')
+    owners = [User(pk=pk, username=f'user{pk}') for pk in range(1, 6)]
+    now = timezone.now()
+    ads = [
+        Ad(pk=pk, user=owners[pk % len(owners)], title=f'Объявление {pk}', description='Описание ' * 20,
+           category=Ad.CATEGORY_CHOICES[pk % 5][0], condition=Ad.CONDITION_CHOICES[pk % 3][0],
+           image_url='https://example.com/image.jpg' if pk % 2 else None, created_at=now, updated_at=now)
+        for pk in range(1, options.cards + 1)
+    ]
+
+    def render_page():
+        context = {
+            'page_obj': CursorPage(ads, None, None),
+            'cards': render_cards(ads),
+            'user': viewer,
+            'csrf_token': 'benchmark',
+            'categories': Ad.CATEGORY_CHOICES,
+            'conditions': Ad.CONDITION_CHOICES,
+        }
+        return render_to_string('ads/ad_list.html', context)
+
+    def measure(cold):
+        timings = []
+        for _ in range(options.iterations):
+            if cold:
+                cache.delete_many([card_key(ad.pk) for ad in ads])
+            start = time.perf_counter()
+            render_page()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    render_page()  # прогрев загрузчика шаблонов
+    results = {'без кэша карточек': measure(cold=True), 'карточки из кэша': measure(cold=False)}
+    for name, timings in results.items():
+        timings.sort()
+        print(f'{name}: p50 {statistics.median(timings):.2f} мс, p95 {timings[int(len(timings) * 0.95)]:.2f} мс')
+    cold, warm = (statistics.median(timings) for timings in results.values())
+    print(f'ускорение рендеринга ленты: {cold / warm:.1f}x ({options.cards} карточек)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Пропускная способность читающих эндпоинтов: WSGI, ASGI с синхронными и с async-представлениями.
+
+В процессе (по умолчанию) создаётся тестовая база, и одни и те же запросы
+вошедших пользователей выполняются с ``--concurrency`` одновременными
+запросами тремя способами:
+
+* WSGI — тестовый клиент Django в пуле потоков (как gunicorn --threads);
+* ASGI, синхронные представления — AsyncClient, каждый запрос уходит в поток;
+* ASGI, ads.async_views — AsyncClient, ORM через async API.
+
+Так сравнивается сам путь обработки запроса, без накладных расходов сервера.
+Для сравнения под настоящими серверами запустите приложение, например
+``uvicorn barter_platform.asgi:application --workers 1`` и
+``gunicorn barter_platform.wsgi --threads 32``, и передайте адрес:
+
+    python -m benchmarks.async_views --concurrency 64
+    python -m benchmarks.async_views --url http://127.0.0.1:8000/ads/ --concurrency 256
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+import django
+
+ENDPOINTS = ['ad_list', 'ad_detail', 'exchange_proposal_list', 'ad-list', 'ad-detail']
+
+
+def summary(name, timings, elapsed):
+    timings = sorted(timings)
+    return (f'{name:42} {len(timings) / elapsed:9.1f} {statistics.median(timings) * 1000:8.2f}м '
+            f'{timings[int(len(timings) * 0.95)] * 1000:8.2f}м')
+
+
+def async_urlconf():
+    from django.urls import include, path
+
+    from ads import async_views
+
+    module = ModuleType('benchmarks.async_urls')
+    module.urlpatterns = [
+        path('ads/', async_views.ad_list),
+        path('ads/<int:pk>/', async_views.ad_detail),
+        path('proposals/', async_views.exchange_proposal_list),
+        path('api/ads/', async_views.api_ad_list),
+        path('api/ads/<int:pk>/', async_views.api_ad_detail),
+        path('', include('barter_platform.urls')),
+    ]
+    return module
+
+
+def run_wsgi(users, urls, requests, concurrency):
+    from django.test import Client
+
+    clients = []
+    for index in range(concurrency):
+        client = Client()
+        client.force_login(users[index % len(users)])
+        clients.append(client)
+
+    def worker(index):
+        client, timings = clients[index], []
+        for number in range(requests // concurrency):
+            start = time.perf_counter()
+            response = client.get(urls[number % len(urls)])
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+        return timings
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))  # прогрев
+        start = time.perf_counter()
+        results = list(executor.map(worker, range(concurrency)))
+    return [t for timings in results for t in timings], time.perf_counter() - start
+
+
+async def run_asgi(users, urls, requests, concurrency):
+    from django.test import AsyncClient
+
+    clients = []
+    for index in range(concurrency):
+        client = AsyncClient()
+        await client.aforce_login(users[index % len(users)])
+        clients.append(client)
+
+    async def worker(index):
+        client, timings = clients[index], []
+        for number in range(requests // concurrency):
+            start = time.perf_counter()
+            response = await client.get(urls[number % len(urls)])
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+        return timings
+
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))  # прогрев
+    start = time.perf_counter()
+    results = await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    return [t for timings in results for t in timings], time.perf_counter() - start
+
+
+def run_in_process(options):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'barter_platform.settings')
+    django.setup()
+
+    from asgiref.sync import async_to_sync
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+    from django.urls import reverse
+
+    from benchmarks.fixtures import seed
+
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    metrics_off = override_settings(ADS_METRICS_SAMPLE_RATE=0.0)  # одинаково для всех режимов
+    metrics_off.enable()
+    try:
+        data = seed(options.users, options.ads, options.proposals, 0, options.seed)
+        users = list(User.objects.filter(pk__in=data['users'][:options.concurrency]))
+        ad_id = data['ads'][len(data['ads']) // 2]
+        urls = {
+            'ad_list': reverse('ad_list'),
+            'ad_detail': reverse('ad_detail', args=[ad_id]),
+            'exchange_proposal_list': reverse('exchange_proposal_list'),
+            'ad-list': reverse('ad-list'),
+            'ad-detail': reverse('ad-detail', args=[ad_id]),
+        }
+        urls = [urls[name] for name in options.endpoints.split(',')]
+        print(f'{connection.vendor}, {options.requests} запросов по {len(urls)} эндпоинтам, '
+              f'одновременно {options.concurrency}', file=sys.stderr)
+        print(f'{"режим":42} {"запр./с":>9} {"p50":>9} {"p95":>9}')
+
+        print(summary('WSGI, потоки', *run_wsgi(users, urls, options.requests, options.concurrency)))
+
+        async def asgi_modes():
+            print(summary('ASGI, синхронные представления',
+                          *await run_asgi(users, urls, options.requests, options.concurrency)))
+            with override_settings(ROOT_URLCONF=async_urlconf()):
+                print(summary('ASGI, ads.async_views',
+                              *await run_asgi(users, urls, options.requests, options.concurrency)))
+
+        # async_to_sync из главного потока: thread_sensitive-код (ORM) выполняется в нём же
+        async_to_sync(asgi_modes)()
+    finally:
+        metrics_off.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def run_http(options):
+    """Нагрузка на запущенный сервер (uvicorn, gunicorn): ``--concurrency`` потоков по ``--url``."""
+
+    def worker(_):
+        timings = []
+        for _ in range(options.requests // options.concurrency):
+            start = time.perf_counter()
+            with urllib.request.urlopen(options.url) as response:
+                response.read()
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    with ThreadPoolExecutor(options.concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(worker, range(options.concurrency)))
+    print(summary(options.url, [t for timings in results for t in timings], time.perf_counter() - start))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--ads', type=int, default=5000)
+    parser.add_argument('--proposals', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Имена URL через запятую.')
+    parser.add_argument('--url', help='Нагружать запущенный сервер вместо запуска в процессе.')
+    options = parser.parse_args(argv)
+    if options.url:
+        run_http(options)
+    else:
+        run_in_process(options)
+
+
+if __name__ == '__main__':
+    main()
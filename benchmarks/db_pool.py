@@ -0,0 +1,132 @@
+"""Пропускная способность ad_list без постоянных соединений, с ними и с пулом.
+
+Настройки соединений читаются при старте Django, поэтому каждый режим
+запускается в отдельном процессе с нужными переменными окружения
+(DATABASE_CONN_MAX_AGE / DATABASE_POOL, см. settings). Внутри процесса
+создаётся тестовая база, заполняется benchmarks.fixtures, и ``--concurrency``
+потоков параллельно запрашивают ленту от имени вошедших пользователей
+(анонимная лента отдавалась бы из кэша страниц, минуя базу).
+
+Имеет смысл против локального PostgreSQL: на SQLite соединение открывается
+почти бесплатно, а режим pool недоступен.
+
+    DJANGO_SETTINGS_MODULE=barter_platform.settings \\
+        python -m benchmarks.db_pool --requests 2000 --concurrency 16
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+MODES = {
+    'без постоянных': {'DATABASE_CONN_MAX_AGE': '0'},
+    'CONN_MAX_AGE=60': {'DATABASE_CONN_MAX_AGE': '60'},
+    'пул psycopg': {'DATABASE_POOL': '1'},
+}
+
+
+def run_mode(options):
+    """Выполняется в дочернем процессе: печатает одну строку JSON с результатом."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'barter_platform.settings')
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.urls import reverse
+
+    from benchmarks.fixtures import seed
+
+    opened = []
+    lock = threading.Lock()
+
+    def count_connection(sender, **kwargs):
+        with lock:
+            opened.append(1)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        data = seed(options.users, options.ads, 0, 0, options.seed)
+        users = list(User.objects.filter(pk__in=data['users'][:options.concurrency]))
+        url = reverse('ad_list')
+        local = threading.local()
+
+        def worker(count):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                local.client.force_login(users[threading.get_ident() % len(users)])
+            timings = []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = local.client.get(url)
+                timings.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f'HTTP {response.status_code}')
+            return timings
+
+        with ThreadPoolExecutor(options.concurrency) as executor:
+            list(executor.map(worker, [options.warmup] * options.concurrency))  # логин и прогрев
+            connection_created.connect(count_connection)
+            per_worker = options.requests // options.concurrency
+            start = time.perf_counter()
+            results = list(executor.map(worker, [per_worker] * options.concurrency))
+            elapsed = time.perf_counter() - start
+            connection_created.disconnect(count_connection)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    timings = sorted(t for worker_timings in results for t in worker_timings)
+    print(json.dumps({
+        'rps': round(len(timings) / elapsed, 1),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95)] * 1000, 3),
+        'connections': len(opened),
+        'database': connection.vendor,
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--ads', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--modes', default=','.join(MODES), help='Режимы через запятую.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.child:
+        return run_mode(options)
+
+    child_args = [
+        f'--{name}={getattr(options, name)}' for name in ('users', 'ads', 'requests', 'concurrency', 'warmup', 'seed')
+    ]
+    print(f'{"режим":20} {"запр./с":>9} {"p50":>9} {"p95":>9} {"соединений":>11}')
+    for mode in options.modes.split(','):
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.db_pool', '--child', *child_args],
+            env={**os.environ, **MODES[mode]}, capture_output=True, text=True,
+        )
+        if result.returncode:
+            error = (result.stderr.strip().splitlines() or ['?'])[-1]
+            print(f'{mode:20} пропущен: {error}')
+            continue
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f'{mode:20} {row["rps"]:9.1f} {row["p50_ms"]:8.2f}м {row["p95_ms"]:8.2f}м {row["connections"]:11d}'
+              f'  ({row["database"]})')
+
+
+if __name__ == '__main__':
+    main()
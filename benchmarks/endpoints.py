@@ -0,0 +1,202 @@
+"""Бенчмарк HTML- и API-эндпоинтов через тестовый клиент Django.
+
+Создаёт отдельную тестовую базу (как ``manage.py test``), заполняет её
+генератором из benchmarks.fixtures и для каждого эндпоинта меряет
+перцентили времени ответа, число SQL-запросов и пик памяти Python.
+Результат печатается таблицей и, с ``--json``, сохраняется для сравнения
+между коммитами (``--compare`` с предыдущим файлом).
+
+    DJANGO_SETTINGS_MODULE=barter_platform.settings \\
+        python -m benchmarks.endpoints --ads 20000 --json bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import django
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def deep_cursor(pages, page_size):
+    """Курсор страницы ленты номер ``pages`` (как при последовательном листании)."""
+    from ads.models import Ad
+    from ads.pagination import KeysetPaginator
+
+    paginator = KeysetPaginator(Ad.objects.filter(is_active=True).order_by('-created_at'), page_size)
+    cursor = None
+    for _ in range(pages):
+        page = paginator.get_page(cursor)
+        if not page.has_next():
+            break
+        cursor = page.next_cursor
+    return cursor
+
+
+def build_endpoints(data, deep_pages):
+    """Список (название, анонимный запрос?, url, параметры)."""
+    from django.conf import settings
+    from django.urls import reverse
+
+    ad_id = data['ads'][len(data['ads']) // 2]
+    return [
+        ('ad_list', False, reverse('ad_list'), {}),
+        ('ad_list (аноним, кэш страниц)', True, reverse('ad_list'), {}),
+        ('ad_list ?q=', False, reverse('ad_list'), {'q': 'телефон'}),
+        ('ad_list ?category=&condition=', False, reverse('ad_list'), {'category': 'books', 'condition': 'used'}),
+        (f'ad_list, страница {deep_pages}', False, reverse('ad_list'),
+         {'cursor': deep_cursor(deep_pages, settings.ADS_PAGE_SIZE)}),
+        ('ad_detail', False, reverse('ad_detail', args=[ad_id]), {}),
+        ('exchange_proposal_list', False, reverse('exchange_proposal_list'), {}),
+        ('GET /api/ads/', False, reverse('ad-list'), {}),
+        ('GET /api/ads/?q=', False, reverse('ad-list'), {'q': 'телефон'}),
+        (f'GET /api/ads/, страница {deep_pages}', False, reverse('ad-list'),
+         {'cursor': deep_cursor(deep_pages, settings.ADS_API_PAGE_SIZE)}),
+        ('GET /api/ads/{id}/', False, reverse('ad-detail', args=[ad_id]), {}),
+        # Выборочные поля (?fields=/?omit=) против полного AdSerializer на большой странице
+        ('GET /api/ads/?page_size=100', False, reverse('ad-list'), {'page_size': 100}),
+        ('GET /api/ads/?page_size=100&fields=', False, reverse('ad-list'),
+         {'page_size': 100, 'fields': 'id,title,category,image_url'}),
+        ('GET /api/ads/?page_size=100&omit=', False, reverse('ad-list'),
+         {'page_size': 100, 'omit': 'description,proposal_count'}),
+        ('GET /api/proposals/', False, reverse('exchangeproposal-list'), {}),
+        ('GET /api/proposals/inbox/?status=', False, reverse('exchangeproposal-inbox'), {'status': 'pending'}),
+        ('proposal_outbox', False, reverse('proposal_outbox'), {}),
+    ]
+
+
+def measure(client, url, params, iterations, warmup):
+    from django.db import connection, reset_queries
+    from django.test.utils import CaptureQueriesContext
+
+    for _ in range(warmup):
+        client.get(url, params)
+
+    reset_queries()  # иначе сигнал request_started обнулит журнал посреди замера
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, params)
+    if response.status_code != 200:
+        raise RuntimeError(f'{url} {params}: HTTP {response.status_code}')
+
+    tracemalloc.start()
+    client.get(url, params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        client.get(url, params)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': len(queries.captured_queries),
+        'sql_ms': round(sum(float(query['time']) for query in queries.captured_queries) * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_kb': round(len(response.content) / 1024, 1),
+    }
+
+
+def print_table(results, baseline=None):
+    header = f'{"эндпоинт":40} {"p50":>8} {"p95":>8} {"p99":>8} {"SQL":>5} {"память":>9} {"ответ":>9}'
+    print(header)
+    print('-' * len(header))
+    for name, row in results.items():
+        line = (f'{name:40} {row["p50_ms"]:7.2f}м {row["p95_ms"]:7.2f}м {row["p99_ms"]:7.2f}м '
+                f'{row["queries"]:5d} {row["peak_memory_kb"]:7.0f}КБ {row["response_kb"]:7.1f}КБ')
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = (row['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+            line += f'  p50 {change:+.0f}%'
+            if row['queries'] != previous['queries']:
+                line += f', запросов {previous["queries"]} -> {row["queries"]}'
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--ads', type=int, default=10000)
+    parser.add_argument('--proposals', type=int, default=10000)
+    parser.add_argument('--notifications', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--deep-pages', type=int, default=50, help='Глубина страницы для keyset-пагинации.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', help='Запускать только эндпоинты, в названии которых есть эта строка.')
+    parser.add_argument('--json', help='Куда сохранить результаты в JSON.')
+    parser.add_argument('--compare', help='JSON предыдущего запуска для сравнения.')
+    options = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'barter_platform.settings')
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from benchmarks.fixtures import seed
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        start = time.perf_counter()
+        data = seed(options.users, options.ads, options.proposals, options.notifications, options.seed)
+        print(f'данные: {options.users} польз., {options.ads} объявлений, {options.proposals} предложений, '
+              f'{options.notifications} уведомлений за {time.perf_counter() - start:.1f} с '
+              f'({connection.vendor})', file=sys.stderr)
+
+        anonymous, member = Client(), Client()
+        member.force_login(User.objects.get(pk=data['users'][0]))
+        results = {}
+        for name, is_anonymous, url, params in build_endpoints(data, options.deep_pages):
+            if options.only and options.only not in name:
+                continue
+            client = anonymous if is_anonymous else member
+            results[name] = measure(client, url, params, options.iterations, options.warmup)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    baseline = None
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as stream:
+            baseline = json.load(stream)['results']
+    print_table(results, baseline)
+
+    if options.json:
+        report = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'options': vars(options),
+            'results': results,
+        }
+        with open(options.json, 'w', encoding='utf-8') as stream:
+            json.dump(report, stream, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Быстрый генератор реалистичного набора данных для бенчмарков.
+
+Всё создаётся через bulk_create пачками, поэтому сигналы не срабатывают:
+счётчики предложений пересчитываются одним UPDATE, а индексы в памяти
+(поиск, граф обменов, подсказки) сбрасываются и строятся заново при первом
+обращении.
+"""
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ads.management.commands.repair_proposal_counts import actual_pending_count
+from ads.matching import get_matching_graph
+from ads.models import Ad, ExchangeProposal, Notification
+from ads.search import PostgresSearchBackend, get_search_backend
+from ads.suggestions import build_suggestion_index
+
+PASSWORD = 'benchmark'
+
+ITEMS = {
+    'electronics': ['телефон', 'ноутбук', 'наушники', 'планшет', 'фотоаппарат', 'колонка'],
+    'clothing': ['куртка', 'кроссовки', 'платье', 'свитер', 'джинсы', 'шапка'],
+    'books': ['роман', 'учебник', 'словарь', 'комикс', 'энциклопедия', 'сборник'],
+    'sports': ['велосипед', 'мяч', 'гантели', 'ролики', 'палатка', 'лыжи'],
+    'other': ['лампа', 'стул', 'горшок', 'пазл', 'гитара', 'часы'],
+}
+ADJECTIVES = ['новый', 'старый', 'красный', 'большой', 'маленький', 'удобный', 'редкий', 'детский']
+PHRASES = [
+    'Отдам в хорошие руки.', 'Почти не пользовались.', 'Есть следы использования.',
+    'Самовывоз из центра.', 'Рассмотрю обмен на технику.', 'Полный комплект.',
+]
+
+
+def seed(users=200, ads=5000, proposals=5000, notifications=5000, seed_value=1, batch_size=2000):
+    """Заполняет базу и возвращает {'users': [...], 'ads': [...]} с id созданных строк."""
+    rng = random.Random(seed_value)
+    now = timezone.now()
+    categories = [value for value, _ in Ad.CATEGORY_CHOICES]
+    conditions = [value for value, _ in Ad.CONDITION_CHOICES]
+
+    with transaction.atomic():
+        password = make_password(PASSWORD)  # один хеш на всех: хеширование — самое медленное место
+        user_objs = User.objects.bulk_create(
+            [User(username=f'bench{i}', password=password) for i in range(users)], batch_size=batch_size
+        )
+        user_ids = [user.pk for user in user_objs]
+
+        ad_rows = []
+        for _ in range(ads):
+            category = rng.choice(categories)
+            item = rng.choice(ITEMS[category])
+            ad_rows.append(Ad(
+                user_id=rng.choice(user_ids),
+                title=f'{rng.choice(ADJECTIVES).capitalize()} {item}',
+                description=' '.join(rng.sample(PHRASES, 3)),
+                category=category,
+                condition=rng.choice(conditions),
+            ))
+        ad_objs = Ad.objects.bulk_create(ad_rows, batch_size=batch_size)
+        # auto_now_add перезаписывает created_at при вставке — разносим даты по минуте отдельно
+        for index, ad in enumerate(ad_objs):
+            ad.created_at = ad.updated_at = now - timedelta(minutes=len(ad_objs) - index)
+        Ad.objects.bulk_update(ad_objs, ['created_at', 'updated_at'], batch_size=batch_size)
+
+        ads_by_user = {}
+        for ad in ad_objs:
+            ads_by_user.setdefault(ad.user_id, []).append(ad.pk)
+        owners = list(ads_by_user)
+        proposal_rows = []
+        for _ in range(proposals):
+            sender, receiver = rng.sample(owners, 2)
+            proposal_rows.append(ExchangeProposal(
+                sender_id=sender,
+                receiver_id=receiver,  # bulk_create не вызывает save(), заполняем сами
+                ad_sender_id=rng.choice(ads_by_user[sender]),
+                ad_receiver_id=rng.choice(ads_by_user[receiver]),
+                comment='Давайте меняться',
+                status=rng.choices(['pending', 'accepted', 'rejected'], weights=[6, 1, 3])[0],
+            ))
+        ExchangeProposal.objects.bulk_create(proposal_rows, batch_size=batch_size)
+
+        Notification.objects.bulk_create(
+            [
+                Notification(user_id=rng.choice(user_ids), message=f'Уведомление {i}', is_read=rng.random() < 0.7)
+                for i in range(notifications)
+            ],
+            batch_size=batch_size,
+        )
+        Ad.objects.update(pending_proposal_count=actual_pending_count())
+        if connection.vendor == 'postgresql':
+            Ad.objects.update(search_vector=PostgresSearchBackend().vector())
+
+    reset_indexes()
+    return {'users': user_ids, 'ads': [ad.pk for ad in ad_objs]}
+
+
+def reset_indexes():
+    backend = get_search_backend()
+    if hasattr(backend, 'reset'):
+        backend.reset()
+    get_matching_graph().reset()
+    build_suggestion_index()  # в запросе индекс не строится
+    cache.clear()
@@ -0,0 +1,105 @@
+"""Бенчмарк поиска цепочек обмена (ads.matching) на синтетическом графе.
+
+База не нужна: граф заполняется напрямую через MatchingGraph.load.
+
+    python -m benchmarks.matching --ads 1000000 --users 200000
+"""
+import argparse
+import random
+import resource
+import statistics
+import time
+
+from ads.matching import MatchingGraph
+
+CATEGORIES = ['electronics', 'clothing', 'books', 'sports', 'other']
+CONDITIONS = ['new', 'used', 'like_new']
+
+
+def generate(ads, users, proposals, wishes, seed):
+    rng = random.Random(seed)
+    ad_rows = [
+        (ad_id, rng.randrange(1, users + 1), rng.choice(CATEGORIES), rng.choice(CONDITIONS))
+        for ad_id in range(1, ads + 1)
+    ]
+    proposal_rows = [
+        (proposal_id, rng.randrange(1, users + 1), rng.randrange(1, ads + 1))
+        for proposal_id in range(1, proposals + 1)
+    ]
+    wish_rows = [
+        (wish_id, rng.randrange(1, users + 1), rng.choice(CATEGORIES), rng.choice(CONDITIONS + [None]))
+        for wish_id in range(1, wishes + 1)
+    ]
+    return ad_rows, proposal_rows, wish_rows
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ads', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--proposals', type=int, default=500_000)
+    parser.add_argument('--wishes', type=int, default=2_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=100_000)
+    parser.add_argument('--max-length', type=int, default=4)
+    parser.add_argument('--max-results', type=int, default=20)
+    parser.add_argument('--max-visits', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args(argv)
+
+    rss_before = max_rss_mb()
+    ad_rows, proposal_rows, wish_rows = generate(
+        options.ads, options.users, options.proposals, options.wishes, options.seed
+    )
+    graph = MatchingGraph()
+    _, build_ms = timed(graph.load, ad_rows, proposal_rows, wish_rows)
+    print(f'граф: {options.ads} объявлений, {options.proposals} предложений, {options.wishes} пожеланий')
+    print(f'построение: {build_ms:.0f} мс, пик памяти процесса: {max_rss_mb() - rss_before:.0f} МБ (вместе с исходными данными)')
+
+    # Точечные обновления: снять объявление и вернуть, отклонить и снова создать предложение
+    rng = random.Random(options.seed + 1)
+    start = time.perf_counter()
+    for _ in range(options.updates // 2):
+        ad_id, user_id, category, condition = ad_rows[rng.randrange(len(ad_rows))]
+        graph.remove_ads([ad_id])
+        graph.load(ads=[(ad_id, user_id, category, condition)])
+        proposal = proposal_rows[rng.randrange(len(proposal_rows))]
+        graph.remove_proposals([proposal[0]])
+        graph.load(proposals=[proposal])
+    update_us = (time.perf_counter() - start) * 1e6 / (options.updates * 2)
+    print(f'точечное обновление: {update_us:.1f} мкс в среднем')
+
+    latencies, found, truncated = [], 0, 0
+    for _ in range(options.queries):
+        ad_id = rng.randrange(1, options.ads + 1)
+        (cycles, exhausted), elapsed = timed(
+            graph.find_cycles, ad_id, options.max_length, options.max_results, options.max_visits
+        )
+        latencies.append(elapsed)
+        found += bool(cycles)
+        truncated += exhausted
+    print(
+        f'поиск циклов (k={options.max_length}): p50 {statistics.median(latencies):.1f} мс, '
+        f'p95 {percentile(latencies, 0.95):.1f} мс, p99 {percentile(latencies, 0.99):.1f} мс, '
+        f'max {max(latencies):.1f} мс'
+    )
+    print(f'найдены циклы: {found}/{options.queries}, бюджет исчерпан: {truncated}/{options.queries}')
+
+
+if __name__ == '__main__':
+    main()
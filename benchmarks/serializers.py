@@ -0,0 +1,75 @@
+"""Пропускная способность сериализации объявлений: AdSerializer и AdValuesSerializer.
+
+Создаёт тестовую базу с ``--ads`` объявлениями (benchmarks.fixtures) и меряет
+отдельно сериализацию уже загруженных строк и весь путь «запрос + сериализация
++ JSON», как в AdViewSet.list. Перед замером проверяет, что JSON совпадает.
+
+    python -m benchmarks.serializers --ads 10000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--ads', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'barter_platform.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from rest_framework.renderers import JSONRenderer
+
+    from ads.models import Ad
+    from ads.serializers import AdSerializer, AdValuesSerializer
+    from benchmarks.fixtures import seed
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        seed(options.users, options.ads, 0, 0, options.seed)
+        queryset = Ad.objects.order_by('-created_at', '-id')
+        renderer = JSONRenderer()
+        instances = list(queryset.select_related('user'))
+        rows = list(AdValuesSerializer.values(queryset))
+        if renderer.render(AdValuesSerializer(rows).data) != renderer.render(AdSerializer(instances, many=True).data):
+            raise SystemExit('JSON AdValuesSerializer не совпадает с AdSerializer')
+
+        cases = [
+            ('AdSerializer, сериализация', lambda: AdSerializer(instances, many=True).data),
+            ('AdValuesSerializer, сериализация', lambda: AdValuesSerializer(rows).data),
+            ('AdSerializer, запрос + JSON', lambda: renderer.render(
+                AdSerializer(list(queryset.select_related('user')), many=True).data)),
+            ('AdValuesSerializer, запрос + JSON', lambda: renderer.render(
+                AdValuesSerializer(list(AdValuesSerializer.values(queryset))).data)),
+        ]
+        print(f'{len(rows)} объявлений, лучшее из {options.repeat} ({connection.vendor})', file=sys.stderr)
+        print(f'{"вариант":36} {"мс":>9} {"объявл./с":>11}')
+        for name, func in cases:
+            elapsed = best_of(options.repeat, func)
+            print(f'{name:36} {elapsed * 1000:9.1f} {len(rows) / elapsed:11.0f}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()